@@ -5,6 +5,8 @@ from huggingface_hub import login
 
 import os
 
+from utils.corpus import load_corpus
+
 # Login
 token = os.getenv("HF_TOKEN")
 if token:
@@ -23,9 +25,9 @@ mode = args.mode
 size = args.size
 
 # Load the data
-path = f"Data/PACS_varying_lengths/{mode}_combined_{length}.csv"
+path = f"Data/PACS_varying_lengths/{mode}_combined_{length}"
 
-data = pd.read_csv(path, sep='\t')
+data = load_corpus(path)
 
 # Login
 login(token=token)
@@ -0,0 +1,44 @@
+import os
+import argparse
+from functools import partial
+
+import pandas as pd
+import torch
+from torch.utils.data import DataLoader
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+from utils.corpus import load_corpus
+from utils.dataset import TokenizedDataset, LengthBucketBatchSampler, collate_tokens
+from utils.acceleration import benchmark_configurations
+
+# Parse arguments
+parser = argparse.ArgumentParser(description="Benchmark training throughput with and without bf16 autocast, torch.compile and fused AdamW")
+parser.add_argument("--model_id", type=str, default="roberta-base", help="Model to benchmark")
+parser.add_argument("--data", type=str, default="/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/train_PACS", help="Corpus artifact to draw batches from")
+parser.add_argument("--max_len", type=int, default=512, help="Maximum sequence length")
+parser.add_argument("--batch_size", type=int, default=16, help="Batch size")
+parser.add_argument("--steps", type=int, default=20, help="Timed steps per configuration")
+parser.add_argument("--warmup", type=int, default=3, help="Untimed warm-up steps per configuration")
+parser.add_argument("--output", type=str, default="Outputs/benchmarks", help="Folder for the results")
+args = parser.parse_args()
+
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+# Load data
+data = load_corpus(args.data, columns=["text", "label"])
+data["label"] = data["label"].astype(int) - 1 # Convert labels to 0, 1, 2
+tokenizer = AutoTokenizer.from_pretrained(args.model_id)
+dataset = TokenizedDataset(data, tokenizer=tokenizer, max_len=args.max_len)
+loader = DataLoader(dataset, batch_sampler=LengthBucketBatchSampler(dataset.lengths(), args.batch_size, shuffle=True),
+                    collate_fn=partial(collate_tokens, pad_token_id=tokenizer.pad_token_id))
+
+# Benchmark every configuration
+model = AutoModelForSequenceClassification.from_pretrained(args.model_id, num_labels=3)
+results = benchmark_configurations(model, torch.optim.AdamW, torch.nn.CrossEntropyLoss(), loader, device,
+                                   steps=args.steps, warmup=args.warmup)
+
+# Save and print results, fastest first
+results = pd.DataFrame(results).sort_values("samples_per_s", ascending=False)
+os.makedirs(args.output, exist_ok=True)
+results.to_csv(f"{args.output}/benchmark_{args.model_id.replace('/', '_')}_{os.uname().nodename}.csv", index=False)
+print(results.to_string(index=False))
@@ -1,22 +1,24 @@
 import pandas as pd
 from utils.preprocessing.transcript import load_data_with_labels
+from utils.splits import select_split, split_documents, PACS_DATA_DIR, PACS_TRAIN_TEST_SPLITS_PATH
 
-# Data folder
-train_data_path = "/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_train"
-val_data_path = "/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_val"
+# Data folder and split manifest (written by train_test_split.py and train_val_split.py)
+splits_path = PACS_TRAIN_TEST_SPLITS_PATH
 labels_path = "/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_labels.xlsx"
 
+# Parse the documents of the split once
+data = load_data_with_labels(labels_path, PACS_DATA_DIR, documents=[document for partition in ["train", "val", "test"] for document in split_documents(splits_path, partition)])
+
 # Load training data
-train_data = load_data_with_labels(labels_path, train_data_path)
+train_data = select_split(data, splits_path, "train")
 train_data["label"] = train_data["label"].astype(int) - 1 # Convert labels to 0, 1, 2
 
 # Load validation data
-val_data = load_data_with_labels(labels_path, val_data_path)
+val_data = select_split(data, splits_path, "val")
 val_data["label"] = val_data["label"].astype(int) - 1 # Convert labels to 0, 1, 2
 
 # Load test data
-test_data_path = "/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_test"
-test_data = load_data_with_labels(labels_path, test_data_path)
+test_data = select_split(data, splits_path, "test")
 test_data["label"] = test_data["label"].astype(int) - 1 # Convert labels to 0, 1, 2
 
 print("Training data class balance:")
@@ -6,6 +6,9 @@ import argparse
 from collections import Counter
 import os
 
+from utils.corpus import load_corpus
+from utils.splits import load_split
+
 # Parse arguments
 parser = argparse.ArgumentParser(description="Compute metrics for a model")
 parser.add_argument("--model_name", type=str, help="Model name (e.g. roberta-base_50)")
@@ -34,19 +37,18 @@ model_accuracies = []
 for i in range(1, 6):
     # Load data
     if mode == "val":
-        if min_length != "0":
-            targets_path = f"Data/k-folds/split{i}/val_{min_length}.csv"
-        else:
-            targets_path = f"Data/k-folds/split{i}/val_PACS.csv"
+        # Select the fold's validation documents from the single parsed corpus
+        target_length = int(min_length) if min_length != "0" else None
+        targets = load_split("Data/k-folds/PACS_turns", "Data/k-folds/splits.csv", "val", fold=i,
+                             target_length=target_length, columns=["text", "label"])
 
     elif mode == "test":
         if min_length != "0":
-            targets_path = f"Data/PACS_varying_lengths/test_combined_{min_length}.csv"
+            targets_path = f"Data/PACS_varying_lengths/test_combined_{min_length}"
         else:
-            targets_path = f"Data/test_PACS.csv"
-
+            targets_path = f"Data/test_PACS"
+        targets = load_corpus(targets_path, columns=["text", "label"])
 
-    targets = pd.read_csv(targets_path, sep="\t")
     true_labels = targets.iloc[:, 1].tolist()
 
     # Load predictions
@@ -1,38 +1,27 @@
 from utils.preprocessing.transcript import load_data_with_labels
+from utils.corpus import write_corpus, export_machamp
+from utils.splits import select_split, split_documents, PACS_DATA_DIR, PACS_TRAIN_TEST_SPLITS_PATH
 
 import pandas as pd
 
 # PACS dataset
 labels_path = "/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_labels.xlsx"
 
-# Load training data
-train_path = "/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_train"
-train_data = load_data_with_labels(labels_path, train_path)
+# Parse the documents of the split once (written by train_test_split.py and train_val_split.py)
+splits_path = PACS_TRAIN_TEST_SPLITS_PATH
+partitions = ["train", "val", "test"]
+data = load_data_with_labels(labels_path, PACS_DATA_DIR, documents=[document for partition in partitions for document in split_documents(splits_path, partition)])
 
-# Remove tabs and newlines from text
-train_data['text'] = train_data['text'].str.replace(r'\t', ' ', regex=True)
-train_data['text'] = train_data['text'].str.replace(r'\n', ' ', regex=True)
+# Select the training, validation and test data
+train_data = select_split(data, splits_path, "train")
+val_data = select_split(data, splits_path, "val")
+test_data = select_split(data, splits_path, "test")
 
-# Load validation data
-val_path = "/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_val"
-val_data = load_data_with_labels(labels_path, val_path)
-
-# Remove tabs and newlines from text
-val_data['text'] = val_data['text'].str.replace(r'\t', ' ', regex=True)
-val_data['text'] = val_data['text'].str.replace(r'\n', ' ', regex=True)
-
-# Load test data
-test_path = "/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_test"
-test_data = load_data_with_labels(labels_path, test_path)
-
-# Remove tabs and newlines from text
-test_data['text'] = test_data['text'].str.replace(r'\t', ' ', regex=True)
-test_data['text'] = test_data['text'].str.replace(r'\n', ' ', regex=True)
 
 # Save data
-train_data.to_csv("/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_train.csv", index=False, sep="\t")
-val_data.to_csv("/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_val.csv", index=False, sep="\t")
-test_data.to_csv("/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_test.csv", index=False, sep="\t")
+for name, data in [("train", train_data), ("val", val_data), ("test", test_data)]:
+    write_corpus(data, f"/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_{name}.parquet")
+    export_machamp(data, f"/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_{name}.csv")
 
 # AnnoMI dataset
 
@@ -1,4 +1,5 @@
 from utils.preprocessing.transcript import load_data_with_labels
+from utils.corpus import load_corpus
 
 import pandas as pd
 import numpy as np
@@ -9,16 +10,16 @@ import seaborn as sns
 pacs_labels_path = "Data/PACS_labels_updated.xlsx"
 all_docs_path = "Data/PACS_data"
 
-train_path = "Data/train_PACS.csv"
-val_path = "Data/val_PACS.csv"
-test_path = "Data/test_PACS.csv"
+train_path = "Data/train_PACS"
+val_path = "Data/val_PACS"
+test_path = "Data/test_PACS"
 
 # Load data
 full = load_data_with_labels(pacs_labels_path, all_docs_path)
 
-train = pd.read_csv(train_path, sep="\t")
-val = pd.read_csv(val_path, sep="\t")
-test = pd.read_csv(test_path, sep="\t")
+train = load_corpus(train_path)
+val = load_corpus(val_path)
+test = load_corpus(test_path)
 
 # Number of documents
 all_docs = full["document"].unique()
@@ -37,13 +38,10 @@ test_classes = test["label"].value_counts(normalize=True)
 full["turn_length"] = full["text"].apply(lambda x: len(x.split()))
 avg_turn_length = np.mean(full["turn_length"])
 
-train["turn_length"] = train["text"].apply(lambda x: len(x.split()))
 train_avg_turn_length = np.mean(train["turn_length"])
 
-val["turn_length"] = val["text"].apply(lambda x: len(x.split()))
 val_avg_turn_length = np.mean(val["turn_length"])
 
-test["turn_length"] = test["text"].apply(lambda x: len(x.split()))
 test_avg_turn_length = np.mean(test["turn_length"])
 
 print("Writing to txt...")
@@ -155,38 +153,26 @@ print("Plotting... Done!")
 # varying lengths
 print("Loading varying lengths...")
 
-train_combined_50 = pd.read_csv("/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_varying_lengths/train_combined_50.csv", sep="\t")
-val_combined_50 = pd.read_csv("/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_varying_lengths/val_combined_50.csv", sep="\t")
-test_combined_50 = pd.read_csv("/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_varying_lengths/test_combined_50.csv", sep="\t")
+train_combined_50 = load_corpus("/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_varying_lengths/train_combined_50")
+val_combined_50 = load_corpus("/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_varying_lengths/val_combined_50")
+test_combined_50 = load_corpus("/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_varying_lengths/test_combined_50")
 
-train_combined_100 = pd.read_csv("/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_varying_lengths/train_combined_100.csv", sep="\t")
-val_combined_100 = pd.read_csv("/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_varying_lengths/val_combined_100.csv", sep="\t")
-test_combined_100 = pd.read_csv("/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_varying_lengths/test_combined_100.csv", sep="\t")
+train_combined_100 = load_corpus("/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_varying_lengths/train_combined_100")
+val_combined_100 = load_corpus("/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_varying_lengths/val_combined_100")
+test_combined_100 = load_corpus("/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_varying_lengths/test_combined_100")
 
-train_combined_150 = pd.read_csv("/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_varying_lengths/train_combined_150.csv", sep="\t")
-val_combined_150 = pd.read_csv("/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_varying_lengths/val_combined_150.csv", sep="\t")
-test_combined_150 = pd.read_csv("/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_varying_lengths/test_combined_150.csv", sep="\t")
+train_combined_150 = load_corpus("/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_varying_lengths/train_combined_150")
+val_combined_150 = load_corpus("/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_varying_lengths/val_combined_150")
+test_combined_150 = load_corpus("/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_varying_lengths/test_combined_150")
 
-train_combined_250 = pd.read_csv("/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_varying_lengths/train_combined_250.csv", sep="\t")
-val_combined_250 = pd.read_csv("/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_varying_lengths/val_combined_250.csv", sep="\t")
-test_combined_250 = pd.read_csv("/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_varying_lengths/test_combined_250.csv", sep="\t")
+train_combined_250 = load_corpus("/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_varying_lengths/train_combined_250")
+val_combined_250 = load_corpus("/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_varying_lengths/val_combined_250")
+test_combined_250 = load_corpus("/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_varying_lengths/test_combined_250")
 
 # Turn lengths
-train_combined_50["turn_length"] = train_combined_50["text"].apply(lambda x: len(x.split()))
-val_combined_50["turn_length"] = val_combined_50["text"].apply(lambda x: len(x.split()))
-test_combined_50["turn_length"] = test_combined_50["text"].apply(lambda x: len(x.split()))
 
-train_combined_100["turn_length"] = train_combined_100["text"].apply(lambda x: len(x.split()))
-train_combined_150["turn_length"] = train_combined_150["text"].apply(lambda x: len(x.split()))
-train_combined_250["turn_length"] = train_combined_250["text"].apply(lambda x: len(x.split()))
 
-val_combined_100["turn_length"] = val_combined_100["text"].apply(lambda x: len(x.split()))
-val_combined_150["turn_length"] = val_combined_150["text"].apply(lambda x: len(x.split()))
-val_combined_250["turn_length"] = val_combined_250["text"].apply(lambda x: len(x.split()))
 
-test_combined_100["turn_length"] = test_combined_100["text"].apply(lambda x: len(x.split()))
-test_combined_150["turn_length"] = test_combined_150["text"].apply(lambda x: len(x.split()))
-test_combined_250["turn_length"] = test_combined_250["text"].apply(lambda x: len(x.split()))
 
 print("Writing to txt...")
 
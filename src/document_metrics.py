@@ -0,0 +1,90 @@
+import os
+import argparse
+
+import torch
+from transformers import AutoTokenizer
+from sklearn.metrics import classification_report
+
+from utils.corpus import load_corpus
+from utils.preprocessing.transcript import combine_turns
+from utils.inference import load_classifier, InferenceEngine
+from utils.prediction_cache import PredictionCache
+from utils.documents import AGGREGATION_METHODS, predict_documents
+from utils.metrics import classification_metrics
+from utils.report import plot_confusion_matrix
+
+classes = ["Dismissing", "Secure", "Preoccupied"]
+
+# Parse arguments
+parser = argparse.ArgumentParser(description="Predict and score whole transcripts by aggregating the chunk predictions of a model")
+parser.add_argument("--checkpoint", type=str, required=True, help="Checkpoint written by Trainer.save or utils.quantization.save_quantized")
+parser.add_argument("--model_id", type=str, default="roberta-base", help="Base model of the checkpoint")
+parser.add_argument("--data", type=str, default="/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/val_PACS", help="Corpus artifact of patient turns with a document column")
+parser.add_argument("--min_length", type=int, default=0, help="Combine turns to chunks of at least this many words (0 for single turns)")
+parser.add_argument("--method", type=str, default="mean_log_prob", choices=AGGREGATION_METHODS, help="Aggregation method of the prediction")
+parser.add_argument("--confidence", type=float, default=0.99, help="Confidence at which a document decision counts as settled")
+parser.add_argument("--min_chunks", type=int, default=8, help="Fewest chunks read before a document can stop early")
+parser.add_argument("--chunks_per_round", type=int, default=4, help="Chunks read from every undecided document per round")
+parser.add_argument("--no_early_stopping", action="store_true", help="Read every chunk of every document")
+parser.add_argument("--max_len", type=int, default=512, help="Maximum sequence length")
+parser.add_argument("--max_tokens", type=int, default=16384, help="Padded token budget of a batch")
+parser.add_argument("--no_prediction_cache", action="store_true", help="Run every chunk instead of reusing cached predictions of this model")
+parser.add_argument("--output", type=str, default=None, help="Output folder (default: next to the checkpoint)")
+args = parser.parse_args()
+
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+model_name = os.path.splitext(os.path.basename(args.checkpoint))[0]
+output_folder = args.output or os.path.dirname(args.checkpoint)
+os.makedirs(output_folder, exist_ok=True)
+
+# Load the chunks of every transcript in transcript order
+data = load_corpus(args.data, columns=["text", "label", "document"])
+data["label"] = data["label"].astype(int) - 1 # Convert labels to 0, 1, 2
+if args.min_length > 0:
+    data = combine_turns(data, args.min_length)
+
+# Predict the documents
+tokenizer = AutoTokenizer.from_pretrained(args.model_id)
+model = load_classifier(args.model_id, args.checkpoint, num_labels=len(classes), id2label=dict(enumerate(classes))).to(device)
+prediction_cache = None if args.no_prediction_cache else PredictionCache()
+engine = InferenceEngine(model, tokenizer, max_len=args.max_len, max_tokens=args.max_tokens, device=device, cache=prediction_cache)
+documents = predict_documents(engine, data, method=args.method, early_stopping=not args.no_early_stopping,
+                              confidence=args.confidence, min_chunks=args.min_chunks,
+                              chunks_per_round=args.chunks_per_round, num_classes=len(classes), progress=True)
+
+# Compute the document-level metrics
+true_labels = documents["label"].to_numpy()
+scores = documents[[f"score_{i}" for i in range(len(classes))]].to_numpy()
+metrics = classification_metrics(scores, true_labels, len(classes))
+cm = metrics["confusion_matrix"].numpy()
+chunks_read = documents["chunks_read"].sum() / documents["chunks_total"].sum()
+
+print(f"\nDocuments: {len(documents)}, chunks read: {chunks_read:.1%}, stopped early: {documents['stopped_early'].mean():.1%}")
+if prediction_cache is not None:
+    print(f"Prediction cache: {prediction_cache.stats()}")
+print("\nConfusion matrix:")
+print(cm)
+reports = {}
+for method in AGGREGATION_METHODS:
+    reports[method] = classification_report(true_labels, documents[f"prediction_{method}"], labels=list(range(len(classes))), target_names=classes, zero_division=0)
+print(f"\nClassification report ({args.method}):")
+print(reports[args.method])
+
+# Save the predictions, the confusion matrix and the report
+suffix = f"{model_name}_{args.method}" + (f"_length_{args.min_length}" if args.min_length > 0 else "")
+documents.to_csv(os.path.join(output_folder, f"documents_{suffix}.csv"), index=False)
+plot_confusion_matrix(cm, classes, os.path.join(output_folder, f"document_confusion_matrix_{suffix}.png"),
+                      title=f"Document confusion matrix | {args.method}")
+with open(os.path.join(output_folder, f"DOCUMENT_REPORT__{suffix}.txt"), "w") as f:
+    f.write(f"Documents: {len(documents)}\n")
+    f.write(f"Chunks read: {chunks_read:.1%}\n")
+    f.write(f"Stopped early: {documents['stopped_early'].mean():.1%}\n")
+    f.write(f"Accuracy: {(documents['prediction'] == documents['label']).mean()}\n")
+    f.write(f"Precision: {metrics['precision']}\n")
+    f.write(f"Recall: {metrics['recall']}\n")
+    f.write(f"F1: {metrics['f1']}\n")
+    f.write("\nConfusion matrix:\n")
+    f.write(str(cm))
+    for method, report in reports.items():
+        f.write(f"\n\nClassification report ({method}):\n")
+        f.write(report)
@@ -0,0 +1,60 @@
+import os
+import argparse
+
+import pandas as pd
+import torch
+from transformers import AutoTokenizer
+
+from utils.corpus import load_corpus
+from utils.dataset import tokenize_flat
+from utils.inference import load_classifier, InferenceEngine, compare_engines
+from utils.onnx_backend import export_onnx, OnnxBackend, check_parity
+
+classes = ["Dismissing", "Secure", "Preoccupied"]
+
+# Parse arguments
+parser = argparse.ArgumentParser(description="Export a Trainer checkpoint to ONNX, check it against PyTorch and compare their CPU speed")
+parser.add_argument("--checkpoint", type=str, required=True, help="Checkpoint written by Trainer.save")
+parser.add_argument("--model_id", type=str, default="roberta-base", help="Base model of the checkpoint")
+parser.add_argument("--output", type=str, default=None, help="Path of the .onnx file (default: next to the checkpoint)")
+parser.add_argument("--data", type=str, default="/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/val_PACS", help="Corpus artifact to check and benchmark on")
+parser.add_argument("--max_len", type=int, default=512, help="Maximum sequence length")
+parser.add_argument("--max_tokens", type=int, default=16384, help="Padded token budget of a batch")
+parser.add_argument("--samples", type=int, default=256, help="Number of texts to check and benchmark on")
+parser.add_argument("--repeats", type=int, default=3, help="Timed passes over the texts per backend")
+parser.add_argument("--threads", type=int, default=None, help="CPU threads for both backends (default: all cores)")
+parser.add_argument("--atol", type=float, default=1e-4, help="Largest absolute logit difference accepted")
+args = parser.parse_args()
+
+output_path = args.output or os.path.splitext(args.checkpoint)[0] + ".onnx"
+if args.threads is not None:
+    torch.set_num_threads(args.threads)
+
+# Export the fine-tuned model
+model = load_classifier(args.model_id, args.checkpoint, num_labels=len(classes), id2label=dict(enumerate(classes)))
+export_onnx(model, output_path)
+print(f"Exported {output_path} ({os.path.getsize(output_path) / 2**20:.0f} MiB)")
+
+# Tokenize the sample texts once for both backends
+tokenizer = AutoTokenizer.from_pretrained(args.model_id)
+texts = load_corpus(args.data, columns=["text"])["text"].tolist()[:args.samples]
+tokens, offsets = tokenize_flat(texts, tokenizer, args.max_len)
+
+engines = {"pytorch": InferenceEngine(model, tokenizer, max_len=args.max_len, max_tokens=args.max_tokens),
+           "onnxruntime": InferenceEngine(OnnxBackend(output_path, threads=args.threads), tokenizer, max_len=args.max_len,
+                                          max_tokens=args.max_tokens, num_labels=len(classes))}
+
+# Check that ONNX Runtime reproduces the PyTorch logits
+parity = check_parity(engines["pytorch"], engines["onnxruntime"], tokens, offsets, atol=args.atol)
+print(f"Parity: {parity}")
+
+# Compare throughput and single-text latency
+results = pd.DataFrame(compare_engines(engines, tokens, offsets, repeats=args.repeats))
+for key, value in parity.items():
+    results[key] = value
+results_path = os.path.splitext(output_path)[0] + "_benchmark.csv"
+results.to_csv(results_path, index=False)
+print(results.to_string(index=False))
+print(f"Saved {results_path}")
+if not parity["passed"]:
+    raise SystemExit(f"ONNX logits differ from PyTorch by {parity['max_logit_diff']:.2e} > {args.atol}")
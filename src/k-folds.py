@@ -1,20 +1,25 @@
-from utils.preprocessing.transcript import load_data_with_labels, combine_turns
-import os
-import shutil
+from utils.build import load_manifest, save_manifest, update_turns, build_partition
+from utils.splits import make_split_manifest, write_split_manifest, split_documents, PACS_DATA_DIR, PACS_CLEAN_SPLITS_PATH
+import argparse
 from sklearn.model_selection import train_test_split
 import pandas as pd
 
+parser = argparse.ArgumentParser(description='Make 5 train/val splits of PACS and build their corpus artifacts')
+parser.add_argument('--incremental', action='store_true', help='Only re-parse changed documents and rewrite changed artifacts')
+parser.add_argument('--no_export', action='store_true', help='Only write the split manifest, without the per-fold MaChAmp files')
+parser.add_argument('--n_jobs', type=int, default=-1, help='Number of processes used to parse documents (-1 for all cores)')
+args = parser.parse_args()
+
 # PACS dataset
 labels_path = "/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_labels_updated.xlsx"
-data_dir = "/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_data"
+data_dir = PACS_DATA_DIR
 
-train_dir = "/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/train_PACS"
-val_dir = "/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/val_PACS"
+splits_path = PACS_CLEAN_SPLITS_PATH
 
 # Load doc names and labels
 pacs_labels = pd.read_excel(labels_path)
-train_docs = os.listdir(train_dir)
-val_docs = os.listdir(val_dir)
+train_docs = split_documents(splits_path, "train")
+val_docs = split_documents(splits_path, "val")
 pacs_docs = train_docs + val_docs
 
 # Keep only the rows in the labels file that correspond to the docs in the train and val sets
@@ -28,49 +33,34 @@ print("Number of unique documents:", len(pacs["Document"].unique()))
 print("Number of docs:", len(docs))
 print("Number of labels:", len(labels))
 
-# Make 5 splits of the data
-for i in range (1, 6):
-    train_dir = f"/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/k-folds/split{i}/train_docs"
-    val_dir = f"/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/k-folds/split{i}/val_docs"
-    os.makedirs(train_dir, exist_ok=True)
-    os.makedirs(val_dir, exist_ok=True)
+# Parse the documents once for all folds (only new or changed ones in incremental mode)
+folds_root = "/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/k-folds"
+manifest = load_manifest(folds_root)
+force = not args.incremental
+turns, changed = update_turns(labels_path, data_dir, folds_root, manifest, documents=pacs_docs, n_jobs=args.n_jobs, force=force)
+target_lengths = [50, 100, 150, 250]
 
+# Make 5 splits of the data, recorded in one manifest of document -> fold/partition
+folds = []
+for i in range (1, 6):
     # Stratified split for train/val sets
     X_train, X_val, y_train, y_val = train_test_split(
         docs, labels, test_size=0.15, stratify=labels, random_state=i, shuffle=True
     )
+    folds.append(make_split_manifest({"train": X_train, "val": X_val}, fold=i))
 
-    # Copy files to respective directories
-    for doc in X_train:
-        shutil.copy2(os.path.join(data_dir, doc), os.path.join(train_dir, doc))
-    for doc in X_val:
-        shutil.copy2(os.path.join(data_dir, doc), os.path.join(val_dir, doc))
-
-    ### Clean text and save data to csv in MaChAmp format
-    # Load data
-    train_data = load_data_with_labels(labels_path, train_dir)
-    val_data = load_data_with_labels(labels_path, val_dir)
-
-    # Remove tabs and newlines from text
-    train_data['text'] = train_data['text'].str.replace(r'\t', ' ', regex=True)
-    train_data['text'] = train_data['text'].str.replace(r'\n', ' ', regex=True)
-    val_data['text'] = val_data['text'].str.replace(r'\t', ' ', regex=True)
-    val_data['text'] = val_data['text'].str.replace(r'\n', ' ', regex=True)
-
-    # Save data
-    train_data.to_csv(f"/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/k-folds/split{i}/train_PACS.csv", index=False, sep="\t")
-    val_data.to_csv(f"/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/k-folds/split{i}/val_PACS.csv", index=False, sep="\t")
-
-# Make varying lengths of instances
-for i in range (1, 6):
-    for target_length in [50, 100, 150, 250]:
-        train_data = pd.read_csv(f"/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/k-folds/split{i}/train_PACS.csv", sep="\t")
-        val_data = pd.read_csv(f"/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/k-folds/split{i}/val_PACS.csv", sep="\t")
+fold_splits = pd.concat(folds, ignore_index=True)
+write_split_manifest(fold_splits, f"{folds_root}/splits.csv")
 
-        # Combine turns to make varying target_length instances
-        combined_train = combine_turns(train_data, target_length)
-        combined_val = combine_turns(val_data, target_length)
+### Save the folds in csv in MaChAmp format, with varying lengths of instances
+# Python loaders read the folds straight from PACS_turns.parquet with utils.splits.load_split,
+# the files are only needed for MaChAmp. Folds whose documents did not change are skipped in incremental mode.
+if not args.no_export:
+    for i in range (1, 6):
+        for name in ["train", "val"]:
+            written = build_partition(turns, split_documents(fold_splits, name, fold=i), f"{folds_root}/split{i}/{name}_PACS",
+                                      f"{folds_root}/split{i}/{name}_{{target_length}}",
+                                      target_lengths, manifest, formats=('.csv',), force=force)
+            print(f"split{i} {name}: wrote {len(written)} files")
 
-        # Save data
-        combined_train.to_csv(f"/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/k-folds/split{i}/train_{target_length}.csv", index=False, sep="\t")
-        combined_val.to_csv(f"/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/k-folds/split{i}/val_{target_length}.csv", index=False, sep="\t")
\ No newline at end of file
+save_manifest(manifest, folds_root)
@@ -6,6 +6,8 @@ import argparse
 from collections import Counter
 import os
 
+from utils.corpus import load_corpus
+
 # Parse arguments
 parser = argparse.ArgumentParser(description="Compute metrics for a model")
 parser.add_argument("--model_date", type=str, help="Model date (e.g. 2024.03.13_11.54.44)")
@@ -37,12 +39,12 @@ pred_labels = preds.iloc[:, 1].tolist()
 
 # Load true labels
 if split == "old":
-    targets = pd.read_csv('Data/old_PACS/PACS_val.csv', sep='\t') if min_length == 0 else pd.read_csv(f'Data/PACS_varying_lengths/val_length_{min_length}.csv', sep='\t')
+    targets = load_corpus('Data/old_PACS/PACS_val') if min_length == 0 else load_corpus(f'Data/PACS_varying_lengths/val_length_{min_length}')
 elif split == "new":
     if mode == "test":
-        targets = pd.read_csv('Data/test_PACS.csv', sep='\t') if min_length == 0 else pd.read_csv(f'Data/PACS_varying_lengths/test_combined_{min_length}.csv', sep='\t')
+        targets = load_corpus('Data/test_PACS') if min_length == 0 else load_corpus(f'Data/PACS_varying_lengths/test_combined_{min_length}')
     elif mode == "val":
-        targets = pd.read_csv('Data/val_PACS.csv', sep='\t') if min_length == 0 else pd.read_csv(f'Data/PACS_varying_lengths/val_combined_{min_length}.csv', sep='\t')
+        targets = load_corpus('Data/val_PACS') if min_length == 0 else load_corpus(f'Data/PACS_varying_lengths/val_combined_{min_length}')
     else:
         raise ValueError("Invalid mode argument. Must be 'val' or 'test'.")
 else:
@@ -96,7 +98,7 @@ with open(f'{output_folder}/metrics_model_{model_number}.txt', 'w') as f:
 
 # Add a new column to the dataframes representing the length of the instances
 preds['length'] = preds.iloc[:, 0].apply(lambda x: len(x.split()))
-targets['length'] = targets.iloc[:, 0].apply(lambda x: len(x.split()))
+targets['length'] = targets['turn_length']
 
 # Define a function to categorize the lengths into bins
 def bin_length(length):
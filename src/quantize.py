@@ -0,0 +1,85 @@
+import os
+import argparse
+
+import pandas as pd
+import torch
+from transformers import AutoTokenizer
+from sklearn.metrics import classification_report
+
+from utils.corpus import load_corpus
+from utils.dataset import tokenize_flat
+from utils.inference import load_classifier, InferenceEngine, compare_engines
+from utils.metrics import classification_metrics
+from utils.quantization import QUANTIZATION_MODES, quantize_dynamic, quantize_static, save_quantized, model_size_bytes
+
+classes = ["Dismissing", "Secure", "Preoccupied"]
+
+# Parse arguments
+parser = argparse.ArgumentParser(description="Quantize a Trainer checkpoint to int8 and report accuracy against latency next to the fp32 model")
+parser.add_argument("--checkpoint", type=str, required=True, help="Checkpoint written by Trainer.save")
+parser.add_argument("--model_id", type=str, default="roberta-base", help="Base model of the checkpoint")
+parser.add_argument("--data", type=str, default="/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/val_PACS", help="Corpus artifact to calibrate and evaluate on")
+parser.add_argument("--modes", type=str, nargs="+", default=["dynamic"], choices=QUANTIZATION_MODES, help="Quantization modes to produce")
+parser.add_argument("--calibration_samples", type=int, default=128, help="Texts held out from the data for static calibration, not evaluated on")
+parser.add_argument("--max_len", type=int, default=512, help="Maximum sequence length")
+parser.add_argument("--max_tokens", type=int, default=16384, help="Padded token budget of a batch")
+parser.add_argument("--repeats", type=int, default=1, help="Timed passes over the evaluation texts per model")
+parser.add_argument("--threads", type=int, default=None, help="CPU threads (default: all cores)")
+parser.add_argument("--output", type=str, default=None, help="Folder for the quantized models and the report (default: next to the checkpoint)")
+args = parser.parse_args()
+
+if args.threads is not None:
+    torch.set_num_threads(args.threads)
+model_name = os.path.splitext(os.path.basename(args.checkpoint))[0]
+output_folder = args.output or os.path.dirname(args.checkpoint)
+os.makedirs(output_folder, exist_ok=True)
+
+# Load data, holding out the first texts for calibration so they are not evaluated on
+tokenizer = AutoTokenizer.from_pretrained(args.model_id)
+data = load_corpus(args.data, columns=["text", "label"])
+data["label"] = data["label"].astype(int) - 1 # Convert labels to 0, 1, 2
+calibration_samples = args.calibration_samples if "static" in args.modes else 0
+calibration_data, eval_data = data.iloc[:calibration_samples], data.iloc[calibration_samples:]
+tokens, offsets = tokenize_flat(eval_data["text"].tolist(), tokenizer, args.max_len)
+true_labels = eval_data["label"].to_numpy()
+
+# Quantize the fp32 model in every mode
+models = {"fp32": load_classifier(args.model_id, args.checkpoint, num_labels=len(classes), id2label=dict(enumerate(classes)))}
+paths = {"fp32": args.checkpoint}
+for mode in args.modes:
+    if mode == "dynamic":
+        models[f"int8_{mode}"] = quantize_dynamic(models["fp32"])
+    else:
+        calibration_tokens, calibration_offsets = tokenize_flat(calibration_data["text"].tolist(), tokenizer, args.max_len)
+        models[f"int8_{mode}"] = quantize_static(models["fp32"], tokenizer, calibration_tokens, calibration_offsets, max_tokens=args.max_tokens)
+    paths[f"int8_{mode}"] = os.path.join(output_folder, f"{model_name}_int8_{mode}.pt")
+    save_quantized(models[f"int8_{mode}"], mode, paths[f"int8_{mode}"])
+    print(f"Saved {paths[f'int8_{mode}']}")
+
+# Evaluate every model and time it on the same texts
+engines = {name: InferenceEngine(model, tokenizer, max_len=args.max_len, max_tokens=args.max_tokens) for name, model in models.items()}
+rows = {row["backend"]: row for row in compare_engines(engines, tokens, offsets, repeats=args.repeats)}
+reports = {}
+for name, engine in engines.items():
+    logits, _ = engine.predict_tokens(tokens, offsets)
+    metrics = classification_metrics(logits, true_labels, len(classes))
+    reports[name] = classification_report(true_labels, logits.argmax(axis=1), target_names=classes, zero_division=0)
+    rows[name].update({"path": paths[name],
+                       "size_mb": model_size_bytes(models[name]) / 2**20,
+                       "accuracy": float((logits.argmax(axis=1) == true_labels).mean()),
+                       "macro_f1": float(metrics["f1"].mean())})
+results = pd.DataFrame(list(rows.values())).rename(columns={"backend": "model"})
+results["accuracy_change"] = results["accuracy"] - results.loc[results["model"] == "fp32", "accuracy"].iloc[0]
+results["speedup"] = results["samples_per_s"] / results.loc[results["model"] == "fp32", "samples_per_s"].iloc[0]
+
+# Save and print the report
+results_path = os.path.join(output_folder, f"QUANTIZATION__{model_name}.csv")
+results.to_csv(results_path, index=False)
+with open(os.path.join(output_folder, f"QUANTIZATION__{model_name}.txt"), "w") as f:
+    f.write(f"Evaluated on {len(eval_data)} texts, {calibration_samples} held out for calibration\n\n")
+    f.write(results.drop(columns="path").to_string(index=False))
+    for name, report in reports.items():
+        f.write(f"\n\nClassification report ({name}):\n")
+        f.write(report)
+print(results.drop(columns="path").to_string(index=False))
+print(f"Saved {results_path}")
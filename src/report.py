@@ -0,0 +1,20 @@
+import os
+import argparse
+
+from utils.events import EVENTS_NAME
+from utils.report import render_report, epoch_metrics
+
+# Parse arguments
+parser = argparse.ArgumentParser(description="Render the training plots of a run from its event log, also while it is still training")
+parser.add_argument("run", type=str, help="Model folder of the run, or the path of its event log")
+parser.add_argument("--output", type=str, default=None, help="Folder for the figures (default: next to the event log)")
+parser.add_argument("--title", type=str, default=None, help="Figure title")
+args = parser.parse_args()
+
+events_path = os.path.join(args.run, EVENTS_NAME) if os.path.isdir(args.run) else args.run
+
+# Print the metrics per epoch and render the figures
+epochs = epoch_metrics(events_path)
+print(epochs[[column for column in ["epoch", "split", "loss", "padding_efficiency"] if column in epochs]].to_string(index=False))
+for path in render_report(events_path, output_dir=args.output, title=args.title):
+    print(f"Saved {path}")
@@ -1,18 +1,19 @@
 import os
 import datetime
 
-from torchmetrics import Accuracy, Precision, Recall, ConfusionMatrix
 import torch
-from torch.utils.data import DataLoader, Subset
-import matplotlib.pyplot as plt
 from transformers import AutoModelForSequenceClassification, AutoTokenizer
 import numpy as np
-from tqdm import tqdm
-from sklearn.metrics import confusion_matrix, classification_report
+from sklearn.metrics import classification_report
 
 from utils.trainer import Trainer
 from utils.preprocessing.transcript import load_data_with_labels
-from utils.dataset import CustomDataset
+from utils.dataset import TokenizedDataset
+from utils.splits import select_split, split_documents, PACS_DATA_DIR, PACS_TRAIN_TEST_SPLITS_PATH
+from utils.inference import InferenceEngine
+from utils.prediction_cache import PredictionCache
+from utils.metrics import classification_metrics
+from utils.report import plot_confusion_matrix
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
@@ -34,26 +35,21 @@ model = AutoModelForSequenceClassification.from_pretrained(
     label2id=label2id)
 model.to(device)
 
-# Data folders
-val_data_path = "/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_val"
+# Data folder and split manifest (written by train_test_split.py and train_val_split.py)
+data_path = PACS_DATA_DIR
+splits_path = PACS_TRAIN_TEST_SPLITS_PATH
 labels_path = "/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_labels.xlsx"
 
 # Load data
-val_data = load_data_with_labels(labels_path, val_data_path)
+val_data = select_split(load_data_with_labels(labels_path, data_path, documents=split_documents(splits_path, "val")), splits_path, "val")
 val_data["label"] = val_data["label"].astype(int) - 1 # Convert labels to 0, 1, 2
 
 max_len = 512
-val_dataset = CustomDataset(val_data, max_len=max_len, tokenizer=tokenizer)
-
-# Put datasets into loaders
-batch_size = 16
-val_loader = DataLoader(val_dataset, batch_size=batch_size)
+val_dataset = TokenizedDataset(val_data, max_len=max_len, tokenizer=tokenizer)
 
 # Instantiate the Trainer
 trainer = Trainer()
 trainer.compile(model, torch.optim.AdamW, learning_rate=5e-5, loss_fn=torch.nn.CrossEntropyLoss(), model_name=model_id)
-trainer.model = model
-trainer.val_loader = val_loader
 
 # Load the saved weights into the model
 # model_state_dict = torch.load(model_path)
@@ -61,53 +57,29 @@ trainer.val_loader = val_loader
 
 trainer.load(model_path, source="cpu")
 
-# Initialize the metrics
-accuracy = Accuracy(task="multiclass", average=None, num_classes=num_labels)
-precision = Precision(task='multiclass', average=None, num_classes=num_labels)
-recall = Recall(task='multiclass', average=None, num_classes=num_labels)
-
-# Make sure to switch the model to evaluation mode
-trainer.model.eval()
-
-# Initialize lists to store the true and predicted labels
-true_labels = []
-pred_labels = []
-
-with torch.no_grad():
-    # Create a progress bar
-    progress_bar = tqdm(val_loader, desc="Validation", total=len(val_loader))
-
-    for batch in progress_bar:
-        inputs = batch['input_ids'].to(device)
-        attention_mask = batch['attention_mask'].to(device)
-        labels = batch['targets'].to(device)
-
-        # Get the model's predictions
-        outputs = trainer.model(inputs, attention_mask=attention_mask)
-        _, preds = torch.max(outputs.logits, 1)
-
-        # Update the metrics
-        accuracy.update(preds, labels)
-        precision.update(preds, labels)
-        recall.update(preds, labels)
+# Predict in length-sorted batches of at most max_tokens padded tokens, returned in dataset order.
+# Texts already scored by these weights are read from the prediction cache instead
+max_tokens = 16384
+prediction_cache = PredictionCache()
+engine = InferenceEngine(trainer.model, tokenizer, max_len=max_len, max_tokens=max_tokens, device=device, cache=prediction_cache)
+logits, probabilities = engine.predict_dataset(val_dataset, progress=True)
+print(f"Prediction cache: {prediction_cache.stats()}")
 
-        # Store the true and predicted labels
-        true_labels.extend(labels.cpu().numpy())
-        pred_labels.extend(preds.cpu().numpy())
+# Compute the metrics once over all predictions
+true_labels = val_data["label"].to_numpy()
+pred_labels = logits.argmax(axis=1)
+metrics = classification_metrics(logits, true_labels, num_labels)
 
-        # Update the progress bar
-        progress_bar.set_postfix({'accuracy': accuracy.compute().tolist(), 'precision': precision.compute().tolist(), 'recall': recall.compute().tolist()})
-       
 # Compute the confusion matrix
-cm = confusion_matrix(true_labels, pred_labels)
+cm = metrics["confusion_matrix"].numpy()
 print("\nConfusion matrix:")
 print(cm)
 
 # Compute the final metrics
 print("\nFinal metrics:")
-final_accuracy = accuracy.compute()
-final_precision = precision.compute()
-final_recall = recall.compute()
+final_accuracy = metrics["accuracy"]
+final_precision = metrics["precision"]
+final_recall = metrics["recall"]
 
 print(f"Accuracy: {final_accuracy}")
 print(f"Precision: {final_precision}")
@@ -125,16 +97,7 @@ if not os.path.exists(output_folder):
 
 
 # Save the confusion matrix
-plt.figure(figsize=(10, 10))
-plt.imshow(cm, interpolation='nearest', cmap=plt.cm.Blues)
-plt.title('Confusion matrix')
-plt.colorbar()
-tick_marks = np.arange(len(classes))
-plt.xticks(tick_marks, classes, rotation=45)
-plt.yticks(tick_marks, classes)
-plt.xlabel('Predicted label')
-plt.ylabel('True label')
-plt.savefig(f'{output_folder}/confusion_matrix_{model_name}.png')
+plot_confusion_matrix(cm, classes, f'{output_folder}/confusion_matrix_{model_name}.png')
 
 # Write metrics to text file
 with open(f'{output_folder}/REPORT__{model_name}.txt', 'w') as f:
@@ -1,5 +1,6 @@
 #%% Imports
 import os
+from functools import partial
 from datetime import datetime
 
 from transformers import TrainingArguments, Trainer, AutoTokenizer, AutoModelForSequenceClassification, DataCollatorWithPadding
@@ -7,14 +8,20 @@ import numpy as np
 import torch
 import torch.nn as nn
 from torch.utils.data import DataLoader, Subset
-import matplotlib.pyplot as plt
-from torchmetrics import Accuracy, Precision, Recall
-from sklearn.metrics import confusion_matrix, classification_report
+from sklearn.metrics import classification_report
 from tqdm import tqdm
 
 from utils.preprocessing.transcript import *
 from utils.trainer import Trainer
-from utils.dataset import CustomDataset
+from utils.dataset import TokenizedDataset, LengthBucketBatchSampler, collate_tokens
+from utils.packing import PackedDataset, collate_packed
+from utils.windows import WindowedDataset, collate_windows, encode_documents
+from utils.splits import select_split, split_documents, PACS_DATA_DIR, PACS_TRAIN_TEST_SPLITS_PATH
+from utils.memory import plan_micro_batches
+from utils.events import EVENTS_NAME
+from utils.report import render_report, plot_confusion_matrix
+from utils.inference import InferenceEngine
+from utils.metrics import classification_metrics
 
 #%% Training arguments
 model_id = 'roberta-base'
@@ -28,6 +35,22 @@ id2label = {i: label for i, label in enumerate(classes)}
 label2id = {label: i for i, label in enumerate(classes)}
 
 batch_size = 32
+packing = False # Pack short turns into max_len rows (useful for single turns, min_length=0)
+packed_batch_size = 4 # Number of packed rows per batch
+windows = False # Classify whole transcripts from sliding windows of max_len tokens, pooled per document
+window_overlap = 128 # Number of tokens shared by consecutive windows
+window_batch_size = 2 # Number of transcripts per batch
+max_windows = 8 # Windows per training transcript and batch, a random run of consecutive windows every epoch
+bf16 = False # bf16 autocast, on CPUs with native bf16 (AVX512-BF16/AMX). Run benchmark.py to pick the fastest setup
+torch_compile = False # torch.compile the model, kernels are cached between runs
+fused_optimizer = False # Fused AdamW where available
+accumulation_steps = 1 # Number of micro-batches per optimizer step, batch_size is the effective batch size
+gradient_checkpointing = False # Recompute activations in the backward pass to save memory
+memory_budget_gb = None # If set, pick the largest micro-batch that fits and accumulate up to batch_size
+checkpoint_every = None # Also checkpoint every this many batches (a multiple of accumulation_steps), for resuming
+resume_from = None # Path of a checkpoint written by fit to continue an interrupted run from
+profile = False # Time data loading, forward, backward, optimizer and metrics per epoch (written to profile.csv)
+profile_steps = None # (start, stop) batches to record a torch.profiler trace of, e.g. (10, 15)
 learning_rate = 5e-5
 num_epochs = 5
 weight_decay = 0.01
@@ -42,25 +65,24 @@ device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 tokenizer = AutoTokenizer.from_pretrained(model_id)
 #%% Load data
 
-# Data folder
-train_data_path = "/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_train"
-val_data_path = "/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_val"
+# Data folder and split manifest (written by train_test_split.py and train_val_split.py)
+data_path = PACS_DATA_DIR
+splits_path = PACS_TRAIN_TEST_SPLITS_PATH
 labels_path = "/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_labels.xlsx"
 
+# Parse the train and val documents once and select the partitions from the split manifest
+data = load_data_with_labels(labels_path, data_path, documents=split_documents(splits_path, "train") + split_documents(splits_path, "val"))
+
 # Load training data
-train_data = load_data_with_labels(labels_path, train_data_path)
+train_data = select_split(data, splits_path, "train")
 train_data["label"] = train_data["label"].astype(int) - 1 # Convert labels to 0, 1, 2
-train_dataset = CustomDataset(train_data, max_len=max_len, tokenizer=tokenizer)
+train_dataset = TokenizedDataset(train_data, max_len=max_len, tokenizer=tokenizer)
 
 # Load validation data
-val_data = load_data_with_labels(labels_path, val_data_path)
+val_data = select_split(data, splits_path, "val")
 val_data["label"] = val_data["label"].astype(int) - 1 # Convert labels to 0, 1, 2
-val_dataset = CustomDataset(val_data, max_len=max_len, tokenizer=tokenizer)
-
+val_dataset = TokenizedDataset(val_data, max_len=max_len, tokenizer=tokenizer)
 
-# Put train dataset into a loader with 2 batches and put test data in val loader
-train_loader = DataLoader(train_dataset, batch_size=batch_size)
-val_loader = DataLoader(val_dataset, batch_size=batch_size)
 
 #%% Initialize model and trainer
 
@@ -74,14 +96,44 @@ model.to(device) # Send to device
 
 # Instantiate the Trainer
 trainer = Trainer(num_labels=num_labels)
-trainer.compile(model, optimizer, learning_rate=learning_rate, loss_fn=loss_fn, model_name=model_id)
+trainer.compile(model, optimizer, learning_rate=learning_rate, loss_fn=loss_fn, model_name=model_id,
+                bf16=bf16, torch_compile=torch_compile, fused_optimizer=fused_optimizer, gradient_checkpointing=gradient_checkpointing)
 
 # Load the saved weights into the model if model_source == fine-tuned
 if model_source == "fine-tuned":
-    model = trainer.load(model_path, "gpu" if device.type == "cuda" else "cpu")
+    trainer.load(model_path, "gpu" if device.type == "cuda" else "cpu")
+
+# Split the batch into micro-batches that fit the memory budget, accumulating gradients up to batch_size
+if memory_budget_gb is not None:
+    micro_batch_size, accumulation_steps = plan_micro_batches(model, batch_size, max_len, memory_budget_gb * 1024**3, device, loss_fn=loss_fn)
+    print(f"Micro-batch size {micro_batch_size} with {accumulation_steps} accumulation steps")
+else:
+    if batch_size % accumulation_steps != 0:
+        raise ValueError(f"batch_size ({batch_size}) must be a multiple of accumulation_steps ({accumulation_steps})")
+    micro_batch_size = batch_size // accumulation_steps
+
+# Put train dataset into a loader with 2 batches and put test data in val loader
+if packing:
+    # Pack several short turns into each max_len row, each turn still only attends to itself
+    collate_fn = partial(collate_packed, pad_token_id=tokenizer.pad_token_id)
+    train_loader = DataLoader(PackedDataset(train_dataset, max_len), batch_size=packed_batch_size, shuffle=True, collate_fn=collate_fn)
+    val_loader = DataLoader(PackedDataset(val_dataset, max_len), batch_size=packed_batch_size, collate_fn=collate_fn)
+elif windows:
+    # Windows are cut from one token stream per transcript, the label belongs to the transcript
+    train_windows = WindowedDataset(train_data, tokenizer, max_len, overlap=window_overlap, max_windows=max_windows, sample_windows=True)
+    val_windows = WindowedDataset(val_data, tokenizer, max_len, overlap=window_overlap)
+    collate_fn = partial(collate_windows, pad_token_id=tokenizer.pad_token_id, prefix=train_windows.prefix, suffix=train_windows.suffix)
+    train_loader = DataLoader(train_windows, batch_sampler=LengthBucketBatchSampler(train_windows.lengths(), window_batch_size, shuffle=True), collate_fn=collate_fn)
+    val_loader = DataLoader(val_windows, batch_sampler=LengthBucketBatchSampler(val_windows.lengths(), window_batch_size), collate_fn=collate_fn)
+else:
+    collate_fn = partial(collate_tokens, pad_token_id=tokenizer.pad_token_id) # Pad to the longest item of each batch
+    train_loader = DataLoader(train_dataset, batch_sampler=LengthBucketBatchSampler(train_dataset.lengths(), micro_batch_size, shuffle=True), collate_fn=collate_fn)
+    val_loader = DataLoader(val_dataset, batch_sampler=LengthBucketBatchSampler(val_dataset.lengths(), batch_size), collate_fn=collate_fn)
 
 #%% Train model and save
-trainer.fit(num_epochs=num_epochs, train_loader=train_loader, device=device, val_loader=val_loader, patience=patience, min_delta=min_delta)
+trainer.fit(num_epochs=num_epochs, train_loader=train_loader, device=device, val_loader=val_loader, patience=patience, min_delta=min_delta,
+            accumulation_steps=accumulation_steps, checkpoint_every=checkpoint_every, resume_from=resume_from,
+            profile=profile, profile_steps=profile_steps)
 
 # define the name for trained model based on set parameters and date
 try:
@@ -93,128 +145,36 @@ except:
     trainer.save('/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Outputs/trained_models/' + model_name)
 
 #%% Evaluate model
-# Access the history
-train_loss = trainer.history['train_loss']
-val_loss = trainer.history['val_loss']
-if all(isinstance(i, torch.Tensor) for i in trainer.history['train_acc']):
-    train_accuracy = [i.item() for i in trainer.history['train_acc']]
-else:
-    train_accuracy = trainer.history['train_acc']
-if all(isinstance(i, torch.Tensor) for i in trainer.history['val_acc']):
-    val_accuracy = [i.item() for i in trainer.history['val_acc']]
-else:
-    val_accuracy = trainer.history['val_acc']
-if all(isinstance(i, torch.Tensor) for i in trainer.history['train_precision']):
-    train_precision = [i.item() for i in trainer.history['train_precision']]
-else:
-    train_precision = trainer.history['train_precision']
-if all(isinstance(i, torch.Tensor) for i in trainer.history['val_precision']):
-    val_precision = [i.item() for i in trainer.history['val_precision']]
-else:
-    val_precision = trainer.history['val_precision']
-if all(isinstance(i, torch.Tensor) for i in trainer.history['train_recall']):
-    train_recall = [i.item() for i in trainer.history['train_recall']]
-else:
-    train_recall = trainer.history['train_recall']
-if all(isinstance(i, torch.Tensor) for i in trainer.history['val_recall']):
-    val_recall = [i.item() for i in trainer.history['val_recall']]
-else:
-    val_recall = trainer.history['val_recall']
-
-# Create a figure with 5 subplots
-fig, axs = plt.subplots(5, sharex=True, figsize=(10, 15))
-
-# Plot the loss
-axs[0].plot(train_loss, label='Train Loss')
-axs[0].plot(val_loss, label='Validation Loss')
-axs[0].set_ylabel('Loss')
-axs[0].legend()
-
-# Plot the accuracy
-axs[1].plot(train_accuracy, label='Train Accuracy')
-axs[1].plot(val_accuracy, label='Validation Accuracy')
-axs[1].set_ylabel('Accuracy')
-axs[1].legend()
-
-# Plot the precision
-axs[2].plot(train_precision, label='Train Precision')
-axs[2].plot(val_precision, label='Validation Precision')
-axs[2].set_ylabel('Precision')
-axs[2].legend()
-
-# Plot the recall
-axs[3].plot(train_recall, label='Train Recall')
-axs[3].plot(val_recall, label='Validation Recall')
-axs[3].set_ylabel('Recall')
-axs[3].legend()
-
-# Add labels and title
-axs[4].set_xlabel('Epochs')
-fig.suptitle(f'Metrics over epochs | {trainer.model_name} | LR = {learning_rate} \n {len(train_dataset)} samples | Batch size = {batch_size}')
-
-# Ensure the directory exists
-os.makedirs({trainer.model_dir}, exist_ok=True)
-plt.savefig(f'{trainer.model_dir}/METRICS_{trainer.model_name}.png')
-
-# Plot the loss over epochs separately
-plt.figure(figsize=(10, 5))
-plt.plot(train_loss, label='Train Loss')
-plt.plot(val_loss, label='Validation Loss')
-plt.xlabel('Epochs')
-plt.ylabel('Loss')
-plt.title(f'Loss over epochs | {trainer.model_name} | LR = {learning_rate} \n {len(train_dataset)} samples | Batch size = {batch_size}')
-plt.legend()
-plt.savefig(f'{trainer.model_dir}/loss_plot_{trainer.model_name}.png')
-
-# Initialize the metrics
-accuracy = Accuracy(task="multiclass", average=None, num_classes=num_labels)
-precision = Precision(task='multiclass', average=None, num_classes=num_labels)
-recall = Recall(task='multiclass', average=None, num_classes=num_labels)
-
-# Make sure to switch the model to evaluation mode
-trainer.model.eval()
-
-# Initialize lists to store the true and predicted labels
-true_labels = []
-pred_labels = []
+# Render the metrics over epochs from the event log of the run
+render_report(os.path.join(trainer.model_dir, EVENTS_NAME),
+              title=f'Metrics over epochs | {trainer.model_name} | LR = {learning_rate} \n {len(train_dataset)} samples | Batch size = {batch_size}')
 
 print("\nComputing validation metrics...")
+if windows:
+    # Predict every validation transcript from all of its windows
+    _, logits, window_stats = encode_documents(trainer.model, val_windows, device, bf16=trainer.bf16, progress=True)
+    print(f"Encoded {window_stats['windows']} windows at {window_stats['tokens_per_s']:.0f} tokens/s")
+    true_labels = val_windows.targets.numpy()
+else:
+    # Predict the validation set in length-sorted, token-budgeted batches, returned in dataset order
+    engine = InferenceEngine(trainer.model, tokenizer, max_len=max_len, device=device, bf16=trainer.bf16)
+    logits, probabilities = engine.predict_dataset(val_dataset, progress=True)
+    true_labels = val_data["label"].to_numpy()
 
-with torch.no_grad():
-    # Create a progress bar
-    progress_bar = tqdm(val_loader, desc="Validation", total=len(val_loader))
-
-    for batch in progress_bar:
-        inputs = batch['input_ids'].to(device)
-        attention_mask = batch['attention_mask'].to(device)
-        labels = batch['targets'].to(device)
-
-        # Get the model's predictions
-        outputs = trainer.model(inputs, attention_mask=attention_mask)
-        _, preds = torch.max(outputs.logits, 1)
-
-        # Update the metrics
-        accuracy.update(preds, labels)
-        precision.update(preds, labels)
-        recall.update(preds, labels)
-
-        # Store the true and predicted labels
-        true_labels.extend(labels.cpu().numpy())
-        pred_labels.extend(preds.cpu().numpy())
+# Compute the metrics once over all predictions
+pred_labels = logits.argmax(axis=1)
+metrics = classification_metrics(logits, true_labels, num_labels)
 
-        # Update the progress bar
-        progress_bar.set_postfix({'accuracy': accuracy.compute().tolist(), 'precision': precision.compute().tolist(), 'recall': recall.compute().tolist()})
-       
 # Compute the confusion matrix
-cm = confusion_matrix(true_labels, pred_labels)
+cm = metrics["confusion_matrix"].numpy()
 print("\nConfusion matrix:")
 print(cm)
 
 # Compute the final metrics
 print("\nValidation metrics:")
-final_accuracy = accuracy.compute()
-final_precision = precision.compute()
-final_recall = recall.compute()
+final_accuracy = metrics["accuracy"]
+final_precision = metrics["precision"]
+final_recall = metrics["recall"]
 
 print(f"Accuracy: {final_accuracy}")
 print(f"Precision: {final_precision}")
@@ -236,13 +196,4 @@ with open(f'{trainer.model_dir}/REPORT__{model_name}.txt', 'w') as f:
     f.write(classification_report(true_labels, pred_labels, target_names=classes))
 
 # Save the confusion matrix
-plt.figure(figsize=(10, 10))
-plt.imshow(cm, interpolation='nearest', cmap=plt.cm.Blues)
-plt.title('Confusion matrix')
-plt.colorbar()
-tick_marks = np.arange(len(classes))
-plt.xticks(tick_marks, classes, rotation=45)
-plt.yticks(tick_marks, classes)
-plt.xlabel('Predicted label')
-plt.ylabel('True label')
-plt.savefig(f'{trainer.model_dir}/confusion_matrix_{model_name}.png')
\ No newline at end of file
+plot_confusion_matrix(cm, classes, f'{trainer.model_dir}/confusion_matrix_{model_name}.png')
\ No newline at end of file
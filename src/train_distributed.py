@@ -0,0 +1,88 @@
+import os
+import argparse
+from functools import partial
+from datetime import datetime
+
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+from utils.corpus import load_corpus
+from utils.trainer import Trainer
+from utils.dataset import TokenCache, TokenizedDataset, LengthBucketBatchSampler, collate_tokens
+from utils.distributed import launch, shard_loader, is_main_process
+from utils.events import EVENTS_NAME
+from utils.report import render_report
+
+classes = ["Dismissing", "Secure", "Preoccupied"]
+
+# Function to load a corpus artifact with 0-based labels
+def load_labelled(path):
+    data = load_corpus(path, columns=["text", "label"])
+    data["label"] = data["label"].astype(int) - 1 # Convert labels to 0, 1, 2
+    return data
+
+# Function to train in one of the processes
+def main(rank, world_size, args):
+    """Train on this process's shard of the data. Gradients are averaged over all processes by DDP."""
+    torch.manual_seed(args.seed) # Identical initial classifier weights on every process
+    device = torch.device("cpu")
+    tokenizer = AutoTokenizer.from_pretrained(args.model_id)
+    cache = TokenCache(args.token_cache) if args.token_cache else None
+    train_dataset = TokenizedDataset(load_labelled(args.train_data), tokenizer=tokenizer, max_len=args.max_len, cache=cache)
+    val_dataset = TokenizedDataset(load_labelled(args.val_data), tokenizer=tokenizer, max_len=args.max_len, cache=cache)
+
+    # Every process draws the same bucketed batches and keeps every world_size-th one
+    collate_fn = partial(collate_tokens, pad_token_id=tokenizer.pad_token_id)
+    train_loader = DataLoader(train_dataset, batch_sampler=LengthBucketBatchSampler(train_dataset.lengths(), args.batch_size, shuffle=True, seed=args.seed), collate_fn=collate_fn)
+    val_loader = DataLoader(val_dataset, batch_sampler=LengthBucketBatchSampler(val_dataset.lengths(), args.batch_size), collate_fn=collate_fn)
+    train_loader = shard_loader(train_loader)
+    val_loader = shard_loader(val_loader, pad=False) # Evaluation sums are all-reduced, so no repeated batches
+
+    model = AutoModelForSequenceClassification.from_pretrained(
+        args.model_id,
+        num_labels=len(classes),
+        id2label={i: label for i, label in enumerate(classes)},
+        label2id={label: i for i, label in enumerate(classes)})
+    model.to(device)
+
+    trainer = Trainer(num_labels=len(classes))
+    trainer.compile(model, torch.optim.AdamW, learning_rate=args.learning_rate, loss_fn=nn.CrossEntropyLoss(), model_name=args.model_id.replace('/', '_'))
+    if args.output:
+        trainer.model_dir = args.output
+    trainer.fit(num_epochs=args.epochs, train_loader=train_loader, device=device, val_loader=val_loader,
+                patience=args.patience, accumulation_steps=args.accumulation_steps)
+
+    if is_main_process():
+        model_name = f"{trainer.model_name}_LR_{args.learning_rate}__EPOCHS_{args.epochs}__BATCHSIZE_{args.batch_size * world_size}__WORLD_{world_size}__TIME_{datetime.now().strftime('%Y-%m-%d_%H%M')}.pt"
+        os.makedirs(trainer.model_dir, exist_ok=True)
+        trainer.save(os.path.join(trainer.model_dir, model_name))
+        render_report(os.path.join(trainer.model_dir, EVENTS_NAME), title=f"{trainer.model_name} | {world_size} processes")
+
+if __name__ == "__main__":
+    # Parse arguments
+    parser = argparse.ArgumentParser(description="Data-parallel training on CPU with one process per replica (gloo backend)")
+    parser.add_argument("--world_size", type=int, default=2, help="Number of processes")
+    parser.add_argument("--threads_per_worker", type=int, default=None, help="Intra-op threads per process (default: an even share of the cores)")
+    parser.add_argument("--model_id", type=str, default="roberta-base", help="Model to fine-tune")
+    parser.add_argument("--train_data", type=str, default="/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/train_PACS", help="Training corpus artifact")
+    parser.add_argument("--val_data", type=str, default="/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/val_PACS", help="Validation corpus artifact")
+    parser.add_argument("--token_cache", type=str, default=None, help="Token cache folder, shared by the processes")
+    parser.add_argument("--max_len", type=int, default=512, help="Maximum sequence length")
+    parser.add_argument("--batch_size", type=int, default=16, help="Batch size per process, the effective batch size is batch_size * world_size")
+    parser.add_argument("--accumulation_steps", type=int, default=1, help="Micro-batches per optimizer step")
+    parser.add_argument("--learning_rate", type=float, default=5e-5, help="Learning rate")
+    parser.add_argument("--epochs", type=int, default=5, help="Number of epochs")
+    parser.add_argument("--patience", type=int, default=2, help="Early stopping patience")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the initial weights and the batch order")
+    parser.add_argument("--output", type=str, default=None, help="Folder for checkpoints and plots")
+    args = parser.parse_args()
+
+    # Tokenize once in the parent process, so the workers only memory-map the cached tokens
+    if args.token_cache:
+        tokenizer = AutoTokenizer.from_pretrained(args.model_id)
+        TokenizedDataset(load_labelled(args.train_data), tokenizer=tokenizer, max_len=args.max_len, cache=TokenCache(args.token_cache))
+        TokenizedDataset(load_labelled(args.val_data), tokenizer=tokenizer, max_len=args.max_len, cache=TokenCache(args.token_cache))
+
+    launch(main, args.world_size, args=(args,), threads_per_worker=args.threads_per_worker)
@@ -1,18 +1,15 @@
 import os
-import shutil
 from sklearn.model_selection import train_test_split
 
+from utils.splits import make_split_manifest, write_split_manifest, PACS_DATA_DIR, PACS_TRAIN_TEST_SPLITS_PATH
+
 # Paths
-data_dir = "/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/PACS_data"
-train_dir = "/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/PACS_train"
-test_dir = "/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/PACS_test"
+data_dir = PACS_DATA_DIR
+splits_path = PACS_TRAIN_TEST_SPLITS_PATH
 
 # Create split
 file_list = os.listdir(data_dir)
 train_files, test_files = train_test_split(file_list, test_size=0.15, random_state=42)
 
-# Copy files to respective directories
-for file in train_files:
-    shutil.copy2(os.path.join(data_dir, file), os.path.join(train_dir, file))
-for file in test_files:
-    shutil.copy2(os.path.join(data_dir, file), os.path.join(test_dir, file))
\ No newline at end of file
+# Record the split in a manifest of document -> partition instead of copying the files
+write_split_manifest(make_split_manifest({"train": train_files, "test": test_files}), splits_path)
@@ -1,15 +1,15 @@
-import os
-import shutil
 from sklearn.model_selection import train_test_split
 
+from utils.splits import read_split_manifest, write_split_manifest, PACS_TRAIN_TEST_SPLITS_PATH
+
 # Paths
-train_dir = "/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_train"
-val_dir = "/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_val"
+splits_path = PACS_TRAIN_TEST_SPLITS_PATH
 
 # Create split
-file_list = os.listdir(train_dir)
+splits = read_split_manifest(splits_path)
+file_list = splits.loc[splits["partition"] == "train", "document"].tolist()
 train_files, val_files = train_test_split(file_list, test_size=0.15, random_state=42)
 
-# Copy files to respective directories
-for file in val_files:
-    shutil.move(os.path.join(train_dir, file), os.path.join(val_dir, file))
\ No newline at end of file
+# Move the validation files from the train to the val partition of the manifest
+splits.loc[splits["document"].isin(val_files), "partition"] = "val"
+write_split_manifest(splits, splits_path)
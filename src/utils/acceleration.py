@@ -0,0 +1,177 @@
+"""
+Opt-in CPU acceleration for training: bf16 autocast, torch.compile and fused AdamW.
+
+Every option degrades gracefully: bf16 is only enabled where the CPU supports it natively,
+torch.compile falls back to the eager model if compilation fails, and fused AdamW falls back to
+the foreach implementation on builds without a fused CPU kernel. benchmark_configurations times
+each combination so the fastest setup can be picked per machine.
+"""
+import os
+import time
+import copy
+import contextlib
+import itertools
+
+import torch
+
+# Default location of the compiled kernel cache shared between runs
+DEFAULT_COMPILE_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'pacs', 'inductor')
+
+# Function to check for native bf16 support
+def bf16_supported(device=torch.device('cpu')):
+    """Whether the device has native bf16 arithmetic (AVX512-BF16 or AMX on CPU)."""
+    if device.type == 'cuda':
+        return torch.cuda.is_bf16_supported()
+    if not torch.backends.mkldnn.is_available():
+        return False
+    try:
+        with open('/proc/cpuinfo') as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+# Function to get the autocast context of a forward pass
+def autocast(device, enabled):
+    """Return a bf16 autocast context for the device if enabled, else a no-op context."""
+    if not enabled:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=device.type, dtype=torch.bfloat16)
+
+# Function to compile a model with a persistent kernel cache
+def compile_model(model, cache_dir=DEFAULT_COMPILE_CACHE_DIR, dynamic=True):
+    """Compile a model with torch.compile, caching the generated kernels in cache_dir.
+    Compilation happens lazily on the first call, use CompiledModelFallback to survive failures.
+    Args:
+        model (torch.nn.Module): The model.
+        cache_dir (str): The inductor cache directory, reused by later runs.
+        dynamic (bool): Compile for dynamic shapes, so dynamic padding does not recompile per length.
+    Returns:
+        The compiled model, or the model itself if torch.compile is unavailable."""
+    if not hasattr(torch, 'compile'):
+        return model
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', cache_dir)
+    try:
+        import torch._inductor.config as inductor_config
+        inductor_config.fx_graph_cache = True
+    except (ImportError, AttributeError):
+        pass
+    return torch.compile(model, dynamic=dynamic)
+
+# Function to list the exception types of failed compilations
+def compile_errors():
+    """The exception types torch.compile raises when tracing or code generation fails
+    (TorchDynamoException covers the backend failures of inductor as well)."""
+    errors = []
+    try:
+        from torch._dynamo.exc import TorchDynamoException
+        errors.append(TorchDynamoException)
+    except ImportError:
+        pass
+    try:
+        from torch._inductor.exc import CppCompileError, LoweringException
+        errors.extend([CppCompileError, LoweringException])
+    except ImportError:
+        pass
+    return tuple(errors)
+
+class CompiledModelFallback:
+    """Calls a compiled model and switches to the eager model for good if compilation fails.
+    Only compilation errors (see compile_errors) trigger the fallback, errors of the model
+    itself are raised as in eager mode. Not a Module itself, so state dicts are still taken
+    from the eager model.
+
+    Args:
+        compiled: The compiled model.
+        eager (torch.nn.Module): The original model, sharing parameters with compiled.
+    """
+    def __init__(self, compiled, eager):
+        self.eager = eager
+        self.compiled = compiled
+        self.failed = False
+        self.errors = compile_errors()
+
+    def __call__(self, *args, **kwargs):
+        if not self.failed:
+            try:
+                return self.compiled(*args, **kwargs)
+            except self.errors as e:
+                print(f"torch.compile failed, falling back to eager mode: {type(e).__name__}: {e}")
+                self.failed = True
+        return self.eager(*args, **kwargs)
+
+# Function to build an optimizer, fused where possible
+def make_optimizer(optimizer, parameters, learning_rate, weight_decay, fused=False):
+    """Instantiate an optimizer, using the fused kernel if requested and available.
+    Falls back to the multi-tensor (foreach) implementation, then to the default one.
+    Args:
+        optimizer: The optimizer class, e.g. torch.optim.AdamW.
+        parameters: The parameters to optimize.
+        learning_rate (float): The learning rate.
+        weight_decay (float): The weight decay.
+        fused (bool): Try the fused implementation.
+    Returns:
+        torch.optim.Optimizer: The optimizer."""
+    parameters = list(parameters)
+    attempts = [{'fused': True}, {'foreach': True}, {}] if fused else [{}]
+    for kwargs in attempts:
+        try:
+            return optimizer(parameters, lr=learning_rate, weight_decay=weight_decay, **kwargs)
+        except (RuntimeError, TypeError, ValueError):
+            continue
+    raise RuntimeError(f"Could not instantiate {optimizer.__name__}")
+
+# Function to time training steps under every acceleration configuration
+def benchmark_configurations(model, optimizer, loss_fn, data_loader, device, learning_rate=5e-5,
+                             weight_decay=0.01, steps=20, warmup=3, options=('bf16', 'torch_compile', 'fused_optimizer')):
+    """Time forward, backward and optimizer steps for every combination of acceleration options.
+    Each configuration trains a fresh copy of the model, so the model passed in is not modified.
+    Args:
+        model (torch.nn.Module): The model.
+        optimizer: The optimizer class.
+        loss_fn: The loss function.
+        data_loader (DataLoader): Batches with "input_ids", "attention_mask" and "targets".
+        device (torch.device): The device.
+        learning_rate (float): The learning rate.
+        weight_decay (float): The weight decay.
+        steps (int): Number of timed steps per configuration.
+        warmup (int): Number of untimed steps per configuration (includes compilation).
+        options (tuple): The options to combine.
+    Returns:
+        list: One dict per configuration with the options, samples/s and the mean and median step latency in ms."""
+    results = []
+    for values in itertools.product([False, True], repeat=len(options)):
+        config = dict(zip(options, values))
+        if config.get('bf16') and not bf16_supported(device):
+            continue
+
+        run_model = copy.deepcopy(model).to(device).train()
+        run_optimizer = make_optimizer(optimizer, run_model.parameters(), learning_rate, weight_decay, fused=config.get('fused_optimizer', False))
+        if config.get('torch_compile'):
+            run_model = CompiledModelFallback(compile_model(run_model), run_model)
+
+        latencies, samples = [], 0
+        batches = itertools.cycle(data_loader)
+        for step in range(warmup + steps):
+            batch = next(batches)
+            start = time.perf_counter()
+            run_optimizer.zero_grad()
+            with autocast(device, config.get('bf16', False)):
+                logits = run_model(batch['input_ids'].to(device), attention_mask=batch['attention_mask'].to(device)).logits
+                loss = loss_fn(logits.float(), batch['targets'].to(device))
+            loss.backward()
+            run_optimizer.step()
+            if step >= warmup:
+                latencies.append(time.perf_counter() - start)
+                samples += len(batch['targets'])
+
+        if config.get('torch_compile') and run_model.failed:
+            config['torch_compile'] = 'failed'
+        latencies.sort()
+        results.append({**config,
+                        'samples_per_s': samples / sum(latencies),
+                        'mean_step_ms': 1000 * sum(latencies) / len(latencies),
+                        'median_step_ms': 1000 * latencies[len(latencies) // 2]})
+        print(results[-1])
+    return results
@@ -0,0 +1,162 @@
+"""
+Incremental builds of the PACS corpus artifacts.
+
+A manifest in the output directory records the content hash and label of every parsed document
+and a digest of every derived artifact. Rebuilding re-parses only new or changed documents,
+re-derives only the partitions whose documents changed and rewrites only the artifacts whose
+content changed, so untouched outputs stay byte-for-byte identical on disk.
+"""
+import os
+import json
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from utils.corpus import write_corpus, read_corpus, export_machamp
+from utils.preprocessing.cache import file_digest
+from utils.preprocessing.transcript import load_documents_with_labels, combine_turns_by_length, PARSER_VERSION
+
+MANIFEST_NAME = 'manifest.json'
+TURNS_NAME = 'PACS_turns.parquet'
+
+# Function to load the build manifest of an output directory
+def load_manifest(output_dir):
+    """Load the build manifest of an output directory, or an empty one if there is none."""
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {'documents': {}, 'partitions': {}, 'artifacts': {}}
+    with open(path) as f:
+        return json.load(f)
+
+# Function to save the build manifest of an output directory
+def save_manifest(manifest, output_dir):
+    """Atomically write the build manifest to an output directory."""
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+# Function to hash the content of a DataFrame
+def frame_digest(data):
+    """Return a digest of the column names and values of a DataFrame (the index is ignored)."""
+    digest = hashlib.sha256(json.dumps([str(c) for c in data.columns]).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(data.astype(str), index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+# Function to write an artifact only if its content changed
+def write_artifact(data, path, manifest, writer=write_corpus, force=False):
+    """Write data to path unless the manifest shows the file already holds the same content.
+    Args:
+        data (pandas.DataFrame): The artifact content.
+        path (str): The output path.
+        manifest (dict): The build manifest, updated in place.
+        writer (callable): Function writing (data, path).
+        force (bool): Write even if the content is unchanged.
+    Returns:
+        bool: Whether the file was written."""
+    digest = frame_digest(data)
+    if not force and manifest['artifacts'].get(path) == digest and os.path.exists(path):
+        return False
+    writer(data, path)
+    manifest['artifacts'][path] = digest
+    return True
+
+# Function to bring the parsed turns of all labelled documents up to date
+def update_turns(labels_path, data_dir, output_dir, manifest, documents=None, n_jobs=None, cache=None, engine='docx', force=False):
+    """Parse the new or changed documents of data_dir and merge them with the stored turns of the others.
+    Args:
+        labels_path (str): The path to the Excel sheet with the labels.
+        data_dir (str): The folder containing all documents.
+        output_dir (str): The folder holding the parsed turns and the manifest.
+        manifest (dict): The build manifest, updated in place.
+        documents (list): Optional subset of the labelled documents to keep.
+        n_jobs (int): The number of worker processes used to parse documents.
+        cache (TranscriptCache): Optional parse cache.
+        engine (str): The paragraph extraction engine, 'docx' or 'lxml'.
+        force (bool): Re-parse every document.
+    Returns:
+        A tuple of (DataFrame with the turns of all labelled documents in labels sheet order, list of re-parsed documents)."""
+    labels = pd.read_excel(labels_path)
+    if documents is not None:
+        labels = labels[labels['Document'].isin(set(documents))]
+    turns_path = os.path.join(output_dir, TURNS_NAME)
+    stored = read_corpus(turns_path) if os.path.exists(turns_path) and not force else None
+    stored_documents = set(stored['document'].unique()) if stored is not None else set()
+
+    # Find the labelled documents whose content, label or parser changed since the last build
+    records = {}
+    changed_names, changed_labels = [], []
+    for document_name, label in zip(labels['Document'], labels['Class3']):
+        path = os.path.join(data_dir, document_name)
+        if not os.path.exists(path):
+            continue
+        record = {'sha256': file_digest(path), 'label': int(label), 'parser': PARSER_VERSION}
+        records[document_name] = record
+        if manifest['documents'].get(document_name) != record or document_name not in stored_documents:
+            changed_names.append(document_name)
+            changed_labels.append(label)
+    if not records:
+        raise FileNotFoundError(f"None of the {len(labels)} labelled documents in {labels_path} were found in {data_dir}")
+
+    parts = []
+    if changed_names:
+        parsed = load_documents_with_labels(changed_names, changed_labels, data_dir, n_jobs=n_jobs, cache=cache, engine=engine)
+        for document_name in parsed.attrs['failures']:
+            del records[document_name]
+        parts.append(parsed)
+    print(f"Re-parsed {len(changed_names)} of {len(records)} documents.")
+
+    # Merge the stored turns of unchanged documents with the new ones, in labels sheet order
+    if stored is not None:
+        kept = stored[stored['document'].isin(set(records) - set(changed_names))]
+        parts.insert(0, kept[['text', 'label', 'document']].astype({'document': str}))
+    turns = pd.concat(parts, ignore_index=True)
+    order = {document_name: i for i, document_name in enumerate(labels['Document'])}
+    turns = turns.iloc[np.argsort(turns['document'].map(order).to_numpy(), kind='stable')].reset_index(drop=True)
+    turns['turn_length'] = turns['text'].str.split().str.len()
+
+    manifest['documents'] = records
+    write_artifact(turns, turns_path, manifest, force=force)
+    return turns, changed_names
+
+# Function to derive the artifacts of one partition of the corpus
+def build_partition(turns, documents, turns_stem, combined_template, target_lengths, manifest, formats=('.parquet', '.csv'), force=False):
+    """Write the turns and combined-length instances of a partition, skipping it if its inputs did not change.
+    Each artifact is written as Parquet (turns_stem + '.parquet') and/or as MaChAmp TSV (turns_stem + '.csv').
+    Args:
+        turns (pandas.DataFrame): The turns of all documents, as returned by update_turns.
+        documents (list): The documents in the partition.
+        turns_stem (str): Output path of the partition's turns, without extension.
+        combined_template (str): Output path of the combined instances, without extension, with a {target_length} field.
+        target_lengths (list): The target lengths of the combined instances.
+        manifest (dict): The build manifest, updated in place.
+        formats (tuple): The extensions of the formats to write, '.parquet' and/or '.csv'.
+        force (bool): Rebuild and rewrite every artifact.
+    Returns:
+        list: The paths of the files that were written."""
+    documents = set(documents)
+
+    # The partition only needs re-deriving if one of its documents (content, label or parser) or the requested lengths changed
+    inputs = sorted((d, manifest['documents'][d]) for d in documents if d in manifest['documents'])
+    inputs_digest = hashlib.sha256(json.dumps([inputs, sorted(target_lengths)], sort_keys=True).encode('utf-8')).hexdigest()
+    stems = [turns_stem] + [combined_template.format(target_length=t) for t in target_lengths]
+    outputs_exist = all(os.path.exists(stem + ext) for stem in stems for ext in formats)
+    if not force and manifest['partitions'].get(turns_stem) == inputs_digest and outputs_exist:
+        return []
+
+    data = turns[turns['document'].isin(documents)].reset_index(drop=True)
+    artifacts = {turns_stem: data}
+    for target_length, combined in combine_turns_by_length(data, target_lengths).items():
+        artifacts[combined_template.format(target_length=target_length)] = combined
+
+    written = []
+    writers = {'.parquet': write_corpus, '.csv': export_machamp}
+    for stem, artifact in artifacts.items():
+        for ext in formats:
+            if write_artifact(artifact, stem + ext, manifest, writer=writers[ext], force=force):
+                written.append(stem + ext)
+    manifest['partitions'][turns_stem] = inputs_digest
+    return written
@@ -0,0 +1,158 @@
+"""
+Asynchronous, rotating checkpoint writing.
+
+Saving a checkpoint on the training thread stalls training for as long as serialisation and disk
+I/O take (several seconds for roberta-large with its AdamW state). CheckpointWriter only copies the
+state to CPU memory on the training thread and writes it from a background thread, atomically
+through a temporary file and a rename, so a crash never leaves a truncated checkpoint behind.
+Older checkpoints are deleted so that only the best few by validation loss and the latest remain.
+get_rng_state and set_rng_state capture the random number generators for resuming a run.
+"""
+import os
+import queue
+import random
+import threading
+
+import numpy as np
+import torch
+
+# Function to copy a (nested) state to CPU memory
+def snapshot_to_cpu(state):
+    """Return a copy of a state dict, history or any nesting of dicts, lists and tuples with every
+    tensor copied to CPU memory, so training can continue to modify the original."""
+    if isinstance(state, torch.Tensor):
+        return state.detach().to('cpu', copy=True)
+    if isinstance(state, dict):
+        return type(state)((key, snapshot_to_cpu(value)) for key, value in state.items())
+    if isinstance(state, (list, tuple)):
+        return type(state)(snapshot_to_cpu(value) for value in state)
+    return state
+
+# Function to capture the state of every random number generator
+def get_rng_state():
+    """Return the states of the Python, NumPy, torch and CUDA generators, using only types
+    torch.load accepts with weights_only."""
+    name, keys, position, has_gauss, cached_gaussian = np.random.get_state()
+    return {
+        'python': random.getstate(),
+        'numpy': {'name': name, 'keys': torch.from_numpy(keys.astype(np.int64)), 'position': position,
+                  'has_gauss': has_gauss, 'cached_gaussian': cached_gaussian},
+        'torch': torch.get_rng_state(),
+        'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else [],
+    }
+
+# Function to restore the state of every random number generator
+def set_rng_state(state):
+    """Restore generator states returned by get_rng_state."""
+    random.setstate(state['python'])
+    numpy_state = state['numpy']
+    np.random.set_state((numpy_state['name'], numpy_state['keys'].numpy().astype(np.uint32), numpy_state['position'],
+                         numpy_state['has_gauss'], numpy_state['cached_gaussian']))
+    torch.set_rng_state(state['torch'])
+    if state['cuda'] and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+# Function to write a checkpoint atomically
+def save_checkpoint(state, path):
+    """Write a checkpoint with torch.save to a temporary file in the same folder and rename it to path."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    try:
+        torch.save(state, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+class CheckpointWriter:
+    """Writes checkpoints in a background thread and keeps the best keep_top_k plus the latest.
+
+    At most one snapshot waits while another is written, so memory stays bounded: if checkpoints
+    are submitted faster than the disk can write them, submit blocks until the queue has room.
+    Errors in the background thread are raised by the next call to submit, wait or close.
+
+    Args:
+        keep_top_k (int): Number of checkpoints with the lowest metric to keep. None keeps all.
+        keep_latest (bool): Also keep the most recent checkpoint.
+    """
+    def __init__(self, keep_top_k=3, keep_latest=True):
+        self.keep_top_k = keep_top_k
+        self.keep_latest = keep_latest
+        self.written = [] # (metric, order, path) of the checkpoints on disk
+        self.error = None
+        self._order = 0
+        self._queue = queue.Queue(maxsize=1)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, state, path, metric=None):
+        """Snapshot state to CPU memory and queue it to be written to path.
+        Args:
+            state (dict): The checkpoint, e.g. model and optimizer state dicts and the history.
+            path (str): The destination file.
+            metric (float): The value to rank checkpoints by, lower is better (the validation loss).
+                Checkpoints without a metric are only kept while they are the latest."""
+        self._raise_error()
+        self._queue.put((snapshot_to_cpu(state), path, metric))
+
+    def track(self, path, metric=None):
+        """Add a checkpoint already on disk, e.g. one of the run being resumed, to the rotation
+        as if it had been written by this writer. Call before submitting new checkpoints."""
+        self.written = [entry for entry in self.written if entry[2] != path]
+        self.written.append((metric, self._order, path))
+        self._order += 1
+
+    def wait(self):
+        """Block until every submitted checkpoint is written."""
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """Write the remaining checkpoints and stop the background thread."""
+        self._queue.join()
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_error()
+
+    def best(self):
+        """Return the path of the checkpoint with the lowest metric, or None."""
+        ranked = sorted((metric, order, path) for metric, order, path in self.written if metric is not None)
+        return ranked[0][2] if ranked else None
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                state, path, metric = item
+                save_checkpoint(state, path)
+                print(f"Model and training history saved to {path}")
+                self.written = [entry for entry in self.written if entry[2] != path]
+                self.written.append((metric, self._order, path))
+                self._order += 1
+                self._rotate()
+            except Exception as e:
+                self.error = e
+            finally:
+                self._queue.task_done()
+
+    def _rotate(self):
+        # Keep the keep_top_k lowest metrics and the latest, delete the rest
+        if self.keep_top_k is None:
+            return
+        ranked = sorted(entry for entry in self.written if entry[0] is not None)
+        keep = {entry[2] for entry in ranked[:self.keep_top_k]}
+        if self.keep_latest:
+            keep.add(self.written[-1][2])
+        for entry in self.written:
+            if entry[2] not in keep and os.path.exists(entry[2]):
+                os.remove(entry[2])
+        self.written = [entry for entry in self.written if entry[2] in keep]
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError("Writing a checkpoint failed") from error
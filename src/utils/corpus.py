@@ -0,0 +1,151 @@
+"""
+Columnar storage for the PACS corpus artifacts (patient turns and combined-length instances).
+"""
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# Columns of a corpus artifact, in the order MaChAmp and the metrics scripts expect
+CORPUS_COLUMNS = ['text', 'label', 'document', 'turn_length']
+MACHAMP_COLUMNS = ['text', 'label', 'document']
+
+# Low-cardinality columns stored dictionary-encoded
+DICTIONARY_COLUMNS = ['label', 'document']
+
+# File extensions of the supported formats, in lookup order
+PARQUET_EXTENSIONS = ('.parquet',)
+ARROW_EXTENSIONS = ('.arrow', '.feather')
+TSV_EXTENSIONS = ('.csv', '.tsv')
+
+# Function to convert a DataFrame of turns into an Arrow table in the corpus layout
+def to_corpus_table(data):
+    """Convert a DataFrame with "text", "label" and "document" columns into an Arrow table.
+    Adds the word count of each text as "turn_length" if it is missing and dictionary-encodes
+    the "label" and "document" columns. Any other columns are kept after the corpus columns.
+    Args:
+        data (pandas.DataFrame): The turns to convert.
+    Returns:
+        pyarrow.Table: The corpus table."""
+    if 'turn_length' not in data:
+        data = data.assign(turn_length=data['text'].str.split().str.len().astype('int32'))
+    columns = CORPUS_COLUMNS + [c for c in data.columns if c not in CORPUS_COLUMNS]
+    table = pa.Table.from_pandas(data[columns], preserve_index=False)
+
+    for name in DICTIONARY_COLUMNS:
+        i = table.schema.get_field_index(name)
+        if not pa.types.is_dictionary(table.schema.field(i).type):
+            table = table.set_column(i, name, pc.dictionary_encode(table.column(i)))
+    return table
+
+# Function to write a corpus artifact
+def write_corpus(data, path):
+    """Write turns to a columnar corpus file.
+    The format follows the extension: '.parquet' writes zstd-compressed Parquet, '.arrow' or
+    '.feather' writes an uncompressed Arrow IPC file that can be memory-mapped without copying.
+    Args:
+        data (pandas.DataFrame or pyarrow.Table): The turns to write.
+        path (str): The output path."""
+    table = data if isinstance(data, pa.Table) else to_corpus_table(data)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    if path.endswith(PARQUET_EXTENSIONS):
+        pq.write_table(table, path, compression='zstd')
+    elif path.endswith(ARROW_EXTENSIONS):
+        with pa.OSFile(path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    else:
+        raise ValueError(f"Unsupported corpus format: {path}. Use .parquet, .arrow or .feather.")
+
+# Function to read a columnar corpus artifact into an Arrow table
+def read_corpus_table(path, columns=None, documents=None):
+    """Read a Parquet or Arrow corpus file into an Arrow table using memory-mapped I/O.
+    Args:
+        path (str): The path to the corpus file.
+        columns (list): Optional subset of columns to read.
+        documents (list): Optional subset of documents to read. Parquet files skip the row groups
+            without any of them.
+    Returns:
+        pyarrow.Table: The corpus table."""
+    if path.endswith(PARQUET_EXTENSIONS):
+        filters = [('document', 'in', list(documents))] if documents is not None else None
+        return pq.read_table(path, columns=columns, filters=filters, memory_map=True)
+    elif path.endswith(ARROW_EXTENSIONS):
+        table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+        if documents is not None:
+            document = table.column('document')
+            if pa.types.is_dictionary(document.type):
+                document = document.cast(document.type.value_type)
+            table = table.filter(pc.is_in(document, value_set=pa.array(list(documents), type=document.type)))
+        return table.select(columns) if columns is not None else table
+    raise ValueError(f"Unsupported corpus format: {path}. Use .parquet, .arrow or .feather.")
+
+# Function to read a columnar corpus artifact into a DataFrame
+def read_corpus(path, columns=None, documents=None):
+    """Read a Parquet or Arrow corpus file into a DataFrame.
+    The "document" column comes back as a pandas categorical, the "label" column is decoded to
+    plain values so it can go straight into tensors and sklearn metrics.
+    Args:
+        path (str): The path to the corpus file.
+        columns (list): Optional subset of columns to read.
+        documents (list): Optional subset of documents to read.
+    Returns:
+        pandas.DataFrame: The corpus."""
+    data = read_corpus_table(path, columns=columns, documents=documents).to_pandas()
+    if 'label' in data and isinstance(data['label'].dtype, pd.CategoricalDtype):
+        data['label'] = data['label'].astype(data['label'].cat.categories.dtype)
+    return data
+
+# Function to find the file behind a corpus artifact name
+def resolve_corpus_path(path):
+    """Return the path of a corpus artifact.
+    An existing path is returned as is. For a path without an extension, or one whose file does
+    not exist, the columnar siblings (.parquet, .arrow, .feather) are tried before the TSV ones
+    (.csv, .tsv), so scripts can name an artifact once and read whichever format was built."""
+    if os.path.exists(path):
+        return path
+    stem, ext = os.path.splitext(path)
+    if ext not in PARQUET_EXTENSIONS + ARROW_EXTENSIONS + TSV_EXTENSIONS:
+        stem = path
+    for candidate_ext in PARQUET_EXTENSIONS + ARROW_EXTENSIONS + TSV_EXTENSIONS:
+        if os.path.exists(stem + candidate_ext):
+            return stem + candidate_ext
+    raise FileNotFoundError(f"No corpus artifact found for {path}")
+
+# Function to load a corpus artifact in any of the supported formats
+def load_corpus(path, columns=None, documents=None):
+    """Load a corpus artifact from Parquet, Arrow or the tab-separated MaChAmp format.
+    TSV artifacts get their "turn_length" column computed on load, so it is always available
+    when no column subset is requested.
+    Args:
+        path (str): The path to the artifact, with or without extension (see resolve_corpus_path).
+        columns (list): Optional subset of columns to read.
+        documents (list): Optional subset of documents to read.
+    Returns:
+        pandas.DataFrame: The corpus."""
+    path = resolve_corpus_path(path)
+    if path.endswith(TSV_EXTENSIONS):
+        usecols = columns if columns is None or documents is None or 'document' in columns else list(columns) + ['document']
+        data = pd.read_csv(path, sep='\t', usecols=usecols)
+        if documents is not None:
+            data = data[data['document'].isin(set(documents))].reset_index(drop=True)
+            data = data[columns] if columns is not None else data
+        if columns is None and 'turn_length' not in data:
+            data['turn_length'] = data['text'].str.split().str.len()
+        return data
+    return read_corpus(path, columns=columns, documents=documents)
+
+# Function to export a corpus artifact as MaChAmp training data
+def export_machamp(data, path):
+    """Write turns as a tab-separated file in the MaChAmp classification format.
+    Tabs and newlines in the text are replaced with spaces so every turn stays on one line.
+    Args:
+        data (pandas.DataFrame): The turns, with "text", "label" and "document" columns.
+        path (str): The output path."""
+    data = data[MACHAMP_COLUMNS].copy()
+    data['text'] = data['text'].str.replace(r'\t', ' ', regex=True)
+    data['text'] = data['text'].str.replace(r'\n', ' ', regex=True)
+    data.to_csv(path, index=False, sep='\t')
@@ -1,5 +1,14 @@
+import os
+import glob
+import time
+import json
+import hashlib
+from functools import partial
+
+import numpy as np
 import torch
-from torch.utils.data import DataLoader, Dataset, SubsetRandomSampler
+import transformers
+from torch.utils.data import DataLoader, Dataset, Sampler, SubsetRandomSampler
 
 class CustomDataset(Dataset):
     def __init__(self, dataframe, tokenizer, max_len):
@@ -25,7 +34,16 @@ class CustomDataset(Dataset):
         item['targets'] = self.targets[index]
         return item
     
-def create_data_loader(data, tokenizer, max_len, batch_size):
+def create_data_loader(data, tokenizer, max_len, batch_size, cache=None, shuffle=False):
+    if cache is not None:
+        # Pre-tokenized items in length buckets, padded to the longest item of each batch
+        ds = TokenizedDataset(data, tokenizer=tokenizer, max_len=max_len, cache=cache)
+        return DataLoader(
+            ds,
+            batch_sampler=LengthBucketBatchSampler(ds.lengths(), batch_size, shuffle=shuffle),
+            num_workers=4,
+            collate_fn=partial(collate_tokens, pad_token_id=tokenizer.pad_token_id)
+        )
     ds = CustomDataset(
         dataframe=data,
         tokenizer=tokenizer,
@@ -35,4 +53,258 @@ def create_data_loader(data, tokenizer, max_len, batch_size):
         ds,
         batch_size=batch_size,
         num_workers=4
-    )
\ No newline at end of file
+    )
+
+# Default location of the tokenization cache
+DEFAULT_TOKEN_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'pacs', 'tokens')
+
+# Function to hash the identity of a tokenizer
+def tokenizer_digest(tokenizer):
+    """Digest of everything that changes a tokenizer's output: class, name, library version and vocabulary."""
+    digest = hashlib.sha256()
+    for part in (type(tokenizer).__name__, tokenizer.name_or_path, transformers.__version__,
+                 getattr(tokenizer, 'truncation_side', 'right')):
+        digest.update(f'{part}\0'.encode('utf-8'))
+    digest.update(json.dumps(sorted(tokenizer.get_vocab().items())).encode('utf-8'))
+    return digest.hexdigest()
+
+# Function to hash a list of texts
+def texts_digest(texts):
+    """Digest of a sequence of texts, sensitive to their order."""
+    digest = hashlib.sha256()
+    for text in texts:
+        digest.update(hashlib.sha256(text.encode('utf-8')).digest())
+    return digest.hexdigest()
+
+class TokenCache:
+    """On-disk cache of tokenized corpora.
+
+    Each entry holds the input ids of all texts of a corpus as one flat token buffer (uint16 when
+    the vocabulary fits, int32 otherwise) plus an int64 offsets array, so text i is
+    tokens[offsets[i]:offsets[i + 1]]. Entries are keyed by the tokenizer digest, max_len and the
+    digest of the texts, and are memory-mapped on load, so a warm start reads nothing up front and
+    memory scales with the real number of tokens rather than N x max_len.
+
+    Args:
+        cache_dir (str): The directory holding the cache entries.
+    """
+    def __init__(self, cache_dir=DEFAULT_TOKEN_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, texts, tokenizer, max_len):
+        """Cache key of a corpus tokenized with a given tokenizer and max_len."""
+        return hashlib.sha256(f'{tokenizer_digest(tokenizer)}\0{max_len}\0{texts_digest(texts)}'.encode('utf-8')).hexdigest()
+
+    def _paths(self, key):
+        return (os.path.join(self.cache_dir, f'{key}.tokens.npy'),
+                os.path.join(self.cache_dir, f'{key}.offsets.npy'))
+
+    def get(self, key):
+        """Return the memory-mapped (tokens, offsets) of an entry, or None on a miss."""
+        tokens_path, offsets_path = self._paths(key)
+        # The offsets file is written last, so its presence marks a complete entry
+        if not os.path.exists(offsets_path):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return np.load(tokens_path, mmap_mode='r'), np.load(offsets_path, mmap_mode='r')
+
+    def put(self, key, tokens, offsets):
+        """Store the flat token buffer and offsets of a corpus."""
+        for path, array in zip(self._paths(key), (tokens, offsets)):
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp_path, path)
+
+    def load(self, texts, tokenizer, max_len):
+        """Return the memory-mapped (tokens, offsets) of texts, tokenizing and storing them on a miss."""
+        key = self.key(texts, tokenizer, max_len)
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        tokens, offsets = tokenize_flat(texts, tokenizer, max_len)
+        self.put(key, tokens, offsets)
+        return self.get(key)
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        for path in glob.glob(os.path.join(self.cache_dir, '*.npy')):
+            os.remove(path)
+
+# Function to tokenize texts into a flat token buffer
+def tokenize_flat(texts, tokenizer, max_len, batch_size=1024):
+    """Tokenize texts without padding into a flat token buffer and an offsets array.
+    Args:
+        texts (list): The texts to tokenize.
+        tokenizer: A Hugging Face tokenizer.
+        max_len (int): Texts are truncated to this many tokens, special tokens included. None
+            keeps the whole text without special tokens, as one token stream per text.
+        batch_size (int): Number of texts passed to the tokenizer at once.
+    Returns:
+        A tuple of (tokens, offsets) NumPy arrays."""
+    dtype = np.uint16 if len(tokenizer) <= np.iinfo(np.uint16).max + 1 else np.int32
+    lengths = np.zeros(len(texts), dtype=np.int64)
+    chunks = []
+    for start in range(0, len(texts), batch_size):
+        if max_len is None:
+            input_ids = tokenizer(list(texts[start:start + batch_size]), add_special_tokens=False, verbose=False)['input_ids']
+        else:
+            input_ids = tokenizer(list(texts[start:start + batch_size]), truncation=True, max_length=max_len)['input_ids']
+        for i, ids in enumerate(input_ids):
+            lengths[start + i] = len(ids)
+            chunks.append(np.asarray(ids, dtype=dtype))
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    tokens = np.concatenate(chunks) if chunks else np.zeros(0, dtype=dtype)
+    return tokens, offsets
+
+class TokenizedDataset(Dataset):
+    """Dataset over a memory-mapped, pre-tokenized corpus.
+
+    Items are unpadded: "input_ids" is a zero-copy NumPy view into the token buffer, so padding
+    and the conversion to int64 tensors happen once per batch in collate_tokens.
+
+    Args:
+        dataframe (pandas.DataFrame): The data, with "text" and "label" columns.
+        tokenizer: A Hugging Face tokenizer.
+        max_len (int): The maximum sequence length.
+        cache (TokenCache): The tokenization cache. Defaults to one in DEFAULT_TOKEN_CACHE_DIR.
+    """
+    def __init__(self, dataframe, tokenizer, max_len, cache=None):
+        self.data = dataframe
+        self.tokenizer = tokenizer
+        self.max_len = max_len
+        self.cache = cache if cache is not None else TokenCache()
+        start = time.perf_counter()
+        self.tokens, self.offsets = self.cache.load(self.data.text.tolist(), tokenizer, max_len)
+        self.tokenize_seconds = time.perf_counter() - start # Tokenizing, or loading from the cache
+        self.targets = torch.tensor(self.data.label.values)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def lengths(self):
+        """The number of tokens of every item."""
+        return np.diff(self.offsets)
+
+    def __getitem__(self, index):
+        return {'input_ids': self.tokens[self.offsets[index]:self.offsets[index + 1]],
+                'targets': self.targets[index]}
+
+# Function to pad a batch of pre-tokenized items
+def collate_tokens(batch, pad_token_id, max_len=None, pad_to_multiple_of=None):
+    """Pad the items of a TokenizedDataset into the batch layout of CustomDataset.
+    Args:
+        batch (list): The items.
+        pad_token_id (int): The id of the padding token.
+        max_len (int): The padded sequence length. None pads to the longest item in the batch.
+        pad_to_multiple_of (int): Round the dynamic padded length up to a multiple of this.
+    Returns:
+        dict: "input_ids" and "attention_mask" (batch x padded length, int64) and "targets"."""
+    if max_len is None:
+        max_len = max(len(item['input_ids']) for item in batch)
+        if pad_to_multiple_of is not None:
+            max_len = -(-max_len // pad_to_multiple_of) * pad_to_multiple_of
+    input_ids = torch.full((len(batch), max_len), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(batch), max_len), dtype=torch.long)
+    for i, item in enumerate(batch):
+        ids = item['input_ids']
+        input_ids[i, :len(ids)] = torch.from_numpy(ids.astype(np.int64))
+        attention_mask[i, :len(ids)] = 1
+    return {'input_ids': input_ids,
+            'attention_mask': attention_mask,
+            'targets': torch.stack([item['targets'] for item in batch])}
+
+class LengthBucketBatchSampler(Sampler):
+    """Batch sampler that groups items of similar length so dynamic padding wastes little compute.
+
+    Without shuffling, batches follow the items sorted by length. With shuffling, the items are
+    permuted, cut into buckets of batch_size * bucket_size_multiplier items, sorted by length
+    within each bucket and cut into batches, and the order of the batches is shuffled. Call
+    set_epoch at the start of every epoch to draw a new order, and skip_batches to resume an
+    epoch after the batches already trained on. For distributed training, every
+    process draws the same batches and keeps every num_replicas-th one starting at its rank,
+    repeating batches if needed so that all processes get the same number (unless pad_replicas
+    is False, for evaluation, where repeated batches would be counted twice).
+
+    Args:
+        lengths (array-like): The number of tokens of every item.
+        batch_size (int): The number of items per batch.
+        shuffle (bool): Shuffle the items within buckets and the order of the batches.
+        bucket_size_multiplier (int): The number of batches per bucket.
+        drop_last (bool): Drop the last incomplete batch of every bucket.
+        seed (int): The base seed of the shuffling.
+        num_replicas (int): The number of processes sharing the data.
+        rank (int): The rank of this process.
+        pad_replicas (bool): Repeat batches so that every process gets the same number.
+    """
+    def __init__(self, lengths, batch_size, shuffle=False, bucket_size_multiplier=50, drop_last=False, seed=0, num_replicas=1, rank=0,
+                 pad_replicas=True):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.bucket_size = batch_size * bucket_size_multiplier
+        self.drop_last = drop_last
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.pad_replicas = pad_replicas
+        self.epoch = 0
+        self.skip = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def skip_batches(self, num_batches):
+        """Leave out the first num_batches batches of the next iteration only (the data-order cursor of a resumed epoch)."""
+        self.skip = num_batches
+
+    def batches(self):
+        """The list of batches (lists of item indices) of the current epoch."""
+        if not self.shuffle:
+            order = np.argsort(self.lengths, kind='stable')
+            buckets = [order]
+        else:
+            rng = np.random.default_rng((self.seed, self.epoch))
+            order = rng.permutation(len(self.lengths))
+            buckets = [bucket[np.argsort(self.lengths[bucket], kind='stable')]
+                       for bucket in np.array_split(order, range(self.bucket_size, len(order), self.bucket_size))]
+
+        batches = []
+        for bucket in buckets:
+            for start in range(0, len(bucket), self.batch_size):
+                batch = bucket[start:start + self.batch_size]
+                if self.drop_last and len(batch) < self.batch_size:
+                    continue
+                batches.append(batch.tolist())
+
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        if self.num_replicas > 1:
+            padding = -len(batches) % self.num_replicas if self.pad_replicas else 0
+            batches = (batches + [batches[i % len(batches)] for i in range(padding)])[self.rank::self.num_replicas]
+        return batches
+
+    def __iter__(self):
+        skip, self.skip = self.skip, 0
+        return iter(self.batches()[skip:])
+
+    def __len__(self):
+        n = len(self.lengths)
+        bucket_sizes = [n] if not self.shuffle else [min(self.bucket_size, n - start) for start in range(0, n, self.bucket_size)]
+        if self.drop_last:
+            num_batches = sum(size // self.batch_size for size in bucket_sizes)
+        else:
+            num_batches = sum(-(-size // self.batch_size) for size in bucket_sizes)
+        if not self.pad_replicas:
+            return len(range(self.rank, num_batches, self.num_replicas))
+        return -(-num_batches // self.num_replicas)
+
+# Function to measure how much of a batch is real tokens rather than padding
+def padding_efficiency(real_tokens, padded_tokens):
+    """The share of non-padding tokens among all tokens fed to the model, between 0 and 1."""
+    return real_tokens / padded_tokens if padded_tokens else 1.0
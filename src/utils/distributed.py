@@ -0,0 +1,94 @@
+"""
+Multi-process data-parallel training on CPU with torch.distributed over the gloo backend.
+
+launch starts one worker process per replica on the local machine, each with its own share of
+the CPU threads, and sets up the process group. Inside a worker the Trainer wraps the model in
+DistributedDataParallel, data loaders are sharded with shard_loader and only rank 0 writes
+checkpoints and plots.
+"""
+import os
+import socket
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.utils.data import DataLoader, DistributedSampler
+
+# Function to check whether training runs in a process group
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+# Function to get the rank of the current process
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+# Function to get the number of processes
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+# Function to check whether the current process is the one that writes outputs
+def is_main_process():
+    return get_rank() == 0
+
+# Function to sum a tensor over all processes
+def all_reduce_sum(tensor):
+    """Sum a tensor over all processes in place and return it. A no-op outside a process group."""
+    if is_distributed():
+        dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def _worker(rank, world_size, port, threads_per_worker, fn, args):
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(port)
+    torch.set_num_threads(threads_per_worker)
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+    try:
+        fn(rank, world_size, *args)
+    finally:
+        dist.destroy_process_group()
+
+# Function to run a training function in several local processes
+def launch(fn, world_size, args=(), threads_per_worker=None):
+    """Run fn(rank, world_size, *args) in world_size local processes joined in a gloo process group.
+    Args:
+        fn (callable): The function to run. Must be importable (defined at module level).
+        world_size (int): The number of processes.
+        args (tuple): Extra arguments passed to fn.
+        threads_per_worker (int): The intra-op threads of each process. Defaults to an even share of the cores."""
+    if threads_per_worker is None:
+        threads_per_worker = max(1, (os.cpu_count() or 1) // world_size)
+    mp.spawn(_worker, args=(world_size, _free_port(), threads_per_worker, fn, args), nprocs=world_size, join=True)
+
+# Function to shard a data loader over the processes
+def shard_loader(loader, shuffle=False, seed=0, pad=True):
+    """Return a copy of a data loader that only yields this process's share of the data.
+    Loaders with a LengthBucketBatchSampler shard its batches; other loaders get a DistributedSampler.
+    With pad, every process gets the same number of batches, padding with repeated data where
+    needed, as DDP training steps require. Evaluation loaders must not be padded: their sums are
+    all-reduced, so repeated data would be counted twice.
+    Args:
+        loader (DataLoader): The data loader.
+        shuffle (bool): Shuffle the data (only used with a DistributedSampler).
+        seed (int): The shuffling seed, shared by all processes.
+        pad (bool): Repeat data so that all processes get the same number of batches.
+    Returns:
+        DataLoader: The sharded loader. The loader itself outside a process group."""
+    if not is_distributed():
+        return loader
+    batch_sampler = loader.batch_sampler
+    if hasattr(batch_sampler, 'num_replicas'):
+        batch_sampler.num_replicas = get_world_size()
+        batch_sampler.rank = get_rank()
+        batch_sampler.pad_replicas = pad
+        return DataLoader(loader.dataset, batch_sampler=batch_sampler, collate_fn=loader.collate_fn, num_workers=loader.num_workers)
+    if not pad:
+        # Every index exactly once over all processes
+        sampler = list(range(get_rank(), len(loader.dataset), get_world_size()))
+        return DataLoader(loader.dataset, batch_size=loader.batch_size, sampler=sampler, collate_fn=loader.collate_fn, num_workers=loader.num_workers)
+    sampler = DistributedSampler(loader.dataset, num_replicas=get_world_size(), rank=get_rank(), shuffle=shuffle, seed=seed)
+    return DataLoader(loader.dataset, batch_size=loader.batch_size, sampler=sampler, collate_fn=loader.collate_fn, num_workers=loader.num_workers)
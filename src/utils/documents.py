@@ -0,0 +1,160 @@
+"""
+Document-level prediction from chunk-level classifiers.
+
+The classifier scores chunks (combined turns or fixed-size word chunks), but a diagnosis is made
+per transcript. predict_documents streams the chunks of every document through an
+InferenceEngine in rounds: each round takes the next few chunks of every document that is still
+undecided, runs them in shared token-budgeted batches, folds their log-probabilities into a
+DocumentAggregate and throws the chunk outputs away. A document leaves the stream at its last
+chunk, or earlier once its decision is statistically settled, so memory per document is a few
+running sums and most chunks of clear-cut transcripts are never tokenized or run.
+"""
+import numpy as np
+import pandas as pd
+from scipy.stats import t as student_t
+from tqdm import tqdm
+
+# Ways to aggregate the chunk predictions of a document
+AGGREGATION_METHODS = ['mean_log_prob', 'majority_vote', 'confidence_weighted']
+
+class DocumentAggregate:
+    """Running aggregate of the chunk predictions of one document.
+    Keeps the sum of the log-probabilities and their products (for the variance of the
+    differences between classes), the votes, and the probabilities weighted by confidence.
+
+    Args:
+        num_classes (int): The number of classes.
+    """
+    def __init__(self, num_classes):
+        self.num_classes = num_classes
+        self.chunks = 0
+        self.log_prob_sum = np.zeros(num_classes)
+        self.log_prob_products = np.zeros((num_classes, num_classes))
+        self.votes = np.zeros(num_classes)
+        self.weighted_probabilities = np.zeros(num_classes)
+        self.weight_sum = 0.0
+
+    def update(self, log_probs):
+        """Add chunks, given as their log-probabilities (chunks, num_classes)."""
+        log_probs = np.asarray(log_probs, dtype=np.float64).reshape(-1, self.num_classes)
+        probabilities = np.exp(log_probs)
+        confidence = probabilities.max(axis=1)
+        self.chunks += len(log_probs)
+        self.log_prob_sum += log_probs.sum(axis=0)
+        self.log_prob_products += log_probs.T @ log_probs
+        self.votes += np.bincount(log_probs.argmax(axis=1), minlength=self.num_classes)
+        self.weighted_probabilities += confidence @ probabilities
+        self.weight_sum += confidence.sum()
+
+    def scores(self, method='mean_log_prob'):
+        """The document scores of the classes under an aggregation method (one of AGGREGATION_METHODS):
+        the mean log-probability, the share of votes (ties broken by the mean log-probability) or
+        the confidence-weighted mean probability."""
+        if self.chunks == 0:
+            return np.full(self.num_classes, np.nan)
+        if method == 'mean_log_prob':
+            return self.log_prob_sum / self.chunks
+        if method == 'majority_vote':
+            return self.votes / self.chunks + 1e-6 * np.exp(self.log_prob_sum / self.chunks)
+        if method == 'confidence_weighted':
+            return self.weighted_probabilities / self.weight_sum
+        raise ValueError(f"Unknown aggregation method {method}, expected one of {AGGREGATION_METHODS}")
+
+    def predict(self, method='mean_log_prob'):
+        """The predicted class of the document under an aggregation method."""
+        return int(np.argmax(self.scores(method)))
+
+    def margin_t(self):
+        """The smallest t statistic of the mean per-chunk log-probability difference between the
+        leading class and any other class. Large values mean more chunks are unlikely to change
+        the leader."""
+        if self.chunks < 2:
+            return 0.0
+        n = self.chunks
+        mean = self.log_prob_sum / n
+        second_moment = self.log_prob_products / n
+        leader = int(np.argmax(mean))
+        t = np.inf
+        for other in range(self.num_classes):
+            if other == leader:
+                continue
+            difference = mean[leader] - mean[other]
+            variance = (second_moment[leader, leader] + second_moment[other, other] - 2 * second_moment[leader, other]
+                        - difference ** 2) * n / (n - 1)
+            t = min(t, difference / np.sqrt(max(variance, 1e-12) / n))
+        return float(t)
+
+    def settled(self, confidence=0.99, min_chunks=8):
+        """Whether the leading class of the mean log-probability is ahead of every other class with
+        the given one-sided confidence, after at least min_chunks chunks. The margin is compared with
+        the Student-t quantile with chunks - 1 degrees of freedom, since the variance is estimated
+        from the same few chunks. The test is repeated after every round without correction, so use
+        a high confidence."""
+        return (self.chunks >= max(min_chunks, 2)
+                and self.margin_t() > student_t.ppf(confidence, df=self.chunks - 1))
+
+# Function to turn logits into log-probabilities
+def log_softmax(logits):
+    """Numerically stable log-softmax over the last axis of a NumPy array."""
+    shifted = logits - logits.max(axis=-1, keepdims=True)
+    return shifted - np.log(np.exp(shifted).sum(axis=-1, keepdims=True))
+
+# Function to predict documents from their chunks
+def predict_documents(engine, data, method='mean_log_prob', early_stopping=True, confidence=0.99, min_chunks=8,
+                      chunks_per_round=4, num_classes=None, progress=False):
+    """Predict every document of a chunk DataFrame by streaming its chunks through a classifier.
+    Args:
+        engine (InferenceEngine): The chunk classifier. Chunks in its prediction cache, if any, are not run again.
+        data (pandas.DataFrame): Chunks with columns "text" and "document" in transcript order,
+            e.g. from combine_turns. A "label" column is carried over per document.
+        method (str): The aggregation method that makes the prediction (see AGGREGATION_METHODS).
+            The predictions of the other methods are returned as well.
+        early_stopping (bool): Stop reading a document once DocumentAggregate.settled.
+        confidence (float): The confidence of the early stopping test.
+        min_chunks (int): The fewest chunks read from a document before it can stop early.
+        chunks_per_round (int): Chunks taken from every undecided document per round.
+        num_classes (int): The number of classes. Defaults to the number of labels of the engine.
+        progress (bool): Show a progress bar over chunks.
+    Returns:
+        pandas.DataFrame: One row per document with its label (if given), the predicted class and
+        scores of method, the prediction of every method, the number of chunks read and in total,
+        and whether the document stopped early."""
+    if method not in AGGREGATION_METHODS:
+        raise ValueError(f"Unknown aggregation method {method}, expected one of {AGGREGATION_METHODS}")
+    num_classes = num_classes or engine.num_labels
+    groups = data.groupby('document', sort=False).indices
+    texts = data['text'].to_numpy()
+    aggregates = {document: DocumentAggregate(num_classes) for document in groups}
+    active = list(groups)
+
+    with tqdm(total=len(data), desc="Documents", disable=not progress) as bar:
+        while active:
+            # Take the next chunks of every undecided document
+            round_rows = [groups[document][aggregates[document].chunks:aggregates[document].chunks + chunks_per_round]
+                          for document in active]
+            round_sizes = np.cumsum([0] + [len(rows) for rows in round_rows])
+            round_rows = np.concatenate(round_rows)
+            logits, _ = engine.predict(texts[round_rows])
+            log_probs = log_softmax(logits)
+
+            # Fold them into the running aggregates and drop the documents that are done
+            for i, document in enumerate(active):
+                aggregates[document].update(log_probs[round_sizes[i]:round_sizes[i + 1]])
+            bar.update(len(round_rows))
+            active = [document for document in active
+                      if aggregates[document].chunks < len(groups[document])
+                      and not (early_stopping and aggregates[document].settled(confidence, min_chunks))]
+
+    results = []
+    for document, aggregate in aggregates.items():
+        row = {'document': document}
+        if 'label' in data:
+            row['label'] = data['label'].iat[groups[document][0]]
+        row['prediction'] = aggregate.predict(method)
+        row.update({f'score_{i}': score for i, score in enumerate(aggregate.scores(method))})
+        row.update({f'prediction_{name}': aggregate.predict(name) for name in AGGREGATION_METHODS})
+        row.update({'chunks_read': aggregate.chunks,
+                    'chunks_total': len(groups[document]),
+                    'stopped_early': aggregate.chunks < len(groups[document])})
+        results.append(row)
+    return pd.DataFrame(results)
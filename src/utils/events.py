@@ -0,0 +1,62 @@
+"""
+Append-only event log of a training run.
+
+The Trainer writes one JSON object per line for every epoch's metrics, checkpoint and early stop,
+flushed as it goes, so the log is readable while training runs and survives a crash. Resumed runs
+continue in the model folder of their checkpoint and append to the same log. Plots are rendered from the log afterwards by utils.report, which keeps
+matplotlib out of the training processes.
+"""
+import json
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+
+# Default file name of the event log in a model folder
+EVENTS_NAME = 'events.jsonl'
+
+def _to_json(value):
+    # Tensors and arrays become (nested) lists, NumPy scalars plain numbers
+    if isinstance(value, (torch.Tensor, np.ndarray)):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot log a value of type {type(value).__name__}")
+
+class EventLog:
+    """Appends events as JSON lines to a file.
+
+    Args:
+        path (str): The log file, created if needed and appended to otherwise.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a', buffering=1)
+
+    def log(self, event, **fields):
+        """Append an event with a timestamp and the given fields (numbers, strings, lists, tensors or arrays)."""
+        record = {'event': event, 'time': time.time(), **fields}
+        self.file.write(json.dumps(record, default=_to_json) + '\n')
+
+    def close(self):
+        self.file.close()
+
+# Function to read an event log
+def read_events(path, event=None):
+    """Read an event log into a DataFrame with one row per event.
+    Args:
+        path (str): The log file.
+        event (str): Optional event type to keep, e.g. "epoch".
+    Returns:
+        pandas.DataFrame: The events in the order they were written."""
+    records = []
+    with open(path) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue # A line cut short by a crash
+    if event is not None:
+        records = [record for record in records if record['event'] == event]
+    return pd.DataFrame.from_records(records)
@@ -0,0 +1,219 @@
+"""
+Batched inference over pre-tokenized texts.
+
+Inputs are sorted by token length and cut into batches with a budget of padded tokens, so short
+turns are run many at a time and long ones in small batches, with almost no padding. Batches run
+under torch.inference_mode and the outputs are put back in the original order of the inputs.
+The model can be a PyTorch module or any callable backend that maps NumPy input_ids and
+attention_mask arrays to logits, such as utils.onnx_backend.OnnxBackend. With a
+utils.prediction_cache.PredictionCache, texts scored before by the same model are looked up
+instead of being tokenized and run again.
+"""
+import time
+
+import numpy as np
+import torch
+from tqdm import tqdm
+from transformers import AutoModelForSequenceClassification
+
+from utils.dataset import tokenize_flat
+from utils.acceleration import autocast
+from utils.quantization import quantized_structure
+from utils.prediction_cache import prediction_namespace, text_key
+
+# Function to group sequences into batches with a budget of padded tokens
+def token_budget_batches(lengths, max_tokens, max_batch_size=None):
+    """Sort sequences by length and group them so that every batch, padded to its longest
+    sequence, has at most max_tokens tokens. Longest sequences come first, so running out of
+    memory shows up in the first batch.
+    Args:
+        lengths (array-like): The number of tokens of every sequence.
+        max_tokens (int): The padded token budget of a batch. A sequence longer than the budget gets a batch of its own.
+        max_batch_size (int): Optional cap on the number of sequences per batch.
+    Returns:
+        list: Arrays of sequence indices, one per batch."""
+    lengths = np.asarray(lengths)
+    order = np.argsort(-lengths, kind='stable')
+    batches, start = [], 0
+    while start < len(order):
+        # The first sequence is the longest, so it sets the padded length of the batch
+        size = max(1, max_tokens // max(int(lengths[order[start]]), 1))
+        if max_batch_size is not None:
+            size = min(size, max_batch_size)
+        batches.append(order[start:start + size])
+        start += size
+    return batches
+
+# Function to load a fine-tuned classifier from a Trainer checkpoint
+def load_classifier(model_id, checkpoint_path=None, num_labels=3, id2label=None):
+    """Instantiate a sequence classification model and load the weights of a checkpoint written by
+    Trainer.save, or of a quantized model written by utils.quantization.save_quantized.
+    Args:
+        model_id (str): The base model the checkpoint was fine-tuned from.
+        checkpoint_path (str): The checkpoint. None returns the base model.
+        num_labels (int): The number of classes.
+        id2label (dict): Optional class names by id.
+    Returns:
+        torch.nn.Module: The model on the CPU in evaluation mode, quantized if the checkpoint is."""
+    kwargs = {'id2label': id2label, 'label2id': {label: i for i, label in id2label.items()}} if id2label else {}
+    model = AutoModelForSequenceClassification.from_pretrained(model_id, num_labels=num_labels, **kwargs)
+    if checkpoint_path is not None:
+        checkpoint = torch.load(checkpoint_path, map_location=torch.device('cpu'))
+        if checkpoint.get('quantization'):
+            model = quantized_structure(model, checkpoint['quantization'])
+        model.load_state_dict(checkpoint['model_state_dict'])
+    return model.eval()
+
+class InferenceEngine:
+    """Runs a sequence classification model over many inputs with length-sorted, token-budgeted batches.
+
+    Args:
+        model: A Hugging Face model for sequence classification, or a callable backend taking
+            int64 NumPy input_ids and attention_mask arrays and returning logits.
+        tokenizer: The tokenizer of the model, used by predict and for the padding token.
+        max_len (int): Texts are truncated to this many tokens.
+        max_tokens (int): The padded token budget of a batch.
+        max_batch_size (int): Optional cap on the number of sequences per batch.
+        device (torch.device): The device to run on.
+        bf16 (bool): Run under bf16 autocast (see utils.acceleration.bf16_supported).
+        num_labels (int): The number of classes, only needed for empty inputs to a callable backend.
+        cache (PredictionCache): Optional cache of the logits of predict and predict_dataset. The
+            model is fingerprinted on first use, so create a new engine after changing its weights.
+    """
+    def __init__(self, model, tokenizer, max_len=512, max_tokens=16384, max_batch_size=None,
+                 device=torch.device('cpu'), bf16=False, num_labels=None, cache=None):
+        self.model = model
+        self.num_labels = num_labels if num_labels is not None else getattr(getattr(model, 'config', None), 'num_labels', 0)
+        self.tokenizer = tokenizer
+        self.max_len = max_len
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.device = device
+        self.bf16 = bf16
+        self.pad_token_id = tokenizer.pad_token_id
+        self.cache = cache
+        self.cache_namespace = None
+
+    def predict(self, texts, progress=False):
+        """Tokenize texts and return their (logits, probabilities) as NumPy arrays in input order."""
+        texts = list(texts)
+        if self.cache is None:
+            tokens, offsets = tokenize_flat(texts, self.tokenizer, self.max_len)
+            return self.predict_tokens(tokens, offsets, progress=progress)
+        return self._predict_cached(texts, lambda indices: tokenize_flat([texts[i] for i in indices], self.tokenizer, self.max_len), progress)
+
+    def predict_dataset(self, dataset, progress=False):
+        """Return the (logits, probabilities) of the items of a TokenizedDataset in dataset order."""
+        if self.cache is None:
+            return self.predict_tokens(dataset.tokens, dataset.offsets, progress=progress)
+        return self._predict_cached(dataset.data.text.tolist(), lambda indices: _select_sequences(dataset.tokens, dataset.offsets, indices), progress)
+
+    def _predict_cached(self, texts, tokenize, progress):
+        # Look the texts up in the cache, run the model on the misses only and store their logits
+        if self.cache_namespace is None:
+            self.cache_namespace = prediction_namespace(self.model, self.tokenizer, self.max_len, self.bf16)
+        keys = [text_key(text) for text in texts]
+        cached = self.cache.get_many(self.cache_namespace, keys)
+        missing = [i for i, logits in enumerate(cached) if logits is None]
+        if missing:
+            tokens, offsets = tokenize(missing)
+            missing_logits, _ = self.predict_tokens(tokens, offsets, progress=progress)
+            self.cache.put_many(self.cache_namespace, [keys[i] for i in missing], missing_logits)
+            for i, logits in zip(missing, missing_logits):
+                cached[i] = logits
+        logits = np.stack(cached).astype(np.float32) if cached else np.zeros((0, self.num_labels), dtype=np.float32)
+        return logits, softmax(logits)
+
+    def predict_tokens(self, tokens, offsets, progress=False):
+        """Run the model over sequences stored in a flat token buffer (see tokenize_flat).
+        Args:
+            tokens (numpy.ndarray): The concatenated token ids.
+            offsets (numpy.ndarray): Sequence i is tokens[offsets[i]:offsets[i + 1]].
+            progress (bool): Show a progress bar.
+        Returns:
+            A tuple of (logits, probabilities), float32 arrays of shape (sequences, classes) in input order."""
+        lengths = np.diff(offsets)
+        batches = token_budget_batches(lengths, self.max_tokens, self.max_batch_size)
+        logits = None
+        if isinstance(self.model, torch.nn.Module):
+            self.model.eval()
+        with torch.inference_mode():
+            for indices in tqdm(batches, desc="Inference", disable=not progress):
+                batch_logits = self.forward(self._pad(tokens, offsets, indices))
+                if logits is None:
+                    logits = np.empty((len(lengths), batch_logits.shape[1]), dtype=np.float32)
+                logits[indices] = batch_logits
+        if logits is None:
+            logits = np.zeros((0, self.num_labels), dtype=np.float32)
+        return logits, softmax(logits)
+
+    def forward(self, batch):
+        """Return the logits of a padded batch as a float32 NumPy array."""
+        if not isinstance(self.model, torch.nn.Module):
+            return np.asarray(self.model(batch['input_ids'].numpy(), batch['attention_mask'].numpy()), dtype=np.float32)
+        input_ids = batch['input_ids'].to(self.device)
+        attention_mask = batch['attention_mask'].to(self.device)
+        with autocast(self.device, self.bf16):
+            logits = self.model(input_ids, attention_mask=attention_mask).logits
+        return logits.float().cpu().numpy()
+
+    def _pad(self, tokens, offsets, indices):
+        # Pad the sequences of a batch to its longest one
+        max_len = int(max(offsets[i + 1] - offsets[i] for i in indices))
+        input_ids = np.full((len(indices), max_len), self.pad_token_id, dtype=np.int64)
+        attention_mask = np.zeros((len(indices), max_len), dtype=np.int64)
+        for row, i in enumerate(indices):
+            length = offsets[i + 1] - offsets[i]
+            input_ids[row, :length] = tokens[offsets[i]:offsets[i + 1]]
+            attention_mask[row, :length] = 1
+        return {'input_ids': torch.from_numpy(input_ids), 'attention_mask': torch.from_numpy(attention_mask)}
+
+# Function to take some sequences of a flat token buffer
+def _select_sequences(tokens, offsets, indices):
+    lengths = offsets[np.asarray(indices) + 1] - offsets[np.asarray(indices)]
+    selected_offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=selected_offsets[1:])
+    selected = [tokens[offsets[i]:offsets[i + 1]] for i in indices]
+    return (np.concatenate(selected) if selected else tokens[:0]), selected_offsets
+
+# Function to turn logits into probabilities
+def softmax(logits):
+    """Numerically stable softmax over the last axis of a NumPy array."""
+    shifted = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return shifted / shifted.sum(axis=-1, keepdims=True)
+
+# Function to compare the speed of inference engines
+def compare_engines(engines, tokens, offsets, repeats=3, single_sequences=32):
+    """Time engines on the same inputs: throughput over all sequences with token-budgeted batches,
+    and the latency of scoring one sequence at a time.
+    Args:
+        engines (dict): InferenceEngines by name.
+        tokens (numpy.ndarray): The concatenated token ids (see tokenize_flat).
+        offsets (numpy.ndarray): The offsets of the sequences in tokens.
+        repeats (int): Timed passes over all sequences per engine, after one untimed warm-up pass.
+        single_sequences (int): Number of sequences scored one at a time for the latency.
+    Returns:
+        list: One dict per engine with samples/s, tokens/s and the median and 95th percentile single-sequence latency in ms."""
+    num_sequences = len(offsets) - 1
+    num_tokens = int(offsets[-1] - offsets[0])
+    results = []
+    for name, engine in engines.items():
+        engine.predict_tokens(tokens, offsets)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            engine.predict_tokens(tokens, offsets)
+        seconds = (time.perf_counter() - start) / repeats
+
+        latencies = []
+        for i in range(min(single_sequences, num_sequences)):
+            single_offsets = np.array([0, offsets[i + 1] - offsets[i]])
+            single_tokens = tokens[offsets[i]:offsets[i + 1]]
+            start = time.perf_counter()
+            engine.predict_tokens(single_tokens, single_offsets)
+            latencies.append(1000 * (time.perf_counter() - start))
+        results.append({'backend': name,
+                        'samples_per_s': num_sequences / seconds,
+                        'tokens_per_s': num_tokens / seconds,
+                        'median_latency_ms': float(np.median(latencies)) if latencies else None,
+                        'p95_latency_ms': float(np.percentile(latencies, 95)) if latencies else None})
+    return results
@@ -0,0 +1,101 @@
+"""
+Memory planning for training under a fixed memory budget.
+
+Training memory is estimated rather than probed: parameters, gradients and the two AdamW moment
+buffers take four times the parameter bytes, and the activations kept for backward are measured
+with saved-tensor hooks on a forward pass at micro-batches of one and two sequences of max_len
+tokens. Activations grow linearly with the micro-batch, so the two measurements give the
+per-sequence cost and the largest micro-batch that fits the budget. This avoids trial runs that
+would get a CPU process killed by the OOM killer instead of raising an error.
+"""
+import math
+
+import torch
+
+# Function to measure the bytes of the tensors saved for backward during a forward pass
+def activation_bytes(model, batch_size, seq_len, device, loss_fn=None):
+    """Return the bytes of the distinct tensors autograd saves for backward in one forward pass.
+    Args:
+        model: A Hugging Face model for sequence classification.
+        batch_size (int): The number of sequences.
+        seq_len (int): The length of every sequence.
+        device (torch.device): The device of the model.
+        loss_fn: Optional loss function included in the forward pass.
+    Returns:
+        int: The number of bytes."""
+    seen = set()
+    total = [0]
+
+    def pack(tensor):
+        storage = tensor.untyped_storage()
+        key = (storage.data_ptr(), storage.nbytes())
+        if key not in seen:
+            seen.add(key)
+            total[0] += storage.nbytes()
+        return tensor
+
+    input_ids = torch.full((batch_size, seq_len), 3, dtype=torch.long, device=device)
+    attention_mask = torch.ones_like(input_ids)
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        logits = model(input_ids, attention_mask=attention_mask).logits
+        if loss_fn is not None:
+            loss_fn(logits, torch.zeros(batch_size, dtype=torch.long, device=device))
+    return total[0]
+
+# Function to estimate the memory needed to train a model
+def training_memory(model, batch_size, seq_len, device, loss_fn=None, optimizer_states=2):
+    """Estimate the peak training memory of a micro-batch in bytes.
+    Args:
+        model: A Hugging Face model for sequence classification.
+        batch_size (int): The micro-batch size.
+        seq_len (int): The sequence length.
+        device (torch.device): The device of the model.
+        loss_fn: Optional loss function.
+        optimizer_states (int): Number of optimizer buffers per parameter (2 for Adam/AdamW).
+    Returns:
+        int: The estimated number of bytes."""
+    fixed, per_sequence = _activation_model(model, seq_len, device, loss_fn)
+    return _parameter_bytes(model, optimizer_states) + fixed + per_sequence * batch_size
+
+def _parameter_bytes(model, optimizer_states):
+    # Parameters, their gradients and the optimizer buffers
+    parameter_bytes = sum(p.numel() * p.element_size() for p in model.parameters() if p.requires_grad)
+    return parameter_bytes * (2 + optimizer_states)
+
+def _activation_model(model, seq_len, device, loss_fn):
+    # Activation bytes are fixed + per_sequence * batch_size
+    was_training = model.training
+    model.train()
+    one = activation_bytes(model, 1, seq_len, device, loss_fn)
+    two = activation_bytes(model, 2, seq_len, device, loss_fn)
+    model.train(was_training)
+    per_sequence = max(two - one, 1)
+    return max(one - per_sequence, 0), per_sequence
+
+# Function to split a batch into micro-batches that fit a memory budget
+def plan_micro_batches(model, batch_size, seq_len, memory_budget_bytes, device, loss_fn=None, optimizer_states=2):
+    """Pick the largest micro-batch that fits the memory budget and the accumulation steps to reach batch_size.
+    Sizes are planned for full-length sequences, so batches padded to shorter lengths always fit.
+    Args:
+        model: A Hugging Face model for sequence classification.
+        batch_size (int): The effective batch size to reach.
+        seq_len (int): The maximum sequence length.
+        memory_budget_bytes (int): The memory available for training.
+        device (torch.device): The device of the model.
+        loss_fn: Optional loss function.
+        optimizer_states (int): Number of optimizer buffers per parameter (2 for Adam/AdamW).
+    Returns:
+        A tuple of (micro-batch size, accumulation steps)."""
+    fixed, per_sequence = _activation_model(model, seq_len, device, loss_fn)
+    available = memory_budget_bytes - _parameter_bytes(model, optimizer_states) - fixed
+    micro_batch_size = min(batch_size, int(available // per_sequence))
+    if micro_batch_size < 1:
+        needed = _parameter_bytes(model, optimizer_states) + fixed + per_sequence
+        raise MemoryError(f"A single sequence of {seq_len} tokens needs about {needed / 1024**3:.2f} GB, "
+                          f"more than the budget of {memory_budget_bytes / 1024**3:.2f} GB. "
+                          f"Try gradient checkpointing or a shorter max_len.")
+
+    # Spread the batch evenly over the accumulation steps
+    accumulation_steps = math.ceil(batch_size / micro_batch_size)
+    micro_batch_size = math.ceil(batch_size / accumulation_steps)
+    return micro_batch_size, accumulation_steps
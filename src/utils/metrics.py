@@ -0,0 +1,68 @@
+"""
+Streaming classification metrics for the training loop.
+
+A single confusion matrix is updated from the argmax of every batch's logits, on the device of the
+logits and without synchronising with the host. Per-class accuracy, precision, recall and F1 are
+derived from it once per epoch, after summing the matrix over all processes in distributed training.
+"""
+import numpy as np
+import torch
+
+from utils.distributed import all_reduce_sum
+
+class ConfusionMatrix:
+    """Confusion matrix accumulated over batches, rows are true classes and columns predictions.
+
+    Args:
+        num_classes (int): The number of classes.
+    """
+    def __init__(self, num_classes):
+        self.num_classes = num_classes
+        self.matrix = None
+
+    def update(self, logits, labels):
+        """Add a batch of logits (batch, num_classes) and integer labels (batch,)."""
+        predictions = logits.detach().argmax(dim=1)
+        counts = torch.bincount(labels * self.num_classes + predictions, minlength=self.num_classes ** 2)
+        counts = counts.reshape(self.num_classes, self.num_classes)
+        self.matrix = counts if self.matrix is None else self.matrix + counts.to(self.matrix.device)
+
+    def compute(self):
+        """Sum the matrix over all processes and derive the per-class metrics.
+        Returns:
+            dict: "confusion_matrix" and per-class "accuracy" (as torchmetrics multiclass accuracy with
+            average=None, i.e. the recall of each class), "precision", "recall" and "f1" on the CPU.
+            Classes without support or predictions get 0."""
+        matrix = torch.zeros(self.num_classes, self.num_classes, dtype=torch.long) if self.matrix is None else self.matrix.cpu()
+        matrix = all_reduce_sum(matrix.clone())
+        true_positives = matrix.diag().double()
+        support = matrix.sum(dim=1).double()
+        predicted = matrix.sum(dim=0).double()
+        recall = torch.where(support > 0, true_positives / support.clamp(min=1), torch.zeros_like(support))
+        precision = torch.where(predicted > 0, true_positives / predicted.clamp(min=1), torch.zeros_like(predicted))
+        f1 = torch.where(precision + recall > 0, 2 * precision * recall / (precision + recall).clamp(min=1e-12), torch.zeros_like(recall))
+        return {'confusion_matrix': matrix,
+                'accuracy': recall.float(),
+                'precision': precision.float(),
+                'recall': recall.float(),
+                'f1': f1.float()}
+
+    def reset(self):
+        self.matrix = None
+
+    def state_dict(self):
+        """A CPU copy of the counts of this process, for checkpoints."""
+        if self.matrix is None:
+            return torch.zeros(self.num_classes, self.num_classes, dtype=torch.long)
+        return self.matrix.detach().to('cpu', copy=True)
+
+    def load_state_dict(self, matrix):
+        self.matrix = matrix.clone()
+
+# Function to compute the metrics of a set of predictions at once
+def classification_metrics(logits, labels, num_classes):
+    """Per-class metrics and confusion matrix (see ConfusionMatrix.compute) of logits or
+    probabilities (samples, num_classes) against integer labels, given as arrays or tensors."""
+    matrix = ConfusionMatrix(num_classes)
+    matrix.update(torch.tensor(np.asarray(logits)), torch.tensor(np.asarray(labels), dtype=torch.long))
+    return matrix.compute()
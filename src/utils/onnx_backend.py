@@ -0,0 +1,116 @@
+"""
+ONNX export and an ONNX Runtime backend for CPU inference.
+
+export_onnx turns a fine-tuned classifier into an ONNX graph whose batch and sequence axes are
+dynamic, so the length-sorted batches of utils.inference.InferenceEngine run without padding to
+a fixed shape. OnnxBackend runs the graph with ONNX Runtime and plugs into InferenceEngine in
+place of the PyTorch model. onnx and onnxruntime are optional dependencies, only imported here.
+"""
+import os
+import inspect
+
+import numpy as np
+import torch
+
+# Default ONNX opset of exported graphs
+DEFAULT_OPSET = 17
+
+class _LogitsOnly(torch.nn.Module):
+    # Exposes the model as (input_ids, attention_mask) -> logits for tracing
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+# Function to export a classifier to ONNX
+def export_onnx(model, output_path, opset=DEFAULT_OPSET, sample_length=16):
+    """Export a sequence classification model to an ONNX graph with dynamic batch and sequence axes.
+    The graph has int64 inputs "input_ids" and "attention_mask" (batch, sequence) and the output
+    "logits" (batch, classes). The file is written atomically.
+    Args:
+        model (torch.nn.Module): The model, e.g. from utils.inference.load_classifier.
+        output_path (str): The path of the .onnx file.
+        opset (int): The ONNX opset version.
+        sample_length (int): The sequence length of the example input used for tracing.
+    Returns:
+        str: output_path."""
+    model = model.to('cpu').eval()
+    input_ids = torch.full((2, sample_length), 3, dtype=torch.long)
+    attention_mask = torch.ones_like(input_ids)
+    attention_mask[1, sample_length // 2:] = 0 # Trace with padding, so the mask stays an input
+
+    dynamic_axes = {'input_ids': {0: 'batch', 1: 'sequence'},
+                    'attention_mask': {0: 'batch', 1: 'sequence'},
+                    'logits': {0: 'batch'}}
+    kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        kwargs['dynamo'] = False # The TorchScript exporter handles dynamic_axes the same on every version
+
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{output_path}.tmp{os.getpid()}"
+    try:
+        with torch.no_grad():
+            torch.onnx.export(_LogitsOnly(model), (input_ids, attention_mask), tmp_path,
+                              input_names=['input_ids', 'attention_mask'], output_names=['logits'],
+                              dynamic_axes=dynamic_axes, opset_version=opset, do_constant_folding=True, **kwargs)
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return output_path
+
+class OnnxBackend:
+    """Runs an exported ONNX classifier with ONNX Runtime on the CPU.
+    Called with int64 NumPy input_ids and attention_mask arrays, it returns the logits, so it can
+    be passed to InferenceEngine as the model.
+
+    Args:
+        path (str): The .onnx file.
+        threads (int): Intra-op threads. None lets ONNX Runtime use all cores.
+        optimized_path (str): Optionally save the graph after ONNX Runtime's optimizations, to
+            skip them when the same model is loaded again.
+    """
+    def __init__(self, path, threads=None, optimized_path=None):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError("The ONNX backend needs onnxruntime: pip install onnxruntime") from e
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads is not None:
+            options.intra_op_num_threads = threads
+        if optimized_path is not None:
+            options.optimized_model_filepath = optimized_path
+        self.path = path
+        self.session = onnxruntime.InferenceSession(path, sess_options=options, providers=['CPUExecutionProvider'])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def __call__(self, input_ids, attention_mask):
+        feed = {'input_ids': np.ascontiguousarray(input_ids, dtype=np.int64),
+                'attention_mask': np.ascontiguousarray(attention_mask, dtype=np.int64)}
+        feed = {name: value for name, value in feed.items() if name in self.input_names}
+        return self.session.run(['logits'], feed)[0]
+
+# Function to check that two inference engines give the same results
+def check_parity(reference, candidate, tokens, offsets, atol=1e-4):
+    """Compare the logits of two InferenceEngines on the same sequences.
+    Args:
+        reference (InferenceEngine): The engine to compare against, usually PyTorch.
+        candidate (InferenceEngine): The engine to check, e.g. with an OnnxBackend.
+        tokens (numpy.ndarray): The concatenated token ids (see tokenize_flat).
+        offsets (numpy.ndarray): The offsets of the sequences in tokens.
+        atol (float): The largest absolute logit difference that passes.
+    Returns:
+        dict: The max absolute logit and probability differences, the share of equal predicted
+        classes and whether the check passed."""
+    reference_logits, reference_probabilities = reference.predict_tokens(tokens, offsets)
+    candidate_logits, candidate_probabilities = candidate.predict_tokens(tokens, offsets)
+    max_logit_diff = float(np.abs(reference_logits - candidate_logits).max()) if len(reference_logits) else 0.0
+    return {'max_logit_diff': max_logit_diff,
+            'max_probability_diff': float(np.abs(reference_probabilities - candidate_probabilities).max()) if len(reference_logits) else 0.0,
+            'prediction_agreement': float(np.mean(reference_logits.argmax(axis=1) == candidate_logits.argmax(axis=1))) if len(reference_logits) else 1.0,
+            'passed': max_logit_diff <= atol}
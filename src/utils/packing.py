@@ -0,0 +1,162 @@
+"""
+Sequence packing: several short examples share one max_len row of the encoder.
+
+Each packed row concatenates the token ids of a few examples (segments). Attention is restricted
+to a block-diagonal mask so tokens only see their own segment, position ids restart at every
+segment, and the classification head is applied to the first token of every segment, so each
+example is encoded exactly as it would be on its own row, just without the padding.
+"""
+import bisect
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+# Number of dimensions of the block attention mask each model class accepts (see block_attention_mask)
+_MASK_NDIM = {}
+
+# Function to pack examples into rows
+def pack_lengths(lengths, max_len):
+    """Pack examples into as few rows of max_len tokens as possible (best-fit decreasing).
+    Args:
+        lengths (array-like): The number of tokens of every example, each at most max_len.
+        max_len (int): The capacity of a row.
+    Returns:
+        list: The rows, each a list of example indices in the order they are laid out."""
+    lengths = np.asarray(lengths)
+    if len(lengths) and lengths.max() > max_len:
+        raise ValueError(f"Examples of up to {lengths.max()} tokens do not fit in rows of {max_len}")
+
+    rows = []
+    free = []  # Sorted (remaining capacity, row index) of all rows
+    for index in np.argsort(-lengths, kind='stable'):
+        length = int(lengths[index])
+        i = bisect.bisect_left(free, (length, -1))
+        if i == len(free):
+            rows.append([int(index)])
+            bisect.insort(free, (max_len - length, len(rows) - 1))
+        else:
+            remaining, row = free.pop(i)
+            rows[row].append(int(index))
+            bisect.insort(free, (remaining - length, row))
+    return rows
+
+class PackedDataset(Dataset):
+    """Dataset of packed rows over a TokenizedDataset.
+
+    Args:
+        dataset (TokenizedDataset): The pre-tokenized examples.
+        max_len (int): The number of tokens per row.
+    """
+    def __init__(self, dataset, max_len):
+        self.dataset = dataset
+        self.max_len = max_len
+        self.rows = pack_lengths(dataset.lengths(), max_len)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def lengths(self):
+        """The number of tokens of every row."""
+        example_lengths = self.dataset.lengths()
+        return np.array([example_lengths[row].sum() for row in self.rows])
+
+    def __getitem__(self, index):
+        items = [self.dataset[i] for i in self.rows[index]]
+        return {'input_ids': np.concatenate([item['input_ids'] for item in items]),
+                'segment_lengths': np.array([len(item['input_ids']) for item in items]),
+                'targets': torch.stack([item['targets'] for item in items]),
+                'indices': torch.tensor(self.rows[index])}
+
+# Function to pad a batch of packed rows
+def collate_packed(batch, pad_token_id, max_len=None):
+    """Pad a batch of PackedDataset rows.
+    Args:
+        batch (list): The rows.
+        pad_token_id (int): The id of the padding token.
+        max_len (int): The padded row length. None pads to the longest row in the batch.
+    Returns:
+        dict: "input_ids", "attention_mask" (1 for real tokens), "segment_ids" (-1 for padding)
+        and "segment_positions" (position of every token within its segment), all batch x length,
+        plus "cls_index" (flat index of the first token of every segment), "targets" and
+        "indices" (the dataset index of every segment)."""
+    if max_len is None:
+        max_len = max(len(row['input_ids']) for row in batch)
+    input_ids = torch.full((len(batch), max_len), pad_token_id, dtype=torch.long)
+    segment_ids = torch.full((len(batch), max_len), -1, dtype=torch.long)
+    segment_positions = torch.zeros((len(batch), max_len), dtype=torch.long)
+    cls_index = []
+
+    for i, row in enumerate(batch):
+        n = len(row['input_ids'])
+        input_ids[i, :n] = torch.from_numpy(row['input_ids'].astype(np.int64))
+        lengths = torch.from_numpy(row['segment_lengths'].astype(np.int64))
+        starts = torch.cumsum(lengths, 0) - lengths
+        segment_ids[i, :n] = torch.repeat_interleave(torch.arange(len(lengths)), lengths)
+        segment_positions[i, :n] = torch.arange(n) - torch.repeat_interleave(starts, lengths)
+        cls_index.append(i * max_len + starts)
+
+    return {'input_ids': input_ids,
+            'attention_mask': (segment_ids >= 0).long(),
+            'segment_ids': segment_ids,
+            'segment_positions': segment_positions,
+            'cls_index': torch.cat(cls_index),
+            'targets': torch.cat([row['targets'] for row in batch]),
+            'indices': torch.cat([row['indices'] for row in batch])}
+
+# Function to run the base model with a block-diagonal attention mask
+def _encode_packed(base_model, input_ids, block_mask, position_ids):
+    key = type(base_model)
+    if key not in _MASK_NDIM:
+        # Older transformers take a (batch, query, key) mask, newer ones a (batch, head, query, key) mask
+        for ndim in (3, 4):
+            try:
+                hidden = base_model(input_ids, attention_mask=block_mask if ndim == 3 else block_mask[:, None],
+                                    position_ids=position_ids).last_hidden_state
+            except (RuntimeError, ValueError):
+                continue
+            _MASK_NDIM[key] = ndim
+            return hidden
+        raise ValueError(f"{key.__name__} does not accept a block attention mask")
+    mask = block_mask if _MASK_NDIM[key] == 3 else block_mask[:, None]
+    return base_model(input_ids, attention_mask=mask, position_ids=position_ids).last_hidden_state
+
+# Function to classify the segments of packed rows
+def packed_forward(model, batch, device):
+    """Return the logits of every segment of a collate_packed batch.
+    Supports sequence classification models whose head reads the first token of a sequence:
+    RoBERTa-style heads (classifier applied to the hidden states) and BERT-style heads (pooler,
+    dropout and linear classifier).
+    Args:
+        model: A Hugging Face model for sequence classification.
+        batch (dict): A batch from collate_packed.
+        device (torch.device): The device of the model.
+    Returns:
+        torch.Tensor: Logits of shape (segments, labels)."""
+    base_model = getattr(model, model.base_model_prefix)
+    input_ids = batch['input_ids'].to(device)
+    segment_ids = batch['segment_ids'].to(device)
+
+    # Tokens attend only to tokens of their own segment
+    block_mask = (segment_ids[:, :, None] == segment_ids[:, None, :]) & (segment_ids[:, None, :] >= 0)
+
+    # Positions restart at every segment. RoBERTa-style embeddings count from padding_idx + 1
+    padding_idx = getattr(base_model.embeddings, 'padding_idx', None)
+    if padding_idx is not None:
+        position_ids = batch['segment_positions'].to(device) + padding_idx + 1
+        position_ids = position_ids.masked_fill(segment_ids < 0, padding_idx)
+    else:
+        position_ids = batch['segment_positions'].to(device)
+
+    hidden = _encode_packed(base_model, input_ids, block_mask, position_ids)
+    cls_states = hidden.reshape(-1, hidden.shape[-1])[batch['cls_index'].to(device)]
+    return classification_head(model, cls_states)
+
+# Function to apply the classification head of a model to first-token states
+def classification_head(model, cls_states):
+    """Return the logits of first-token hidden states (sequences, hidden) under the head of a
+    sequence classification model (see packed_forward for the supported heads)."""
+    base_model = getattr(model, model.base_model_prefix)
+    if getattr(base_model, 'pooler', None) is not None:
+        return model.classifier(model.dropout(base_model.pooler(cls_states.unsqueeze(1))))
+    return model.classifier(cls_states.unsqueeze(1))
@@ -0,0 +1,155 @@
+"""
+Persistent cache of model predictions.
+
+Scoring the same validation and test texts again (per length bin, per fold, in every metrics
+script) repeats the whole encoder forward pass. PredictionCache stores the logits of every text
+in an SQLite database, under a namespace that fingerprints everything that changes them: the
+model weights, the tokenizer, max_len and bf16. InferenceEngine looks texts up before batching
+and only runs the model on the misses. The least recently used entries are evicted when the
+stored logits exceed a size limit.
+"""
+import io
+import os
+import time
+import sqlite3
+import hashlib
+
+import numpy as np
+import torch
+
+from utils.dataset import tokenizer_digest
+
+# Default location of the prediction cache
+DEFAULT_PREDICTION_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'pacs', 'predictions.sqlite')
+
+# Number of keys per SQL query, below the SQLite variable limit
+_QUERY_SIZE = 500
+
+# Function to fingerprint the weights of a model
+def model_fingerprint(model):
+    """Digest of the weights of a model: the names, dtypes, shapes and values of its state dict,
+    or the contents of the file of a backend with a path (e.g. an OnnxBackend)."""
+    digest = hashlib.sha256()
+    if not isinstance(model, torch.nn.Module):
+        with open(model.path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 24), b''):
+                digest.update(block)
+        return digest.hexdigest()
+    for name, value in model.state_dict().items():
+        digest.update(f'{name}\0'.encode('utf-8'))
+        if isinstance(value, torch.Tensor) and not value.is_quantized:
+            value = value.detach().cpu().contiguous()
+            digest.update(f'{value.dtype}\0{tuple(value.shape)}\0'.encode('utf-8'))
+            digest.update(value.view(-1).view(torch.uint8).numpy().tobytes())
+        else:
+            # Quantized tensors and packed parameters
+            buffer = io.BytesIO()
+            torch.save(value, buffer)
+            digest.update(buffer.getvalue())
+    return digest.hexdigest()
+
+# Function to build the namespace of a model's predictions
+def prediction_namespace(model, tokenizer, max_len, bf16=False):
+    """Key of the predictions of a model with a tokenizer, max_len and precision."""
+    return hashlib.sha256(f'{model_fingerprint(model)}\0{tokenizer_digest(tokenizer)}\0{max_len}\0{bf16}'.encode('utf-8')).hexdigest()
+
+# Function to hash a text
+def text_key(text):
+    """The key of a text within a namespace."""
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+class PredictionCache:
+    """SQLite store of logits by namespace and text.
+
+    Args:
+        path (str): The database file, created if needed. Several processes can share it.
+        max_bytes (int): Evict the least recently used entries when the stored logits and keys
+            take more than this many bytes.
+    """
+    def __init__(self, path=DEFAULT_PREDICTION_CACHE_PATH, max_bytes=256 * 2**20):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS predictions (namespace TEXT, text_key BLOB, logits BLOB, '
+                                'size INTEGER, last_used REAL, PRIMARY KEY (namespace, text_key))')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS predictions_last_used ON predictions (last_used)')
+        self.connection.commit()
+
+    def get_many(self, namespace, keys):
+        """Look up texts by key.
+        Args:
+            namespace (str): The namespace, see prediction_namespace.
+            keys (list): Text keys, see text_key.
+        Returns:
+            list: The float32 logits of every key, None for misses."""
+        found = {}
+        for start in range(0, len(keys), _QUERY_SIZE):
+            chunk = list(set(keys[start:start + _QUERY_SIZE]))
+            rows = self.connection.execute(
+                f"SELECT text_key, logits FROM predictions WHERE namespace = ? AND text_key IN ({', '.join('?' * len(chunk))})",
+                [namespace, *chunk]).fetchall()
+            found.update((key, np.frombuffer(logits, dtype=np.float32)) for key, logits in rows)
+        if found:
+            now = time.time()
+            self.connection.executemany('UPDATE predictions SET last_used = ? WHERE namespace = ? AND text_key = ?',
+                                        [(now, namespace, key) for key in found])
+            self.connection.commit()
+        results = [found.get(key) for key in keys]
+        self.hits += sum(result is not None for result in results)
+        self.misses += sum(result is None for result in results)
+        return results
+
+    def put_many(self, namespace, keys, logits):
+        """Store the logits (texts, classes) of texts by key, then evict entries over max_bytes."""
+        now = time.time()
+        rows = []
+        for key, row in zip(keys, logits):
+            row = np.asarray(row, dtype=np.float32).tobytes()
+            rows.append((namespace, key, row, len(key) + len(row), now))
+        self.connection.executemany('INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?)', rows)
+        self.connection.commit()
+        self.evict()
+
+    def evict(self):
+        """Delete the least recently used entries until the cache fits in max_bytes."""
+        excess = self.size_bytes() - self.max_bytes
+        if excess <= 0:
+            return
+        victims = []
+        for namespace, key, size in self.connection.execute('SELECT namespace, text_key, size FROM predictions ORDER BY last_used'):
+            victims.append((namespace, key))
+            excess -= size
+            if excess <= 0:
+                break
+        self.connection.executemany('DELETE FROM predictions WHERE namespace = ? AND text_key = ?', victims)
+        self.connection.commit()
+        self.evictions += len(victims)
+
+    def size_bytes(self):
+        """The number of bytes of the stored logits and keys."""
+        return self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM predictions').fetchone()[0]
+
+    def stats(self):
+        """Hits, misses, hit rate and evictions since this object was created, and the number of entries and bytes stored."""
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': self.connection.execute('SELECT COUNT(*) FROM predictions').fetchone()[0],
+                'bytes': self.size_bytes()}
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        self.connection.execute('DELETE FROM predictions')
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
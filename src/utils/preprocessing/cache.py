@@ -0,0 +1,154 @@
+"""
+Persistent, content-addressed cache of parsed transcripts.
+"""
+import os
+import glob
+import hashlib
+import pickle
+import zlib
+
+# Default location of the parse cache
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'pacs', 'transcripts')
+
+# Function to hash the contents of a file
+def file_digest(path, chunk_size=1 << 20):
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class TranscriptCache:
+    """On-disk cache of the paragraphs and patient turns extracted from .docx transcripts.
+
+    Entries are keyed by the SHA-256 of the file contents plus a digest of the parser
+    configuration (speaker-prefix regex and parser version), so renamed or copied files hit
+    the cache and edited files miss it. Each entry is a zlib-compressed pickle of the
+    paragraph texts and the (paragraph index, prefix end) pairs of the patient turns.
+    When the cache grows beyond max_size_bytes, the least recently used entries are evicted.
+
+    Args:
+        cache_dir (str): The directory holding the cache entries.
+        max_size_bytes (int): The size cap of the cache. None disables eviction.
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size_bytes=512 * 1024**2):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def __getstate__(self):
+        # Worker processes re-scan the cache size themselves
+        state = self.__dict__.copy()
+        state['_size'] = None
+        return state
+
+    @staticmethod
+    def config_digest(prefix_pattern, parser_version):
+        """Digest of the parser configuration that produced an entry."""
+        return hashlib.sha256(f'{parser_version}\0{prefix_pattern}'.encode('utf-8')).hexdigest()[:16]
+
+    def _entry_path(self, content_digest, config_digest):
+        return os.path.join(self.cache_dir, content_digest[:2], f'{content_digest}-{config_digest}.bin')
+
+    def _entries(self):
+        return glob.glob(os.path.join(self.cache_dir, '*', '*.bin'))
+
+    def size(self):
+        """Total size of the cache entries in bytes."""
+        if self._size is None:
+            self._size = sum(os.path.getsize(path) for path in self._entries())
+        return self._size
+
+    def get(self, path, prefix_pattern, parser_version, content_digest=None):
+        """Return the cached (paragraphs, patient_turns) of a document, or None on a miss."""
+        content_digest = content_digest or file_digest(path)
+        entry_path = self._entry_path(content_digest, self.config_digest(prefix_pattern, parser_version))
+        try:
+            with open(entry_path, 'rb') as f:
+                paragraphs, turn_spans = pickle.loads(zlib.decompress(f.read()))
+        except (FileNotFoundError, zlib.error, pickle.UnpicklingError, EOFError):
+            self.misses += 1
+            return None
+
+        # Mark the entry as recently used
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+
+        self.hits += 1
+        return paragraphs, [paragraphs[i][start:] for i, start in turn_spans]
+
+    def put(self, path, prefix_pattern, parser_version, paragraphs, turn_spans, content_digest=None):
+        """Store the paragraphs of a document and the (paragraph index, prefix end) pairs of its patient turns."""
+        content_digest = content_digest or file_digest(path)
+        entry_path = self._entry_path(content_digest, self.config_digest(prefix_pattern, parser_version))
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+
+        payload = zlib.compress(pickle.dumps((paragraphs, turn_spans), protocol=pickle.HIGHEST_PROTOCOL), 1)
+
+        # Write to a temporary file and rename so concurrent readers never see a partial entry
+        tmp_path = f'{entry_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, entry_path)
+
+        self._size = self.size() + len(payload)
+        if self.max_size_bytes is not None and self._size > self.max_size_bytes:
+            self.evict(self.max_size_bytes)
+
+    def load(self, path, prefix_pattern, parser_version, parse_fn):
+        """Return the (paragraphs, patient_turns) of a document from the cache, parsing and storing it on a miss.
+        Args:
+            path (str): The path to the document.
+            prefix_pattern (str): The speaker-prefix regex used to select patient turns.
+            parser_version (int): The version of the parser, bumped whenever its output changes.
+            parse_fn (callable): Function mapping a path to (paragraphs, turn_spans).
+        """
+        content_digest = file_digest(path)
+        cached = self.get(path, prefix_pattern, parser_version, content_digest=content_digest)
+        if cached is not None:
+            return cached
+
+        paragraphs, turn_spans = parse_fn(path)
+        self.put(path, prefix_pattern, parser_version, paragraphs, turn_spans, content_digest=content_digest)
+        return paragraphs, [paragraphs[i][start:] for i, start in turn_spans]
+
+    def evict(self, max_size_bytes):
+        """Delete the least recently used entries until the cache is at most max_size_bytes."""
+        entries = []
+        for entry_path in self._entries():
+            try:
+                stat = os.stat(entry_path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+        entries.sort()
+
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, entry_path in entries:
+            if size <= max_size_bytes:
+                break
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+        self._size = size
+
+    def invalidate(self, path):
+        """Remove all cached entries for the current contents of a document."""
+        content_digest = file_digest(path)
+        for entry_path in glob.glob(os.path.join(self.cache_dir, content_digest[:2], f'{content_digest}-*.bin')):
+            os.remove(entry_path)
+        self._size = None
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        for entry_path in self._entries():
+            os.remove(entry_path)
+        self._size = 0
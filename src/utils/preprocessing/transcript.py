@@ -5,6 +5,8 @@ import os
 import random
 import zipfile
 import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
 from docx import Document
 from docx.oxml.ns import nsdecls
@@ -74,15 +76,7 @@ def paragraph_comments(paragraph, comments_dict):
 # Function to fetch all paragraphs with comments from a document
 def comments_with_reference_paragraph(docxFileName):
     """Returns a dict with keys as paragraphs and values as comments"""
-    document = Document(docxFileName)
-    comments_dict=get_document_comments(docxFileName)
-    comments_with_their_reference_paragraph={}
-    for paragraph in document.paragraphs:  
-        if comments_dict: 
-            comments=paragraph_comments(paragraph,comments_dict)  
-            if comments:
-                comments_with_their_reference_paragraph[paragraph.text] = comments
-    return comments_with_their_reference_paragraph
+    return iter_docx_comment_paragraphs(docxFileName)
 
 # Function to extract lists of text and comments from a dict where keys are paragraphs and values are comments
 def extract_text_and_comments(comments_with_reference_paragraph, as_lists=False):
@@ -201,114 +195,320 @@ def create_random_word_document(folder_path, n_docs=1):
 
         doc.save(filename)
 
+# WordprocessingML tags used by the streaming parser
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+W_BODY = f'{{{W_NS}}}body'
+W_P = f'{{{W_NS}}}p'
+W_TBL = f'{{{W_NS}}}tbl'
+W_R = f'{{{W_NS}}}r'
+W_HYPERLINK = f'{{{W_NS}}}hyperlink'
+W_T = f'{{{W_NS}}}t'
+W_TAB = f'{{{W_NS}}}tab'
+W_PTAB = f'{{{W_NS}}}ptab'
+W_BR = f'{{{W_NS}}}br'
+W_CR = f'{{{W_NS}}}cr'
+W_NO_BREAK_HYPHEN = f'{{{W_NS}}}noBreakHyphen'
+W_TYPE = f'{{{W_NS}}}type'
+W_ID = f'{{{W_NS}}}id'
+W_COMMENT = f'{{{W_NS}}}comment'
+W_COMMENT_REFERENCE = f'{{{W_NS}}}commentReference'
+OFFICE_DOCUMENT_RT = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument'
+
+# Function to get the text of a run the way python-docx's Run.text does
+def _run_text(r, parts):
+    """Append the text of a w:r element to parts."""
+    for child in r:
+        tag = child.tag
+        if tag == W_T:
+            parts.append(child.text or '')
+        elif tag == W_TAB or tag == W_PTAB:
+            parts.append('\t')
+        elif tag == W_CR:
+            parts.append('\n')
+        elif tag == W_BR:
+            # Only line breaks produce text, page and column breaks are dropped
+            if child.get(W_TYPE, 'textWrapping') == 'textWrapping':
+                parts.append('\n')
+        elif tag == W_NO_BREAK_HYPHEN:
+            parts.append('-')
+
+# Function to get the text of a paragraph the way python-docx's Paragraph.text does
+def _paragraph_text(p):
+    """Return the text of a w:p element from its runs and hyperlinked runs."""
+    parts = []
+    for child in p:
+        if child.tag == W_R:
+            _run_text(child, parts)
+        elif child.tag == W_HYPERLINK:
+            for r in child.iterchildren(W_R):
+                _run_text(r, parts)
+    return ''.join(parts)
+
+# Function to find the main document part of a .docx archive
+def _main_document_part(docx_zip):
+    """Return the archive member name of the main document part."""
+    try:
+        rels = etree.fromstring(docx_zip.read('_rels/.rels'))
+        for rel in rels:
+            if rel.get('Type') == OFFICE_DOCUMENT_RT:
+                return rel.get('Target').lstrip('/')
+    except KeyError:
+        pass
+    return 'word/document.xml'
+
+# Function to open a .docx archive, raising the same errors as python-docx
+def _open_docx_zip(path):
+    """Open a .docx file as a zip archive."""
+    if not os.path.isfile(path):
+        raise PackageNotFoundError(f"Package not found at '{path}'")
+    try:
+        return zipfile.ZipFile(path)
+    except zipfile.BadZipFile:
+        raise PackageNotFoundError(f"Package not found at '{path}'")
+
+# Function to stream the paragraph texts of a .docx file without building a python-docx Document
+def iter_docx_paragraphs(path):
+    """Yield the text of each top-level body paragraph of a .docx file, in document order.
+    Streams the main document part out of the archive with lxml's iterparse and frees each
+    element once it has been read. Yields the same strings as [p.text for p in Document(path).paragraphs].
+    Args:
+        path (str): The path to the .docx file."""
+    with _open_docx_zip(path) as docx_zip:
+        with docx_zip.open(_main_document_part(docx_zip)) as xml_file:
+            for _, elem in etree.iterparse(xml_file, events=('end',), tag=(W_P, W_TBL)):
+                parent = elem.getparent()
+                if parent is None or parent.tag != W_BODY:
+                    # Paragraphs in tables, text boxes etc. are not body paragraphs
+                    continue
+                if elem.tag == W_P:
+                    yield _paragraph_text(elem)
+
+                # Free the element and everything before it in the body
+                elem.clear(keep_tail=True)
+                while elem.getprevious() is not None:
+                    del parent[0]
+
+# Regular expression matching the speaker prefix of a patient speech turn
+PATIENT_PREFIX_PATTERN = r'^(P\d*:|P:|PATIENT:|P;|PATIENT;)'
+PATIENT_PREFIX_RE = re.compile(PATIENT_PREFIX_PATTERN)
+
+# Version of the paragraph extraction, bump whenever its output changes to invalidate cached parses
+PARSER_VERSION = 1
+
+# Function to locate the patient speech turns among the paragraphs of a document
+def patient_turn_spans(paragraphs, prefix_re=PATIENT_PREFIX_RE):
+    """Return (paragraph index, end of prefix) pairs for the paragraphs that are patient speech turns."""
+    spans = []
+    for i, p in enumerate(paragraphs):
+        match = prefix_re.match(p)
+        if match:
+            spans.append((i, match.end()))
+    return spans
+
+# Function to read the comments part of an open .docx archive
+def _read_comments(docx_zip):
+    """Return a dict with comment id as key and comment string as value, empty if the document has no comments."""
+    comments_dict = {}
+    try:
+        comments_file = docx_zip.open('word/comments.xml')
+    except KeyError:
+        return comments_dict
+    with comments_file:
+        for _, comment in etree.iterparse(comments_file, events=('end',), tag=W_COMMENT):
+            comments_dict[comment.get(W_ID)] = ''.join(comment.itertext())
+            comment.clear(keep_tail=True)
+    return comments_dict
+
+# Function to fetch all paragraphs with comments from a document in a single pass over the archive
+def iter_docx_comment_paragraphs(path):
+    """Return a dict with paragraph texts as keys and the comments referenced in them as values.
+    Opens the archive once, reads the comments part and then streams the main document part,
+    resolving each run's w:commentReference id with a dict lookup. Gives the same result as
+    pairing Document(path).paragraphs with get_document_comments(path), except that a document
+    without a comments part yields an empty dict.
+    Args:
+        path (str): The path to the .docx file."""
+    comments_with_their_reference_paragraph = {}
+    with _open_docx_zip(path) as docx_zip:
+        comments_dict = _read_comments(docx_zip)
+        if not comments_dict:
+            # Nothing can be referenced, so skip the document part entirely
+            return comments_with_their_reference_paragraph
+
+        with docx_zip.open(_main_document_part(docx_zip)) as xml_file:
+            for _, elem in etree.iterparse(xml_file, events=('end',), tag=(W_P, W_TBL)):
+                parent = elem.getparent()
+                if parent is None or parent.tag != W_BODY:
+                    continue
+                if elem.tag == W_P:
+                    # Only the first comment reference of each direct run counts, as in paragraph_comments
+                    comments = []
+                    for r in elem.iterchildren(W_R):
+                        comment_reference = r.find(W_COMMENT_REFERENCE)
+                        if comment_reference is not None:
+                            comments.append(comments_dict[comment_reference.get(W_ID)])
+                    if comments:
+                        comments_with_their_reference_paragraph[_paragraph_text(elem)] = comments
+
+                elem.clear(keep_tail=True)
+                while elem.getprevious() is not None:
+                    del parent[0]
+    return comments_with_their_reference_paragraph
+
+# Paragraph extraction backends selectable with the engine argument of the loaders
+PARAGRAPH_ENGINES = {
+    'docx': lambda path: [p.text for p in Document(path).paragraphs],
+    'lxml': lambda path: list(iter_docx_paragraphs(path)),
+}
+
+# Function to extract the paragraph texts of a .docx file with the chosen engine
+def docx_paragraphs(path, engine='docx'):
+    """Return the text of each body paragraph of a .docx file.
+    Args:
+        path (str): The path to the .docx file.
+        engine (str): 'docx' to parse with python-docx, 'lxml' to stream the XML with lxml."""
+    try:
+        extract = PARAGRAPH_ENGINES[engine]
+    except KeyError:
+        raise ValueError(f"Unknown engine '{engine}'. Choose one of {list(PARAGRAPH_ENGINES)}.")
+    return extract(path)
+
+# Function to parse a .docx file into its paragraphs and patient turn spans
+def _parse_docx(path, engine='docx'):
+    """Parse a .docx file into (paragraphs, patient turn spans)."""
+    paragraphs = docx_paragraphs(path, engine=engine)
+    return paragraphs, patient_turn_spans(paragraphs)
+
 # Function to load patient speech turns from path or doc
-def load_patient_turns(doc):
+def load_patient_turns(doc, cache=None, engine='docx'):
     """Load the patient speech turns from a document.
     Args:
         doc (str or Document): The document to load.
-        prefix (str): The prefix used to indicate a patient speech turn."""
+        cache (TranscriptCache): Optional parse cache consulted before parsing a path.
+        engine (str): The paragraph extraction engine used for paths, 'docx' or 'lxml'."""
 
     # Load the document if doc is a path
     if isinstance(doc, str):
-        if doc.endswith('.docx'):
-            doc = Document(doc)
-            # Extract the text of each paragraph
-            paragraphs = [p.text for p in doc.paragraphs]
-        else:
+        if not doc.endswith('.docx'):
             raise ValueError("Unsupported file type. Please provide a .docx file.")
+        if cache is not None:
+            _, turns = cache.load(doc, PATIENT_PREFIX_PATTERN, PARSER_VERSION, partial(_parse_docx, engine=engine))
+            return turns
+        paragraphs, spans = _parse_docx(doc, engine=engine)
+    else:
+        # Extract the text of each paragraph
+        paragraphs = [p.text for p in doc.paragraphs]
+        spans = patient_turn_spans(paragraphs)
 
-        # Compile the regular expression for matching the prefixes
-        prefix_re = re.compile(r'^(P\d*:|P:|PATIENT:|P;|PATIENT;)')
-        
-        # Filter the paragraphs to only include those that start with the prefix
-        paragraphs = [p for p in paragraphs if prefix_re.match(p)]
-
-        # Strip the prefix from the paragraphs
-        paragraphs = [prefix_re.sub('', p) for p in paragraphs]
-
-    return paragraphs
+    # Strip the prefix from the patient turns
+    return [paragraphs[i][start:] for i, start in spans]
 
 # Function to load patient speech turns from all documents in a folder
-def load_patient_turns_from_folder(folder_path, prefixes=['P:', 'PATIENT:', 'P;', 'PATIENT;']):
+def load_patient_turns_from_folder(folder_path, prefixes=['P:', 'PATIENT:', 'P;', 'PATIENT;'], cache=None, engine='docx'):
     """Load the patient speech turns from all documents in a folder.
     Returns a list of lists with speech turns per document.
     Args:
         folder_path (str): The path to the folder containing the documents.
-        prefixes (list): The prefixes used to indicate a patient speech turn."""
+        prefixes (list): The prefixes used to indicate a patient speech turn.
+        cache (TranscriptCache): Optional parse cache consulted before parsing each document.
+        engine (str): The paragraph extraction engine, 'docx' or 'lxml'."""
 
     # Initialize an empty list to hold all the paragraphs
     all_paragraphs = []
 
-    # Compile the regular expression for matching the prefixes
-    prefix_re = re.compile(r'^(P\d*:|P:|PATIENT:|P;|PATIENT;)')
-
     # Iterate over all files in the folder
     for filename in os.listdir(folder_path):
         # Check if the file is a Word document
         if filename.endswith('.docx'):
-            # Load the document
-            doc = Document(os.path.join(folder_path, filename))
-
-            # Extract the text of each paragraph
-            paragraphs = [p.text for p in doc.paragraphs]
-
-            # Filter the paragraphs to only include those that start with the prefix
-            paragraphs = [p for p in paragraphs if prefix_re.match(p)]
-
-            # Strip the prefix from the paragraphs
-            paragraphs = [prefix_re.sub('', p) for p in paragraphs]
-
-            # Add the paragraphs to the list of all paragraphs
-            all_paragraphs.append(paragraphs)
+            # Load the patient turns of the document and add them to the list of all paragraphs
+            all_paragraphs.append(load_patient_turns(os.path.join(folder_path, filename), cache=cache, engine=engine))
 
     return all_paragraphs
 
+# Function to load the patient turns of one labelled document (module level so worker processes can pickle it)
+def _load_document_turns(document_path, cache=None, engine='docx'):
+    """Load the patient speech turns of a single document, returning the error instead of raising it.
+    Args:
+        document_path (str): The path to the document.
+        cache (TranscriptCache): Optional parse cache.
+        engine (str): The paragraph extraction engine.
+    Returns:
+        A tuple of (patient turns or None, error message or None)."""
+    try:
+        return load_patient_turns(document_path, cache=cache, engine=engine), None
+    except (FileNotFoundError, PackageNotFoundError) as e:
+        return None, f"{type(e).__name__}: {e}"
+
 # Function to load patient speech turns from all documents in a folder and store in df with labels
-def load_data_with_labels(labels_path, folder_path):
+def load_data_with_labels(labels_path, folder_path, n_jobs=None, cache=None, engine='docx', documents=None):
     """Load the patient speech turns from all documents in a folder and store them in a DataFrame with labels.
     Args:
         labels_path (str): The path to the Excel sheet with the labels.
         folder_path (str): The path to the folder containing the documents.
+        n_jobs (int): The number of worker processes used to parse the documents.
+            None or 1 parses serially, -1 uses all available cores.
+        cache (TranscriptCache): Optional parse cache consulted before parsing each document.
+        engine (str): The paragraph extraction engine, 'docx' or 'lxml'.
+        documents (list): Optional subset of the labelled documents to load, e.g. from utils.splits.split_documents.
     Returns:
-        A DataFrame with the patient speech turns, their labels, and their source document."""
+        A DataFrame with the patient speech turns, their labels, and their source document.
+        Documents that could not be loaded are listed in result.attrs['failures']."""
     # Load the Excel sheet
     df = pd.read_excel(labels_path)
+    if documents is not None:
+        df = df[df['Document'].isin(set(documents))]
 
-    # Counter for the number of documents check
-    n_docs = 0
-
-    # Initialize a list to store DataFrame objects
-    df_list = []
-
-    # Iterate over the rows in the DataFrame
-    for index, row in df.iterrows():
-        # Get the document name and label
-        document_name = row['Document']
-        label = row['Class3']
-
-        # Load the corresponding file
-        try:
-            p_turns = load_patient_turns(os.path.join(folder_path, document_name))
+    return load_documents_with_labels(df['Document'].tolist(), df['Class3'].tolist(), folder_path, n_jobs=n_jobs, cache=cache, engine=engine)
 
-            # Increment counter
-            n_docs += 1
-        except FileNotFoundError:
-            continue
-        except PackageNotFoundError:
+# Function to load patient speech turns from a list of labelled documents
+def load_documents_with_labels(document_names, labels, folder_path, n_jobs=None, cache=None, engine='docx'):
+    """Load the patient speech turns of the given documents and store them in a DataFrame with labels.
+    Args:
+        document_names (list): The file names of the documents, in output order.
+        labels (list): The label of each document.
+        folder_path (str): The path to the folder containing the documents.
+        n_jobs (int): The number of worker processes used to parse the documents (see load_data_with_labels).
+        cache (TranscriptCache): Optional parse cache consulted before parsing each document.
+        engine (str): The paragraph extraction engine, 'docx' or 'lxml'.
+    Returns:
+        A DataFrame with the patient speech turns, their labels, and their source document.
+        Documents that could not be loaded are listed in result.attrs['failures']."""
+    document_paths = [os.path.join(folder_path, document_name) for document_name in document_names]
+
+    # Parse the documents, either serially or fanned out over a process pool
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    if n_jobs is None or n_jobs <= 1 or len(document_paths) <= 1:
+        results = [_load_document_turns(path, cache, engine) for path in document_paths]
+    else:
+        n_workers = min(n_jobs, len(document_paths))
+        # Hand out a few chunks per worker to balance uneven document sizes without too much IPC overhead
+        chunksize = max(1, len(document_paths) // (n_workers * 4))
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            # map yields results in submission order, so the output order matches the serial path
+            results = list(executor.map(_load_document_turns, document_paths, [cache] * len(document_paths), [engine] * len(document_paths), chunksize=chunksize))
+
+    # Initialize lists to store the rows and the documents that failed to load
+    texts, row_labels, documents = [], [], []
+    failures = {}
+
+    for document_name, label, (p_turns, error) in zip(document_names, labels, results):
+        if error is not None:
+            failures[document_name] = error
             continue
 
         # For each patient turn, create a new row in the result DataFrame
-        data = []
-        for patient_turn in p_turns:
-            data.append({'text': patient_turn, 'label': label, 'document': document_name})
+        texts.extend(p_turns)
+        row_labels.extend([label] * len(p_turns))
+        documents.extend([document_name] * len(p_turns))
 
-        # Append the DataFrame to the list
-        df_list.append(pd.DataFrame(data))
-    
-    # Concatenate all the DataFrames in the list
-    result = pd.concat(df_list, ignore_index=True)
+    result = pd.DataFrame({'text': texts, 'label': row_labels, 'document': documents})
+    result.attrs['failures'] = failures
 
+    n_docs = len(document_names) - len(failures)
     print(f"\nLoaded {n_docs} documents.")
+    if failures:
+        print(f"Failed to load {len(failures)} documents.")
     return result
 
 # Get average word count of speech turns
@@ -408,11 +608,12 @@ def split_into_chunks(data, chunk_size=100, n_chunks=10):
         raise ValueError("You must specify either chunk_size or n_chunks, but not both.")
 
 # Function to load patient and therapist speech turns from all documents in a folder and split into chunks  of turns with the minimum of a specified word count
-def load_and_chunk_speech_turns(folder_path, min_word_count=250):
+def load_and_chunk_speech_turns(folder_path, min_word_count=250, engine='docx'):
     """Load speech turns from all documents in a folder and combine them into chunks of a specified minimum word count.
     Args:
         folder_path (str): The path to the folder containing the documents.
         min_word_count (int): The minimum word count of each chunk.
+        engine (str): The paragraph extraction engine, 'docx' or 'lxml'.
     Returns:
         A list of lists of strings, where each list represents a document and each string within a list represents a chunk of speech turns."""
 
@@ -426,11 +627,8 @@ def load_and_chunk_speech_turns(folder_path, min_word_count=250):
     for filename in os.listdir(folder_path):
         # Check if the file is a Word document
         if filename.endswith('.docx'):
-            # Load the document
-            doc = Document(os.path.join(folder_path, filename))
-
             # Extract the text of each paragraph
-            paragraphs = [p.text for p in doc.paragraphs]
+            paragraphs = docx_paragraphs(os.path.join(folder_path, filename), engine=engine)
 
             # Filter the paragraphs to only include those that start with the prefix
             paragraphs = [p for p in paragraphs if prefix_re.match(p)]
@@ -470,25 +668,49 @@ def combine_turns(data, target_length):
         pandas.DataFrame: A new DataFrame with combined turns, where each row contains a speech turn of a least the specified word count.
 
     """
-    combined_data = pd.DataFrame(columns=["text", "label", "document"])
-    current_length = 0
-    current_document = ""
-    current_turn = ""
-    current_label = ""
-    for index, row in data.iterrows():
-        turn_length = len(row["text"].split())
-        if current_length + turn_length < target_length and (current_document == row["document"] or current_document == ""):
-            current_document = row["document"]
-            current_turn += row["text"] + " "
-            current_label = row["label"]
-            current_length += turn_length
-        else:
-            if current_length >= target_length:
-                new_row = pd.DataFrame({"text": [current_turn], "label": [current_label], "document": [current_document]})
-                combined_data = pd.concat([combined_data, new_row], ignore_index=True)
-            current_length = turn_length
-            current_document = row["document"]
-            current_turn = row["text"] + " "
-            current_label = row["label"]
-    combined_data.reset_index(drop=True, inplace=True)
-    return combined_data
\ No newline at end of file
+    return combine_turns_by_length(data, [target_length])[target_length]
+
+# Combine turns for several target lengths from a single scan of the data
+def combine_turns_by_length(data, target_lengths):
+    """
+    Combine consecutive turns for each of the given target lengths in one pass over the data.
+
+    Reproduces the greedy scan combine_turns has always used: a buffer of turns from one
+    document grows while its word count stays below target_length, and it is only written out
+    when it has reached target_length by the time the next turn arrives; the buffer left over
+    at the end of the data is dropped. Since a buffer only grows while it is shorter than
+    target_length, the buffers that are written out are exactly the single turns of at least
+    target_length words, other than the final row. That makes every target length a vectorised
+    mask over the per-turn word counts, which are computed once.
+
+    Args:
+        data (pandas.DataFrame): The input data containing columns "text", "label", and "document".
+            A precomputed "turn_length" column is used as the word counts if present.
+        target_lengths (list): The desired lengths of the combined turns (positive integers).
+
+    Returns:
+        dict: Maps each target length to a DataFrame with columns "text", "label" and "document",
+            identical to combine_turns(data, target_length).
+
+    """
+    if any(target_length <= 0 for target_length in target_lengths):
+        raise ValueError("Target lengths must be positive.")
+
+    if 'turn_length' in data:
+        word_counts = data['turn_length'].to_numpy()
+    else:
+        word_counts = data['text'].str.split().str.len().to_numpy()
+
+    # The buffer holding the final row is never written out
+    not_last = np.ones(len(data), dtype=bool)
+    not_last[-1:] = False
+
+    texts = (data['text'] + ' ').to_numpy()
+    labels = data['label'].to_numpy()
+    documents = data['document'].to_numpy()
+
+    combined = {}
+    for target_length in target_lengths:
+        mask = not_last & (word_counts >= target_length)
+        combined[target_length] = pd.DataFrame({"text": texts[mask], "label": labels[mask], "document": documents[mask]})
+    return combined
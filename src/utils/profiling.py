@@ -0,0 +1,171 @@
+"""
+Instrumentation of the training loop.
+
+PhaseTimer adds up the wall-clock time of the phases of every step (waiting for data, forward,
+backward, optimizer step, metric updates) and counts samples and tokens, so an epoch can be
+summarised as samples/s, tokens/s and padding ratio next to the peak resident memory. With
+phase timing disabled only the counts are kept, which costs nothing. trace_window records a
+torch.profiler trace of a range of steps for a detailed look at single operators.
+"""
+import os
+import sys
+import time
+import contextlib
+
+import pandas as pd
+import torch
+
+# Function to get the peak resident memory of the process
+def peak_rss_bytes():
+    """The peak resident set size of this process in bytes, or None where it cannot be measured."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024 # Bytes on macOS, KiB on Linux
+    except ImportError:
+        pass
+    try:
+        import psutil
+        memory = psutil.Process().memory_info()
+        return getattr(memory, 'peak_wset', memory.rss) # Peak working set on Windows
+    except ImportError:
+        return None
+
+class PhaseTimer:
+    """Accumulates wall-clock time per phase and the samples and tokens processed.
+
+    Args:
+        enabled (bool): Time the phases. If False, phase and iterate do nothing and only counts are kept.
+        synchronize (bool): Wait for queued CUDA kernels at the end of every phase, so GPU time is
+            attributed to the phase that launched it. Stalls the pipeline, so only use it to profile.
+    """
+    def __init__(self, enabled=True, synchronize=False):
+        self.enabled = enabled
+        self.synchronize = synchronize and torch.cuda.is_available()
+        self.reset()
+
+    def reset(self):
+        self.seconds = {}
+        self.samples = 0
+        self.tokens = 0
+        self.padded_tokens = 0
+        self.start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time the enclosed block as phase name."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.synchronize:
+                torch.cuda.synchronize()
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+
+    def iterate(self, iterable, name='data'):
+        """Yield from iterable, timing every wait for the next item as phase name."""
+        if not self.enabled:
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, samples, tokens, padded_tokens):
+        """Add a batch of samples with its real and padded token counts."""
+        self.samples += samples
+        self.tokens += tokens
+        self.padded_tokens += padded_tokens
+
+    def summary(self, samples=None, tokens=None, padded_tokens=None):
+        """Summarise the time since the last reset.
+        Args:
+            samples, tokens, padded_tokens (int): Totals to use instead of the counts of this
+                process, e.g. summed over all processes in distributed training.
+        Returns:
+            dict: Wall time, samples/s, tokens/s (real tokens), padding ratio, peak RSS and the seconds of every phase."""
+        wall = time.perf_counter() - self.start
+        samples = self.samples if samples is None else samples
+        tokens = self.tokens if tokens is None else tokens
+        padded_tokens = self.padded_tokens if padded_tokens is None else padded_tokens
+        summary = {'wall_seconds': wall,
+                   'samples': samples,
+                   'samples_per_s': samples / wall if wall > 0 else 0.0,
+                   'tokens_per_s': tokens / wall if wall > 0 else 0.0,
+                   'padding_ratio': 1 - tokens / padded_tokens if padded_tokens else 0.0,
+                   'peak_rss_bytes': peak_rss_bytes()}
+        for name, seconds in self.seconds.items():
+            summary[f'{name}_seconds'] = seconds
+        if self.seconds:
+            summary['other_seconds'] = max(wall - sum(self.seconds.values()), 0.0)
+        return summary
+
+class _NoTrace:
+    def start(self):
+        pass
+
+    def step(self):
+        pass
+
+    def stop(self):
+        pass
+
+# Function to set up a torch.profiler trace of a range of steps
+def trace_window(output_dir, steps=None, record_shapes=True, profile_memory=True):
+    """Return a profiler that records the training steps in range(start, stop).
+    Call start() before training, step() after every batch and stop() at the end. The trace is
+    written to output_dir as a Chrome trace (open in chrome://tracing or Perfetto), with a table
+    of the most expensive operators next to it.
+    Args:
+        output_dir (str): Folder for the trace.
+        steps (tuple): (start, stop) batch indices counted from the start of training. None disables tracing.
+        record_shapes (bool): Record the input shapes of operators.
+        profile_memory (bool): Record tensor memory allocations.
+    Returns:
+        A torch.profiler.profile, or an object with no-op start, step and stop if steps is None."""
+    if steps is None:
+        return _NoTrace()
+    start, stop = steps
+    if not 0 <= start < stop:
+        raise ValueError(f"Invalid profiling step range {steps}")
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+    def on_trace_ready(profiler):
+        os.makedirs(output_dir, exist_ok=True)
+        profiler.export_chrome_trace(os.path.join(output_dir, f'trace_steps_{start}-{stop}.json'))
+        with open(os.path.join(output_dir, f'trace_steps_{start}-{stop}.txt'), 'w') as f:
+            f.write(profiler.key_averages().table(sort_by='self_cpu_time_total', row_limit=30))
+
+    # The step before the window warms the profiler up, its events are discarded
+    schedule = torch.profiler.schedule(wait=max(start - 1, 0), warmup=min(start, 1), active=stop - start, repeat=1)
+    return torch.profiler.profile(activities=activities, schedule=schedule, on_trace_ready=on_trace_ready,
+                                  record_shapes=record_shapes, profile_memory=profile_memory)
+
+# Function to append a summary to a CSV file of summaries
+def append_summary(summary, path):
+    """Append a summary as a row of a CSV file, writing the header if the file is new.
+    The row is written in the column order of the existing header, with empty cells for missing
+    columns. A summary with new columns rewrites the file with them added at the end."""
+    row = pd.DataFrame([summary])
+    if not os.path.exists(path):
+        row.to_csv(path, index=False)
+        return
+    columns = pd.read_csv(path, nrows=0).columns.tolist()
+    new_columns = [column for column in row.columns if column not in columns]
+    if not new_columns:
+        row.reindex(columns=columns).to_csv(path, mode='a', header=False, index=False)
+        return
+    summaries = pd.concat([pd.read_csv(path), row], ignore_index=True)[columns + new_columns]
+    tmp_path = f'{path}.tmp'
+    summaries.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
@@ -0,0 +1,114 @@
+"""
+Post-training int8 quantization of fine-tuned classifiers for CPU inference.
+
+"dynamic" stores the weights of every Linear layer as int8 and quantizes activations on the fly
+with a scale computed per batch, so it needs no data. "static" also fixes the activation scales
+of the Linear inputs from a calibration pass over held-out texts, which saves computing them at
+run time. Embeddings, layer norms, softmax and GELU stay in fp32 in both modes. Quantized models
+are saved with their mode, so utils.inference.load_classifier can rebuild and load them.
+"""
+import io
+import copy
+import warnings
+
+import torch
+import torch.nn as nn
+import torch.ao.quantization as quantization
+
+QUANTIZATION_MODES = ['dynamic', 'static']
+
+class _StaticLinear(nn.Module):
+    # A Linear layer with int8 inputs, whose scale is set by calibration
+    def __init__(self, linear):
+        super().__init__()
+        self.quant = quantization.QuantStub()
+        self.linear = linear
+        self.dequant = quantization.DeQuantStub()
+
+    def forward(self, x):
+        return self.dequant(self.linear(self.quant(x)))
+
+def _wrap_linears(module):
+    # Replace every Linear layer below module with a _StaticLinear, in place
+    for name, child in module.named_children():
+        if isinstance(child, nn.Linear):
+            setattr(module, name, _StaticLinear(child))
+        else:
+            _wrap_linears(child)
+
+# Function to quantize the Linear layers of a model dynamically
+def quantize_dynamic(model):
+    """Return a copy of model with int8 weights and dynamically quantized activations in every Linear layer."""
+    return quantization.quantize_dynamic(model.to('cpu').eval(), {nn.Linear}, dtype=torch.qint8, inplace=False)
+
+# Function to prepare a model for static quantization
+def prepare_static(model):
+    """Return a copy of model with observers recording the input ranges of every Linear layer.
+    Run calibration inputs through it, then pass it to convert_static."""
+    model = _copy(model)
+    qconfig = quantization.get_default_qconfig(torch.backends.quantized.engine)
+    for module in model.modules():
+        if isinstance(module, _StaticLinear):
+            module.qconfig = qconfig
+    return quantization.prepare(model, inplace=True)
+
+# Function to turn a calibrated model into a statically quantized one
+def convert_static(prepared):
+    """Replace the observed Linear layers of a model from prepare_static with int8 ones, in place."""
+    return quantization.convert(prepared.eval(), inplace=True)
+
+# Function to quantize a model statically
+def quantize_static(model, tokenizer, tokens, offsets, max_tokens=16384):
+    """Return a copy of model with int8 Linear layers whose activation scales are calibrated on sequences.
+    Args:
+        model (torch.nn.Module): The fp32 model.
+        tokenizer: The tokenizer of the model, for the padding token.
+        tokens (numpy.ndarray): The concatenated token ids of the calibration texts (see tokenize_flat).
+        offsets (numpy.ndarray): The offsets of the calibration sequences in tokens.
+        max_tokens (int): The padded token budget of a calibration batch.
+    Returns:
+        torch.nn.Module: The quantized model."""
+    from utils.inference import InferenceEngine
+
+    prepared = prepare_static(model)
+    InferenceEngine(prepared, tokenizer, max_tokens=max_tokens).predict_tokens(tokens, offsets)
+    return convert_static(prepared)
+
+# Function to rebuild the structure of a quantized model
+def quantized_structure(model, mode):
+    """Turn an fp32 model into the module structure of a quantized one, so that the state dict of
+    a quantized model of the given mode can be loaded into it. The quantization parameters it
+    has before loading are placeholders.
+    Args:
+        model (torch.nn.Module): The fp32 model, e.g. the base model.
+        mode (str): One of QUANTIZATION_MODES.
+    Returns:
+        torch.nn.Module: The quantized model."""
+    if mode == 'dynamic':
+        return quantize_dynamic(model)
+    if mode == 'static':
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore') # Observers that saw no data warn about their placeholder ranges
+            return convert_static(prepare_static(model))
+    raise ValueError(f"Unknown quantization mode {mode}, expected one of {QUANTIZATION_MODES}")
+
+# Function to save a quantized model
+def save_quantized(model, mode, path):
+    """Save the state dict of a quantized model with its mode, in the checkpoint format that
+    utils.inference.load_classifier reads."""
+    from utils.checkpoint import save_checkpoint
+
+    save_checkpoint({'model_state_dict': model.state_dict(), 'quantization': mode}, path)
+
+# Function to get the serialized size of a model
+def model_size_bytes(model):
+    """The number of bytes of the state dict of model when saved with torch.save."""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes
+
+def _copy(model):
+    # Deep copy of model on the CPU with its Linear layers wrapped for static quantization
+    model = copy.deepcopy(model).to('cpu').eval()
+    _wrap_linears(model)
+    return model
@@ -0,0 +1,98 @@
+"""
+Training reports rendered from the event log of a run.
+
+matplotlib is imported inside the functions and only the object-oriented Figure API is used, so
+importing this module is cheap and needs no display or pyplot backend. Run src/report.py to
+render the plots of a finished or running training run on demand.
+"""
+import os
+
+import numpy as np
+
+from utils.events import read_events
+
+METRICS = ['loss', 'accuracy', 'precision', 'recall', 'f1']
+
+# Function to get the metrics of every epoch from an event log
+def epoch_metrics(events_path):
+    """Return the epoch events of a log as a DataFrame with one row per epoch and split.
+    If a resumed run logged an epoch again, the last record wins.
+    Args:
+        events_path (str): The event log.
+    Returns:
+        pandas.DataFrame: Columns "epoch", "split" and the metrics, per-class metrics as lists."""
+    epochs = read_events(events_path, event='epoch')
+    if epochs.empty:
+        return epochs
+    return epochs.drop_duplicates(subset=['epoch', 'split'], keep='last').sort_values(['split', 'epoch']).reset_index(drop=True)
+
+def _macro(values):
+    # Per-class lists are averaged over the classes
+    return [float(np.mean(value)) if isinstance(value, list) else value for value in values]
+
+# Function to render the plots of a training run
+def render_report(events_path, output_dir=None, title=None):
+    """Plot the loss and metrics over epochs from an event log.
+    Writes METRICS.png (loss and the macro-averaged accuracy, precision, recall and F1) and
+    loss_plot.png with the training and validation curves.
+    Args:
+        events_path (str): The event log.
+        output_dir (str): Folder for the figures. Defaults to the folder of the log.
+        title (str): Optional figure title.
+    Returns:
+        list: The paths of the figures written."""
+    from matplotlib.figure import Figure
+
+    output_dir = output_dir or os.path.dirname(events_path)
+    os.makedirs(output_dir, exist_ok=True)
+    epochs = epoch_metrics(events_path)
+    if epochs.empty:
+        return []
+    splits = [split for split in ['train', 'validation'] if split in set(epochs['split'])]
+    metrics = [metric for metric in METRICS if metric in epochs]
+
+    # All metrics over epochs
+    fig = Figure(figsize=(10, 3 * len(metrics)))
+    axs = fig.subplots(len(metrics), sharex=True, squeeze=False)[:, 0]
+    for ax, metric in zip(axs, metrics):
+        for split in splits:
+            rows = epochs[epochs['split'] == split]
+            ax.plot(rows['epoch'], _macro(rows[metric]), marker='o', label=f"{split.capitalize()} {metric}")
+        ax.set_ylabel(metric.capitalize())
+        ax.legend()
+    axs[-1].set_xlabel('Epochs')
+    if title:
+        fig.suptitle(title)
+    paths = [os.path.join(output_dir, 'METRICS.png')]
+    fig.savefig(paths[-1])
+
+    # Loss over epochs
+    fig = Figure(figsize=(10, 5))
+    ax = fig.subplots()
+    for split in splits:
+        rows = epochs[epochs['split'] == split]
+        ax.plot(rows['epoch'], rows['loss'], marker='o', label=f"{split.capitalize()} loss")
+    ax.set_xlabel('Epochs')
+    ax.set_ylabel('Loss')
+    ax.set_title(title or 'Loss over epochs')
+    ax.legend()
+    paths.append(os.path.join(output_dir, 'loss_plot.png'))
+    fig.savefig(paths[-1])
+    return paths
+
+# Function to plot a confusion matrix
+def plot_confusion_matrix(cm, classes, path, title='Confusion matrix'):
+    """Save a confusion matrix (rows are true labels, columns predictions) as an image."""
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(10, 10))
+    ax = fig.subplots()
+    image = ax.imshow(cm, interpolation='nearest', cmap='Blues')
+    ax.set_title(title)
+    fig.colorbar(image)
+    tick_marks = np.arange(len(classes))
+    ax.set_xticks(tick_marks, classes, rotation=45)
+    ax.set_yticks(tick_marks, classes)
+    ax.set_xlabel('Predicted label')
+    ax.set_ylabel('True label')
+    fig.savefig(path)
@@ -0,0 +1,99 @@
+"""
+Split manifests: which partition (train/val/test) each document belongs to in each fold.
+
+Instead of copying the .docx files of every partition into their own folder and parsing each
+folder separately, the corpus is parsed once and the partitions are selected from it by document.
+A split manifest is a CSV file with one row per (document, fold) holding the document's partition.
+"""
+import os
+
+import pandas as pd
+
+from utils.corpus import load_corpus
+from utils.preprocessing.transcript import combine_turns_by_length
+
+SPLIT_COLUMNS = ['document', 'fold', 'partition']
+
+# The PACS documents and the manifests of its two split schemes: the stratified train/val/test
+# split of clean_and_split.py (also the basis of k-folds.py), and the train/test split of
+# train_test_split.py with the val partition carved out of train by train_val_split.py
+PACS_DATA_DIR = "/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_data"
+PACS_CLEAN_SPLITS_PATH = "/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_splits.csv"
+PACS_TRAIN_TEST_SPLITS_PATH = "/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/PACS_train_test_splits.csv"
+
+# Function to build a split manifest from the document lists of each partition
+def make_split_manifest(partitions, fold=0):
+    """Build the split manifest of one fold.
+    Args:
+        partitions (dict): Maps a partition name (e.g. 'train') to its documents.
+        fold (int): The fold number. Single train/val/test splits use fold 0.
+    Returns:
+        pandas.DataFrame: The manifest, with "document", "fold" and "partition" columns."""
+    frames = [pd.DataFrame({'document': list(documents), 'fold': fold, 'partition': partition})
+              for partition, documents in partitions.items()]
+    return pd.concat(frames, ignore_index=True)[SPLIT_COLUMNS]
+
+# Function to write a split manifest
+def write_split_manifest(splits, path):
+    """Atomically write a split manifest to a CSV file."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    splits[SPLIT_COLUMNS].to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+# Function to read a split manifest
+def read_split_manifest(path):
+    """Read a split manifest written by write_split_manifest."""
+    return pd.read_csv(path, dtype={'document': str, 'fold': int, 'partition': str})
+
+# Function to list the documents of a partition
+def split_documents(splits, partition, fold=0):
+    """Return the documents in a partition of a fold, in manifest order.
+    Args:
+        splits (pandas.DataFrame or str): The split manifest or its path.
+        partition (str): The partition name, e.g. 'train', 'val' or 'test'.
+        fold (int): The fold number.
+    Returns:
+        list: The documents."""
+    if isinstance(splits, str):
+        splits = read_split_manifest(splits)
+    selected = splits[(splits['fold'] == fold) & (splits['partition'] == partition)]
+    if selected.empty:
+        raise ValueError(f"No documents in partition '{partition}' of fold {fold}")
+    return selected['document'].tolist()
+
+# Function to select a partition from a parsed corpus in memory
+def select_split(data, splits, partition, fold=0, target_length=None):
+    """Select the turns of a partition from a DataFrame of parsed turns.
+    Rows keep their order in data, so the result matches parsing the partition's documents on their own.
+    Args:
+        data (pandas.DataFrame): The turns of all documents, with a "document" column.
+        splits (pandas.DataFrame or str): The split manifest or its path.
+        partition (str): The partition name.
+        fold (int): The fold number.
+        target_length (int): If given, combine the turns into instances of at least this many words.
+    Returns:
+        pandas.DataFrame: The turns of the partition."""
+    documents = split_documents(splits, partition, fold)
+    data = data[data['document'].isin(set(documents))].reset_index(drop=True)
+    if target_length is not None:
+        data = combine_turns_by_length(data, [target_length])[target_length]
+    return data
+
+# Function to load a partition from a stored corpus artifact
+def load_split(corpus_path, splits, partition, fold=0, target_length=None, columns=None):
+    """Load the turns of a partition from a corpus artifact, reading only the partition's rows.
+    Args:
+        corpus_path (str): The corpus artifact with the turns of all documents (see load_corpus).
+        splits (pandas.DataFrame or str): The split manifest or its path.
+        partition (str): The partition name.
+        fold (int): The fold number.
+        target_length (int): If given, combine the turns into instances of at least this many words.
+        columns (list): Optional subset of columns to return.
+    Returns:
+        pandas.DataFrame: The turns of the partition."""
+    documents = split_documents(splits, partition, fold)
+    data = load_corpus(corpus_path, documents=documents)
+    if target_length is not None:
+        data = combine_turns_by_length(data, [target_length])[target_length]
+    return data[columns] if columns is not None else data
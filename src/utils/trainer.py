@@ -2,13 +2,24 @@
 
 # Import libraries
 import os
+import time
+import contextlib
 from datetime import datetime
 
 import torch
 import torch.nn as nn
+from torch.nn.parallel import DistributedDataParallel as DDP
 from tqdm import tqdm
-import matplotlib.pyplot as plt
-from torchmetrics import Accuracy, Precision, Recall
+
+from utils.dataset import padding_efficiency
+from utils.packing import packed_forward
+from utils.windows import windowed_forward
+from utils.metrics import ConfusionMatrix
+from utils.events import EventLog, EVENTS_NAME, read_events
+from utils.profiling import PhaseTimer, trace_window, append_summary
+from utils.checkpoint import CheckpointWriter, save_checkpoint, get_rng_state, set_rng_state
+from utils.distributed import is_distributed, is_main_process, all_reduce_sum
+from utils.acceleration import autocast, bf16_supported, compile_model, make_optimizer, CompiledModelFallback, DEFAULT_COMPILE_CACHE_DIR
 
 if __name__ == "__main__":
     # Set device
@@ -17,15 +28,17 @@ if __name__ == "__main__":
 class Trainer:
     def __init__(self, num_labels=3):
         self.model = None
+        self.forward_model = None
+        self._forward_owner = None # The model forward_model was built for, see forward
         self.optimizer = None
         self.loss_fn = None
+        self.bf16 = False
+        self.events = None
         self.train_loader = None
         self.val_loader = None
         self.source = None
         self.num_labels = num_labels
-        self.accuracy = Accuracy(task="multiclass", average=None, num_classes=self.num_labels)
-        self.precision = Precision(task="multiclass", average=None, num_classes=self.num_labels)
-        self.recall = Recall(task="multiclass", average=None, num_classes=self.num_labels)
+        self.metrics = ConfusionMatrix(self.num_labels)
         self.history = {
             'train_loss': [],
             'val_loss': [],
@@ -36,21 +49,87 @@ class Trainer:
             'train_precision': [],
             'val_precision': [],
             'train_recall': [],
-            'val_recall': []
+            'val_recall': [],
+            'train_f1': [],
+            'val_f1': [],
+            'train_padding_efficiency': [],
+            'val_padding_efficiency': []
         }
 
-    def compile(self, model, optimizer, learning_rate, loss_fn, weight_decay=0.01, model_name=None):
+    def compile(self, model, optimizer, learning_rate, loss_fn, weight_decay=0.01, model_name=None,
+                bf16=False, torch_compile=False, fused_optimizer=False, compile_cache_dir=DEFAULT_COMPILE_CACHE_DIR,
+                gradient_checkpointing=False):
+        """Set up the model, optimizer and loss.
+        The acceleration options are opt-in and fall back silently where unsupported:
+        bf16 autocast needs native bf16 on the device, torch_compile reverts to eager mode if
+        compilation fails, fused_optimizer uses the foreach implementation if there is no fused kernel.
+        gradient_checkpointing recomputes activations in the backward pass instead of storing them,
+        trading about a third more compute for much less memory."""
         self.model = model
-        self.optimizer = optimizer(self.model.parameters(), lr=learning_rate, weight_decay = weight_decay)
+        if gradient_checkpointing:
+            model.gradient_checkpointing_enable()
+        self.optimizer = make_optimizer(optimizer, self.model.parameters(), learning_rate, weight_decay, fused=fused_optimizer)
         self.loss_fn = loss_fn
+        self.bf16 = bf16
+        if bf16 and not bf16_supported(next(model.parameters()).device):
+            print("bf16 is not natively supported on this device, training in fp32")
+            self.bf16 = False
+
+        # The module called in forward passes: DistributedDataParallel inside a process group, compiled if requested
+        self.forward_model = DDP(model) if is_distributed() else model
+        if torch_compile:
+            self.forward_model = CompiledModelFallback(compile_model(self.forward_model, compile_cache_dir), self.forward_model)
+        self._forward_owner = model
         if model_name is None:
             self.model_name = "unspecified"
         else:
             self.model_name = model_name
         self.model_dir = f"/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Outputs/trained_models/{self.model_name}_{datetime.now().strftime('%Y-%m-%d_%H%M')}"
 
-    def fit(self, num_epochs, train_loader, device, val_loader=None, patience=5, min_delta=0.0001):
+    def forward(self, batch, device):
+        """Return the logits and targets of a batch, one row per example.
+        Packed batches (from utils.packing.collate_packed) get one row per segment, windowed
+        batches (from utils.windows.collate_windows) one row per document."""
+        labels = batch['targets'].to(device)
+        if 'segment_ids' in batch:
+            if is_distributed():
+                raise ValueError("Packed batches are not supported in distributed training")
+            return packed_forward(self.model, batch, device), labels
+        if 'window_document' in batch:
+            if is_distributed():
+                raise ValueError("Windowed batches are not supported in distributed training")
+            return windowed_forward(self.model, batch, device), labels
+        texts = batch['input_ids'].to(device)
+        attention_mask = batch['attention_mask'].to(device)
+        model = self.model
+        if self._forward_owner is self.model:
+            model = self.forward_model
+        outputs = model(texts, attention_mask=attention_mask)
+        return outputs.logits, labels
+
+    def fit(self, num_epochs, train_loader, device, val_loader=None, patience=5, min_delta=0.0001, accumulation_steps=1,
+            keep_checkpoints=3, checkpoint_every=None, resume_from=None, profile=False, profile_steps=None):
+        """Train the model, with early stopping on the validation loss.
+        With accumulation_steps > 1, gradients of that many consecutive batches are summed before each
+        optimizer step (each batch's loss is divided by the number of batches in its group), so the
+        update matches one batch of accumulation_steps times the size. Losses and metrics are still
+        tracked per batch and epoch, so early stopping is unaffected.
+        Epoch checkpoints are written in the background, keeping the keep_checkpoints with the lowest
+        validation loss and the latest (None keeps all). fit returns once they are all on disk.
+        With checkpoint_every, a checkpoint is also written every that many batches (a multiple of
+        accumulation_steps, so no partial gradients are lost). resume_from continues the run of
+        a checkpoint written by fit, with the same loaders: it restores the epoch, the batch
+        position in the epoch, the early stopping state, the random generators and the loss and
+        metrics accumulated so far, so a killed run continues without repeating batches. It also
+        continues in the model folder of the run, so its checkpoints are rotated together with the
+        new ones and profile.csv and the event log are appended to.
+        Every epoch's samples/s, tokens/s, padding ratio and peak RSS are appended to profile.csv
+        and the event log in the model folder. profile=True adds the seconds spent waiting for data,
+        in forward, backward, optimizer steps and metric updates. profile_steps=(start, stop)
+        records a torch.profiler trace of those batches (counted from the start of this call) to
+        the profile folder next to the checkpoints."""
         self.train_loader = train_loader
+        self.accumulation_steps = accumulation_steps
         self.val_loader = val_loader
         self.patience = patience
         self.best_val_loss = float('inf')
@@ -58,77 +137,155 @@ class Trainer:
         self.epochs_without_improvement = 0
         self.min_delta = min_delta
         
+        if checkpoint_every is not None and checkpoint_every % accumulation_steps != 0:
+            raise ValueError(f"checkpoint_every ({checkpoint_every}) must be a multiple of accumulation_steps ({accumulation_steps})")
+
+        # Continue a run from where its checkpoint was taken, in its model folder
+        start_epoch, resume = 0, None
+        if resume_from is not None:
+            resume = self.load(resume_from, "cpu")['training_state']
+            start_epoch = resume['epoch']
+            self.best_val_loss = resume['best_val_loss']
+            self.current_patience = resume['current_patience']
+            self.model_dir = resume.get('model_dir') or os.path.dirname(os.path.abspath(resume_from))
+            print(f"Resuming from epoch {start_epoch + 1}, batch {resume['step'] + 1} in {self.model_dir}")
+
         os.makedirs(self.model_dir, exist_ok=True)
-        figure_num = 0
+        self.checkpoint_writer = CheckpointWriter(keep_top_k=keep_checkpoints) if is_main_process() else None
+        if resume is not None and self.checkpoint_writer is not None:
+            self._track_checkpoints()
+            self._check_event_log(start_epoch)
+        self.timer = PhaseTimer(enabled=profile, synchronize=device.type == 'cuda')
+        profiler = trace_window(os.path.join(self.model_dir, 'profile'), profile_steps if is_main_process() else None)
+        self._log('fit_start', model_name=self.model_name, num_epochs=num_epochs, start_epoch=start_epoch + 1,
+                  start_step=resume['step'] if resume is not None else 0, batches_per_epoch=len(train_loader),
+                  samples=len(train_loader.dataset), accumulation_steps=accumulation_steps,
+                  tokenize_seconds=getattr(train_loader.dataset, 'tokenize_seconds', None), resume_from=resume_from)
+        profiler.start()
 
-        for epoch in range(num_epochs):
+        for epoch in range(start_epoch, num_epochs):
             self.model.train()
-            total_loss = 0.0
-            with tqdm(total=len(self.train_loader), desc=f"Epoch {epoch + 1}/{num_epochs}") as pbar:
-                for batch in self.train_loader:
+            total_loss = torch.zeros((), device=device)
+            real_tokens, padded_tokens = 0, 0
+            start_step = 0
+            if resume is not None:
+                set_rng_state(resume['epoch_rng'] if resume['step'] else resume['rng'])
+                start_step = resume['step']
+                progress = resume['progress']
+                # Only one process restores the counts, they were summed over all processes when saved
+                if progress is not None and is_main_process():
+                    total_loss += progress['total_loss']
+                    real_tokens, padded_tokens = progress['real_tokens'], progress['padded_tokens']
+                    self.metrics.load_state_dict(progress['confusion_matrix'])
+            epoch_rng = get_rng_state()
+
+            # Draw a new order for samplers that shuffle per epoch
+            for sampler in (self.train_loader.sampler, self.train_loader.batch_sampler):
+                if hasattr(sampler, 'set_epoch'):
+                    sampler.set_epoch(epoch)
+
+            # Skip the batches a resumed epoch already trained on, without loading them where the sampler allows
+            if start_step and hasattr(self.train_loader.batch_sampler, 'skip_batches'):
+                self.train_loader.batch_sampler.skip_batches(start_step)
+                batches = iter(self.train_loader)
+            else:
+                batches = iter(self.train_loader)
+                for _ in range(start_step):
+                    next(batches)
+            if resume is not None:
+                if start_step:
+                    set_rng_state(resume['rng'])
+                resume = None
+
+            num_batches = len(self.train_loader)
+            self.timer.reset()
+            with tqdm(total=num_batches, initial=start_step, desc=f"Epoch {epoch + 1}/{num_epochs}", disable=not is_main_process()) as pbar:
+                for step, batch in enumerate(self.timer.iterate(batches), start=start_step):
+                    # Number of batches accumulated into this optimizer step (the last group may be shorter)
+                    group_len = min(accumulation_steps, num_batches - step + step % accumulation_steps)
+                    if step % accumulation_steps == 0:
+                        self.optimizer.zero_grad()
+
                     # Make predictions
-                    texts = batch['input_ids'].to(device)
-                    attention_mask = batch['attention_mask'].to(device)
-                    labels = batch['targets'].to(device)
-                    self.optimizer.zero_grad()
-                    outputs = self.model(texts, attention_mask=attention_mask)
-                    logits = outputs.logits
-
-                    # Calculate train metrics
-                    loss = self.loss_fn(logits, labels)
-                    train_acc = self.accuracy(logits.softmax(dim=1), labels)
-                    train_precision = self.precision(logits.softmax(dim=1), labels)
-                    train_recall = self.recall(logits.softmax(dim=1), labels)
+                    batch_tokens = int(batch['attention_mask'].sum())
+                    real_tokens += batch_tokens
+                    padded_tokens += batch['attention_mask'].numel()
+                    self.timer.count(len(batch['targets']), batch_tokens, batch['attention_mask'].numel())
 
-                    # Backpropagation
-                    loss.backward()
-                    self.optimizer.step()
-                    total_loss += loss.item()
+                    # Only synchronise gradients between processes on the last batch of an accumulation group
+                    last_in_group = (step + 1) % accumulation_steps == 0 or step + 1 == num_batches
+                    sync = contextlib.nullcontext() if last_in_group or not isinstance(self.forward_model, DDP) else self.forward_model.no_sync()
+                    with sync:
+                        with self.timer.phase('forward'), autocast(device, self.bf16):
+                            logits, labels = self.forward(batch, device)
+                            loss = self.loss_fn(logits, labels)
+
+                        # Backpropagation
+                        with self.timer.phase('backward'):
+                            (loss / group_len).backward()
+                    if (step + 1) % accumulation_steps == 0 or step + 1 == num_batches:
+                        with self.timer.phase('optimizer'):
+                            self.optimizer.step()
+
+                    # Accumulate loss and metrics on the device, without waiting for the step to finish
+                    with self.timer.phase('metrics'):
+                        total_loss += loss.detach().float()
+                        self.metrics.update(logits, labels)
 
                     # Update the progress bar
                     pbar.update(1)
+                    profiler.step()
+
+                    # Mid-epoch checkpoint for resuming a killed run
+                    if checkpoint_every is not None and (step + 1) % checkpoint_every == 0 and step + 1 < num_batches:
+                        with self.timer.phase('checkpoint'):
+                            self._checkpoint_step(epoch, step + 1, epoch_rng, total_loss, real_tokens, padded_tokens)
             
-            # Compute metrics
-            avg_loss = total_loss / len(self.train_loader)
-            train_acc = self.accuracy.compute()
-            train_precision = self.precision.compute()
-            train_recall = self.recall.compute()
+            # Throughput of this epoch, summed over all processes in distributed training
+            counts = all_reduce_sum(torch.tensor([self.timer.samples, self.timer.tokens, self.timer.padded_tokens], dtype=torch.float64)).tolist()
+            throughput = self.timer.summary(*(int(count) for count in counts))
+
+            # Compute metrics, summed over all processes in distributed training
+            avg_loss, real_tokens, padded_tokens = self._reduce_epoch_totals(total_loss, num_batches, real_tokens, padded_tokens)
+            metrics = self.metrics.compute()
+            train_acc, train_precision, train_recall, train_f1 = metrics['accuracy'], metrics['precision'], metrics['recall'], metrics['f1']
+            train_padding_efficiency = padding_efficiency(real_tokens, padded_tokens)
 
             # Add metrics to history
             self.history['train_loss'].append(avg_loss)
             self.history['train_acc'].append(train_acc)
             self.history['train_precision'].append(train_precision)
             self.history['train_recall'].append(train_recall)
+            self.history['train_f1'].append(train_f1)
+            self.history['train_padding_efficiency'].append(train_padding_efficiency)
 
             # Print metrics
-            print(f"Training Loss: {avg_loss}")
-            print(f"Training Accuracy: {train_acc}")
-            print(f"Training Precision: {train_precision}")
-            print(f"Training Recall: {train_recall}")
+            if is_main_process():
+                print(f"Training Loss: {avg_loss}")
+                print(f"Training Accuracy: {train_acc}")
+                print(f"Training Precision: {train_precision}")
+                print(f"Training Recall: {train_recall}")
+                print(f"Training F1: {train_f1}")
+                print(f"Training Padding Efficiency: {train_padding_efficiency:.3f}")
 
             # Reset metrics
-            self.accuracy.reset()
-            self.precision.reset()
-            self.recall.reset()
-            
+            self.metrics.reset()
+            self.epoch = epoch + 1
+            self._log('epoch', epoch=self.epoch, split='train', loss=avg_loss, padding_efficiency=train_padding_efficiency, **metrics)
+
             if self.val_loader is not None:
                 # Calculate validation loss
+                validation_start = time.perf_counter()
                 val_loss = self.evaluate(self.val_loader, device, "Validation")
+                throughput['validation_seconds'] = time.perf_counter() - validation_start
 
                 # Add val loss to history
                 self.history['val_loss'].append(val_loss)
 
-                # Plot the loss
-                plt.plot(self.history['train_loss'], label='train_loss')
-                plt.plot(self.history['val_loss'], label='val_loss')
-                plt.xlabel('Epochs')
-                plt.ylabel('Loss')
-                plt.title('Loss over epochs')
-                plt.legend()
-                os.makedirs('Outputs/Figures', exist_ok=True)
-                plt.savefig(f"{self.model_dir}/loss_plot_{self.model_name}_{datetime.now().strftime('%Y-%m-%d_%H%M')}_{str(figure_num)}.png")
-                plt.clf()
+            # Write the throughput of the epoch next to the checkpoints
+            self._write_profile(epoch + 1, throughput)
 
+            if self.val_loader is not None:
                 # Check for early stopping
                 if val_loss < self.best_val_loss:
                     self.best_val_loss = val_loss
@@ -137,82 +294,165 @@ class Trainer:
                     self.current_patience += 1
                     if self.current_patience >= self.patience:
                         print(f"Early stopping after {epoch + 1} epochs.")
+                        self._log('early_stopping', epoch=epoch + 1, best_val_loss=self.best_val_loss)
                         break
 
-            ### save checkpoint of model and plot
-            ### MODEL
+            # Only the first process writes checkpoints
+            if not is_main_process():
+                continue
+
+            ### save checkpoint of model
             os.makedirs(self.model_dir, exist_ok=True)
-            model_name = f"{self.model_name}_checkpoint_EPOCH_{epoch+1}_SAMPLES_{len(self.train_loader.dataset)}_BATCHSIZE_{self.train_loader.batch_size}.pt"
-            # torch.save(self.model.state_dict(), 'Outputs/trained_models/' + model_name)
-            self.save(f"{self.model_dir}/{model_name}")
-            print(f'Checkpoint after epoch {epoch+1} saved successfully')
-
-            ### PLOT
-            try:
-                history = self.history
-                # Plot the loss history
-                plt.plot(history['train_loss'], label='Train Loss')
-                plt.plot(history['val_loss'], label='Validation Loss')
-                plt.xlabel('Epoch')
-                plt.ylabel('Loss')
-                plt.title('Training History')
-                plt.legend()
-                plt.savefig(f"{self.model_dir}/{self.model_name}_checkpoint_EPOCH_{epoch}_SAMPLES_{len(self.train_loader.dataset)}_BATCHSIZE_{self.train_loader.batch_size}_{datetime.now().strftime('%Y-%m-%d_%H%M')}.png")
-            except:
-                print('Error generating plot')
+            batch_size = (self.train_loader.batch_size or self.train_loader.batch_sampler.batch_size) * accumulation_steps
+            model_name = f"{self.model_name}_checkpoint_EPOCH_{epoch+1}_SAMPLES_{len(self.train_loader.dataset)}_BATCHSIZE_{batch_size}.pt"
+            # Snapshot to CPU now, the file is written in the background
+            training_state = self._training_state(epoch + 1, 0)
+            metric = val_loss if self.val_loader is not None else None
+            self.checkpoint_writer.submit(self.state_dict(training_state), f"{self.model_dir}/{model_name}", metric=metric)
+            self._log('checkpoint', epoch=epoch + 1, step=0, path=f"{self.model_dir}/{model_name}", val_loss=metric)
+            print(f'Checkpoint after epoch {epoch+1} queued for saving')
+
+        profiler.stop()
+
+        # Wait for the last checkpoints to be written
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.close()
+            self.best_checkpoint = self.checkpoint_writer.best()
+        self._log('fit_end', best_val_loss=self.best_val_loss, best_checkpoint=getattr(self, 'best_checkpoint', None))
 
     def evaluate(self, data_loader, device, mode="Test"):
         self.model.eval()
-        total_loss = 0.0
+        total_loss = torch.zeros((), device=device)
+        real_tokens, padded_tokens = 0, 0
+        num_batches = len(data_loader)
         with torch.no_grad():
             for batch in data_loader:
-                # Move the data to the GPU
-                texts = batch['input_ids'].to(device)
-                attention_mask = batch['attention_mask'].to(device)
-                labels = batch['targets'].to(device)
-
                 # Make predictions
-                outputs = self.model(texts, attention_mask=attention_mask)
-                logits = outputs.logits
+                real_tokens += int(batch['attention_mask'].sum())
+                padded_tokens += batch['attention_mask'].numel()
+                with autocast(device, self.bf16):
+                    logits, labels = self.forward(batch, device)
+                    loss = self.loss_fn(logits, labels)
 
                 # Calculate metrics
-                loss = self.loss_fn(logits, labels)
-                total_loss += loss.item()
-                val_acc = self.accuracy(logits.softmax(dim=1), labels)
-                val_precision = self.precision(logits.softmax(dim=1), labels)
-                val_recall = self.recall(logits.softmax(dim=1), labels)
-
-        # Compute metrics
-        avg_loss = total_loss / len(data_loader)
-        val_acc = self.accuracy.compute()
-        val_precision = self.precision.compute()
-        val_recall = self.recall.compute()
+                total_loss += loss.float()
+                self.metrics.update(logits, labels)
+
+        # Compute metrics, summed over all processes in distributed training
+        avg_loss, real_tokens, padded_tokens = self._reduce_epoch_totals(total_loss, num_batches, real_tokens, padded_tokens)
+        metrics = self.metrics.compute()
+        val_acc, val_precision, val_recall, val_f1 = metrics['accuracy'], metrics['precision'], metrics['recall'], metrics['f1']
+        val_padding_efficiency = padding_efficiency(real_tokens, padded_tokens)
 
         if mode == "Validation":
             # Add metrics to history
             self.history['val_acc'].append(val_acc)
             self.history['val_precision'].append(val_precision)
             self.history['val_recall'].append(val_recall)
+            self.history['val_f1'].append(val_f1)
+            self.history['val_padding_efficiency'].append(val_padding_efficiency)
 
         # Print metrics
-        print(f"{mode} Loss: {avg_loss}")
-        print(f"{mode} Accuracy: {val_acc}")
-        print(f"{mode} Precision: {val_precision}")
-        print(f"{mode} Recall: {val_recall}")
+        if is_main_process():
+            print(f"{mode} Loss: {avg_loss}")
+            print(f"{mode} Accuracy: {val_acc}")
+            print(f"{mode} Precision: {val_precision}")
+            print(f"{mode} Recall: {val_recall}")
+            print(f"{mode} F1: {val_f1}")
+            print(f"{mode} Padding Efficiency: {val_padding_efficiency:.3f}")
 
         # Reset metrics
-        self.accuracy.reset()
-        self.precision.reset()
-        self.recall.reset()
+        self.metrics.reset()
+        if mode == "Validation":
+            self._log('epoch', epoch=getattr(self, 'epoch', None), split='validation', loss=avg_loss, padding_efficiency=val_padding_efficiency, **metrics)
+        else:
+            self._log('evaluation', split=mode.lower(), loss=avg_loss, padding_efficiency=val_padding_efficiency, **metrics)
 
         return avg_loss
     
-    def save(self, filepath):
-        torch.save({
+    def _reduce_epoch_totals(self, total_loss, num_batches, real_tokens, padded_tokens):
+        # Average the loss over the batches of all processes and sum the token counts (the only host sync of the loss)
+        totals = all_reduce_sum(torch.tensor([float(total_loss), num_batches, real_tokens, padded_tokens], dtype=torch.float64))
+        total_loss, num_batches, real_tokens, padded_tokens = totals.tolist()
+        return total_loss / num_batches, int(real_tokens), int(padded_tokens)
+
+    def _training_state(self, epoch, step, epoch_rng=None, progress=None):
+        # Everything fit needs to continue at batch step of epoch
+        return {
+            'epoch': epoch,
+            'step': step,
+            'model_dir': self.model_dir,
+            'best_val_loss': self.best_val_loss,
+            'current_patience': self.current_patience,
+            'rng': get_rng_state(),
+            'epoch_rng': epoch_rng,
+            'progress': progress
+        }
+
+    def _checkpoint_step(self, epoch, step, epoch_rng, total_loss, real_tokens, padded_tokens):
+        # Sum the partial epoch over all processes, then the first process writes the checkpoint
+        totals = all_reduce_sum(torch.tensor([float(total_loss), real_tokens, padded_tokens], dtype=torch.float64)).tolist()
+        progress = {'total_loss': totals[0], 'real_tokens': int(totals[1]), 'padded_tokens': int(totals[2]),
+                    'confusion_matrix': all_reduce_sum(self.metrics.state_dict())}
+        if not is_main_process():
+            return
+        state = self.state_dict(self._training_state(epoch, step, epoch_rng, progress))
+        self.checkpoint_writer.submit(state, f"{self.model_dir}/{self.model_name}_checkpoint_EPOCH_{epoch+1}_STEP_{step}.pt")
+        self._log('checkpoint', epoch=epoch + 1, step=step, path=f"{self.model_dir}/{self.model_name}_checkpoint_EPOCH_{epoch+1}_STEP_{step}.pt")
+
+    def _write_profile(self, epoch, throughput):
+        # Print the throughput and append it to profile.csv and the event log
+        if not is_main_process():
+            return
+        peak_rss = throughput['peak_rss_bytes']
+        print(f"Throughput: {throughput['samples_per_s']:.1f} samples/s, {throughput['tokens_per_s']:.0f} tokens/s, "
+              f"padding {throughput['padding_ratio']:.1%}" + (f", peak RSS {peak_rss / 1024**3:.2f} GB" if peak_rss else ""))
+        append_summary({'epoch': epoch, **throughput}, os.path.join(self.model_dir, 'profile.csv'))
+        self._log('profile', epoch=epoch, **throughput)
+
+    def _track_checkpoints(self):
+        # Hand the checkpoints the resumed run left on disk to the writer, so keep_checkpoints holds across the resume
+        events_path = os.path.join(self.model_dir, EVENTS_NAME)
+        if not os.path.exists(events_path):
+            return
+        for record in read_events(events_path, 'checkpoint').to_dict('records'):
+            metric = record.get('val_loss')
+            if os.path.exists(record['path']):
+                self.checkpoint_writer.track(record['path'], None if metric is None or metric != metric else metric)
+
+    def _check_event_log(self, epoch):
+        # The resumed run appends to the event log of its folder, which should hold the epochs before the resume
+        events_path = os.path.join(self.model_dir, EVENTS_NAME)
+        logged = read_events(events_path, 'epoch') if os.path.exists(events_path) else None
+        last_epoch = int(logged['epoch'].max()) if logged is not None and not logged.empty else 0
+        if last_epoch < epoch:
+            print(f"Warning: the event log in {self.model_dir} has {last_epoch} of the {epoch} epochs before the resume, "
+                  f"the report will only plot the epochs it has")
+
+    def _log(self, event, **fields):
+        # Append to the event log in the model folder, opened on first use by the first process
+        if not is_main_process():
+            return
+        path = os.path.join(self.model_dir, EVENTS_NAME)
+        if self.events is None or self.events.path != path:
+            if self.events is not None:
+                self.events.close()
+            os.makedirs(self.model_dir, exist_ok=True)
+            self.events = EventLog(path)
+        self.events.log(event, **fields)
+
+    def state_dict(self, training_state=None):
+        state = {
             'model_state_dict': self.model.state_dict(),
             'optimizer_state_dict': self.optimizer.state_dict(),
             'history': self.history
-        }, filepath)
+        }
+        if training_state is not None:
+            state['training_state'] = training_state
+        return state
+
+    def save(self, filepath):
+        save_checkpoint(self.state_dict(), filepath)
         print(f"Model and training history saved to {filepath}")
 
     def load(self, filepath, source):
@@ -222,5 +462,6 @@ class Trainer:
             checkpoint = torch.load(filepath)
         self.model.load_state_dict(checkpoint['model_state_dict'])
         self.optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
-        self.history = checkpoint['history']
-        print(f"Model and training history loaded from {filepath}")
\ No newline at end of file
+        self.history.update(checkpoint['history']) # Keeps the keys of checkpoints from before they were tracked
+        print(f"Model and training history loaded from {filepath}")
+        return checkpoint
\ No newline at end of file
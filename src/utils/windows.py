@@ -0,0 +1,235 @@
+"""
+Sliding-window encoding of whole transcripts.
+
+The patient speech of every document is tokenized once into a single token stream, without
+truncation or special tokens (and cached by TokenCache like any corpus). Windows are slices of
+that stream of max_len tokens minus the special tokens, started every stride tokens, so
+consecutive windows share max_len - stride - 2 tokens (for RoBERTa) and nothing is re-tokenized
+per window: the special tokens are added when a batch is assembled. The encoder reads the
+windows of several documents per batch, the first-token states of the windows of a document are
+pooled into a document embedding, and the classification head of the model is applied to it.
+"""
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+from tqdm import tqdm
+
+from utils.dataset import TokenCache
+from utils.packing import classification_head
+from utils.inference import token_budget_batches
+from utils.acceleration import autocast
+
+# Ways to pool the window states of a document
+POOLING_METHODS = ['mean', 'max']
+
+# Function to place windows over a token stream
+def window_starts(length, window, stride):
+    """Start positions of windows of window tokens every stride tokens over a stream of length tokens.
+    The last window is aligned to the end of the stream, so it may overlap its predecessor more
+    than stride implies. A stream of at most window tokens is a single window.
+    Args:
+        length (int): The number of tokens in the stream.
+        window (int): The number of stream tokens per window.
+        stride (int): The distance between window starts, between 1 and window.
+    Returns:
+        numpy.ndarray: The start positions."""
+    if not 0 < stride <= window:
+        raise ValueError(f"The stride must be between 1 and the window size {window}, got {stride}")
+    if length <= window:
+        return np.zeros(1, dtype=np.int64)
+    return np.append(np.arange(0, length - window, stride), length - window)
+
+# Function to get the special tokens around a sequence
+def special_tokens(tokenizer):
+    """The token ids a tokenizer puts before and after a single sequence, e.g. ([0], [2]) for RoBERTa."""
+    ids = tokenizer('a')['input_ids']
+    content = tokenizer('a', add_special_tokens=False)['input_ids']
+    i = next(i for i in range(len(ids) - len(content) + 1) if ids[i:i + len(content)] == content)
+    return ids[:i], ids[i + len(content):]
+
+class WindowedDataset(Dataset):
+    """Dataset of whole documents as sliding windows over their token streams.
+
+    Args:
+        dataframe (pandas.DataFrame): Turns with "text", "label" and "document" columns, in
+            transcript order. The turns of a document are joined into one text.
+        tokenizer: A Hugging Face tokenizer.
+        max_len (int): The number of tokens per window, special tokens included.
+        overlap (int): The number of tokens shared by consecutive windows.
+        stride (int): The distance between window starts. Overrides overlap if given.
+        max_windows (int): Optional cap on the windows per item, to bound the memory of training.
+            Documents with more windows get an evenly spaced selection, or a random run of
+            consecutive windows if sample_windows is True.
+        sample_windows (bool): Draw a new run of windows every time an item is read (for training).
+        cache (TokenCache): The tokenization cache. Defaults to one in DEFAULT_TOKEN_CACHE_DIR.
+    """
+    def __init__(self, dataframe, tokenizer, max_len, overlap=128, stride=None, max_windows=None,
+                 sample_windows=False, cache=None):
+        documents = dataframe.groupby('document', sort=False)
+        self.documents = list(documents.groups)
+        self.tokenizer = tokenizer
+        self.max_len = max_len
+        self.prefix, self.suffix = special_tokens(tokenizer)
+        self.window = max_len - len(self.prefix) - len(self.suffix)
+        self.stride = stride if stride is not None else self.window - overlap
+        self.max_windows = max_windows
+        self.sample_windows = sample_windows
+        self.cache = cache if cache is not None else TokenCache()
+        start = time.perf_counter()
+        self.tokens, self.offsets = self.cache.load(documents['text'].agg(' '.join).tolist(), tokenizer, None)
+        self.tokenize_seconds = time.perf_counter() - start # Tokenizing, or loading from the cache
+        self.starts = [window_starts(length, self.window, self.stride) for length in np.diff(self.offsets)]
+        self.targets = torch.tensor(documents['label'].first().to_numpy())
+
+    def __len__(self):
+        return len(self.documents)
+
+    def num_windows(self):
+        """The number of windows of every item, after max_windows."""
+        counts = np.array([len(starts) for starts in self.starts])
+        return counts if self.max_windows is None else np.minimum(counts, self.max_windows)
+
+    def lengths(self):
+        """The number of tokens of the windows of every item, special tokens included."""
+        window_lengths = np.minimum(np.diff(self.offsets), self.window) + len(self.prefix) + len(self.suffix)
+        return self.num_windows() * window_lengths
+
+    def _select(self, starts):
+        # Keep at most max_windows windows
+        if self.max_windows is None or len(starts) <= self.max_windows:
+            return starts
+        if self.sample_windows:
+            first = int(torch.randint(len(starts) - self.max_windows + 1, ()))
+            return starts[first:first + self.max_windows]
+        return starts[np.linspace(0, len(starts) - 1, self.max_windows).round().astype(int)]
+
+    def __getitem__(self, index):
+        stream = self.tokens[self.offsets[index]:self.offsets[index + 1]]
+        return {'windows': [stream[start:start + self.window] for start in self._select(self.starts[index])],
+                'targets': self.targets[index]}
+
+def _pad_windows(windows, pad_token_id, prefix, suffix):
+    # Add the special tokens to every window and pad them to the longest one
+    max_len = max(len(window) for window in windows) + len(prefix) + len(suffix)
+    input_ids = np.full((len(windows), max_len), pad_token_id, dtype=np.int64)
+    attention_mask = np.zeros((len(windows), max_len), dtype=np.int64)
+    for row, window in enumerate(windows):
+        length = len(window) + len(prefix) + len(suffix)
+        input_ids[row, :len(prefix)] = prefix
+        input_ids[row, len(prefix):len(prefix) + len(window)] = window
+        input_ids[row, len(prefix) + len(window):length] = suffix
+        attention_mask[row, :length] = 1
+    return torch.from_numpy(input_ids), torch.from_numpy(attention_mask)
+
+# Function to collate windowed documents
+def collate_windows(batch, pad_token_id, prefix, suffix):
+    """Stack the windows of the documents of a batch into one padded batch of windows.
+    Args:
+        batch (list): Items of a WindowedDataset.
+        pad_token_id (int): The id of the padding token.
+        prefix, suffix (list): The special tokens around every window (WindowedDataset.prefix and .suffix).
+    Returns:
+        dict: "input_ids" and "attention_mask" (windows x padded length), "window_document" (the
+        position in the batch of the document of every window) and "targets" (one per document)."""
+    windows = [window for item in batch for window in item['windows']]
+    input_ids, attention_mask = _pad_windows(windows, pad_token_id, prefix, suffix)
+    return {'input_ids': input_ids,
+            'attention_mask': attention_mask,
+            'window_document': torch.repeat_interleave(torch.arange(len(batch)), torch.tensor([len(item['windows']) for item in batch])),
+            'targets': torch.stack([item['targets'] for item in batch])}
+
+# Function to pool window states into document states
+def pool_windows(states, window_document, num_documents, pooling='mean'):
+    """Pool the states of windows (windows, hidden) into one per document (num_documents, hidden).
+    Args:
+        states (torch.Tensor): The window states.
+        window_document (torch.Tensor): The document of every window.
+        num_documents (int): The number of documents.
+        pooling (str): "mean" or "max" over the windows of a document.
+    Returns:
+        torch.Tensor: The document states."""
+    index = window_document.to(states.device)
+    if pooling == 'mean':
+        counts = torch.bincount(index, minlength=num_documents).clamp(min=1).to(states.dtype)
+        return states.new_zeros(num_documents, states.shape[1]).index_add(0, index, states) / counts[:, None]
+    if pooling == 'max':
+        expanded = index[:, None].expand_as(states)
+        return states.new_full((num_documents, states.shape[1]), -torch.inf).scatter_reduce(0, expanded, states, 'amax')
+    raise ValueError(f"Unknown pooling {pooling}, expected one of {POOLING_METHODS}")
+
+# Function to classify the documents of a windowed batch
+def windowed_forward(model, batch, device, pooling='mean'):
+    """Return the logits of every document of a collate_windows batch: the first-token states of
+    its windows, pooled, under the classification head of the model (see packing.classification_head).
+    Args:
+        model: A Hugging Face model for sequence classification.
+        batch (dict): A batch from collate_windows.
+        device (torch.device): The device of the model.
+        pooling (str): How window states are pooled (see POOLING_METHODS).
+    Returns:
+        torch.Tensor: Logits of shape (documents, labels)."""
+    base_model = getattr(model, model.base_model_prefix)
+    states = base_model(batch['input_ids'].to(device), attention_mask=batch['attention_mask'].to(device)).last_hidden_state[:, 0]
+    return classification_head(model, pool_windows(states, batch['window_document'], len(batch['targets']), pooling))
+
+# Function to encode whole documents with sliding windows
+def encode_documents(model, dataset, device, max_tokens=16384, pooling='mean', bf16=False, progress=False):
+    """Encode all windows of all documents of a WindowedDataset, ignoring max_windows, and pool
+    them into document embeddings and logits. Windows of different documents share batches of at
+    most max_tokens padded tokens and only the running pooled states are kept per document.
+    Args:
+        model: A Hugging Face model for sequence classification.
+        dataset (WindowedDataset): The documents.
+        device (torch.device): The device of the model.
+        max_tokens (int): The padded token budget of a batch of windows.
+        pooling (str): How window states are pooled (see POOLING_METHODS).
+        bf16 (bool): Run under bf16 autocast.
+        progress (bool): Show a progress bar over batches.
+    Returns:
+        A tuple of (embeddings, logits, stats): float32 arrays of shape (documents, hidden) and
+        (documents, labels) in dataset order, and a dict with the number of windows and tokens,
+        the seconds taken, tokens/s and documents/s."""
+    if pooling not in POOLING_METHODS:
+        raise ValueError(f"Unknown pooling {pooling}, expected one of {POOLING_METHODS}")
+    base_model = getattr(model, model.base_model_prefix)
+    window_document = np.repeat(np.arange(len(dataset)), [len(starts) for starts in dataset.starts])
+    window_start = np.concatenate(dataset.starts)
+    stream_lengths = np.diff(dataset.offsets)
+    window_lengths = np.minimum(stream_lengths[window_document] - window_start, dataset.window)
+    num_special = len(dataset.prefix) + len(dataset.suffix)
+
+    hidden_size = model.config.hidden_size
+    pooled = torch.full((len(dataset), hidden_size), 0.0 if pooling == 'mean' else -torch.inf, device=device)
+    real_tokens, padded_tokens = 0, 0
+    model.eval()
+    start_time = time.perf_counter()
+    with torch.inference_mode():
+        for indices in tqdm(token_budget_batches(window_lengths + num_special, max_tokens), desc="Windows", disable=not progress):
+            starts = dataset.offsets[window_document[indices]] + window_start[indices]
+            windows = [dataset.tokens[start:start + length] for start, length in zip(starts, window_lengths[indices])]
+            input_ids, attention_mask = _pad_windows(windows, dataset.tokenizer.pad_token_id, dataset.prefix, dataset.suffix)
+            real_tokens += int(attention_mask.sum())
+            padded_tokens += attention_mask.numel()
+            with autocast(device, bf16):
+                states = base_model(input_ids.to(device), attention_mask=attention_mask.to(device)).last_hidden_state[:, 0].float()
+            index = torch.from_numpy(window_document[indices]).to(device)
+            if pooling == 'mean':
+                pooled.index_add_(0, index, states)
+            else:
+                pooled.scatter_reduce_(0, index[:, None].expand_as(states), states, 'amax')
+        if pooling == 'mean':
+            pooled /= torch.bincount(torch.from_numpy(window_document), minlength=len(dataset)).clamp(min=1).to(device)[:, None]
+        with autocast(device, bf16):
+            logits = classification_head(model, pooled).float()
+    seconds = time.perf_counter() - start_time
+
+    stats = {'documents': len(dataset),
+             'windows': len(window_start),
+             'tokens': real_tokens,
+             'padded_tokens': padded_tokens,
+             'seconds': seconds,
+             'tokens_per_s': real_tokens / seconds if seconds > 0 else 0.0,
+             'documents_per_s': len(dataset) / seconds if seconds > 0 else 0.0}
+    return pooled.cpu().numpy(), logits.cpu().numpy(), stats
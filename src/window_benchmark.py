@@ -0,0 +1,58 @@
+import os
+import argparse
+
+import pandas as pd
+import torch
+from transformers import AutoTokenizer
+
+from utils.corpus import load_corpus
+from utils.dataset import TokenCache
+from utils.inference import load_classifier
+from utils.windows import POOLING_METHODS, WindowedDataset, encode_documents
+
+classes = ["Dismissing", "Secure", "Preoccupied"]
+
+# Parse arguments
+parser = argparse.ArgumentParser(description="Classify whole transcripts with sliding windows and report tokens/s for every window length and overlap")
+parser.add_argument("--checkpoint", type=str, default=None, help="Checkpoint of a model trained on windowed documents (default: the base model, for timing only)")
+parser.add_argument("--model_id", type=str, default="roberta-base", help="Base model of the checkpoint")
+parser.add_argument("--data", type=str, default="/home/unicph.domain/wqs493/ucph/securegroupdir/SAMF-SODAS-PACS/Data/val_PACS", help="Corpus artifact of patient turns with a document column")
+parser.add_argument("--max_lens", type=int, nargs="+", default=[128, 256, 512], help="Window lengths in tokens, special tokens included")
+parser.add_argument("--overlaps", type=int, nargs="+", default=[0, 64, 128], help="Tokens shared by consecutive windows")
+parser.add_argument("--pooling", type=str, default="mean", choices=POOLING_METHODS, help="How window states are pooled per document")
+parser.add_argument("--max_tokens", type=int, default=16384, help="Padded token budget of a batch of windows")
+parser.add_argument("--bf16", action="store_true", help="Run under bf16 autocast")
+parser.add_argument("--output", type=str, default="Outputs/benchmarks", help="Folder for the results")
+args = parser.parse_args()
+
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+os.makedirs(args.output, exist_ok=True)
+
+# Load data and model
+data = load_corpus(args.data, columns=["text", "label", "document"])
+data["label"] = data["label"].astype(int) - 1 # Convert labels to 0, 1, 2
+tokenizer = AutoTokenizer.from_pretrained(args.model_id)
+model = load_classifier(args.model_id, args.checkpoint, num_labels=len(classes), id2label=dict(enumerate(classes))).to(device)
+cache = TokenCache() # The token streams are tokenized once and shared by all configurations
+
+# Encode the documents with every window length and overlap
+results = []
+for max_len in args.max_lens:
+    for overlap in args.overlaps:
+        if overlap >= max_len - 2:
+            continue
+        dataset = WindowedDataset(data, tokenizer, max_len, overlap=overlap, cache=cache)
+        _, logits, stats = encode_documents(model, dataset, device, max_tokens=args.max_tokens, pooling=args.pooling, bf16=args.bf16)
+        stats.update({"max_len": max_len, "overlap": overlap, "stride": dataset.stride,
+                      "accuracy": float((logits.argmax(axis=1) == dataset.targets.numpy()).mean())})
+        results.append(stats)
+        print(f"max_len {max_len}, overlap {overlap}: {stats['windows']} windows, {stats['tokens_per_s']:.0f} tokens/s, {stats['documents_per_s']:.2f} documents/s")
+
+# Save and print results
+results = pd.DataFrame(results)[["max_len", "overlap", "stride", "documents", "windows", "tokens", "padded_tokens",
+                                 "seconds", "tokens_per_s", "documents_per_s", "accuracy"]]
+model_name = os.path.splitext(os.path.basename(args.checkpoint))[0] if args.checkpoint else args.model_id.replace("/", "_")
+results_path = os.path.join(args.output, f"windows_{model_name}.csv")
+results.to_csv(results_path, index=False)
+print(results.to_string(index=False))
+print(f"Saved {results_path}")